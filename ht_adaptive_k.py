@@ -0,0 +1,28 @@
+import logging
+
+REL_TO_BEST = 0.5
+GAP_RATIO   = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+def adaptive_k(scores, min_k, max_k, rel=REL_TO_BEST, gap=GAP_RATIO, floor=0.0) -> int:
+    # scores are best-first and higher is better (BM25 score or 1/(1+L2))
+    scores = list(scores)[:max_k]
+    if not scores or scores[0] <= floor:
+        return min(min_k, len(scores))
+    best = scores[0]
+    k = 1
+    for prev, s in zip(scores, scores[1:]):
+        # stop below the relative threshold or at the first drop that is large compared to the best hit
+        if s <= floor or s < rel * best or prev - s > gap * best:
+            break
+        k += 1
+    return max(min(min_k, len(scores)), k)
+
+
+def cut_results(results, min_k, max_k, rel=REL_TO_BEST, gap=GAP_RATIO, floor=0.0, label=""):
+    k = adaptive_k([r["sim"] for r in results], min_k, max_k, rel, gap, floor)
+    if k < len(results):
+        logger.info(f"Adaptive depth{' for ' + label if label else ''}: kept {k}/{len(results)}")
+    return results[:k]
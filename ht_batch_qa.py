@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import logging
+import argparse
+import itertools
+import importlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+BATCH_WORKERS    = 4
+QUEUE_PER_WORKER = 2
+DEFAULT_MODE     = "hybrid"
+
+MODES = {
+    "regular":  "ht_regular_offline_rag",
+    "semantic": "ht_semantic_offline_rag",
+    "hybrid":   "ht_hybrid_offline_rag",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path: str) -> list[dict]:
+    # one JSON object per line with "query" (or "question") and an optional "id"; bare strings also work
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"query": item}
+            query = item.get("query") or item.get("question")
+            if not query:
+                logger.warning(f"Line {n} of {path} has no query, skipping")
+                continue
+            questions.append({"id": str(item.get("id", n)), "query": query})
+    return questions
+
+
+def load_done(path: str) -> set[str]:
+    # ids that already have a record, failed ones included; a line cut off by an interruption is ignored
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done.add(rec["id"])
+    return done
+
+
+def drop_errors(path: str) -> int:
+    # removes failed records so their questions run again without leaving two records per id
+    if not os.path.exists(path):
+        return 0
+    kept, dropped = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" in rec:
+                dropped += 1
+            else:
+                kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp, path)
+    return dropped
+
+
+def answer_one(mod, res, mode, item) -> dict:
+    trace = {}
+    t0 = time.perf_counter()
+    try:
+        answer, _, _ = mod.answer_query(item["query"], res, trace=trace)
+    except Exception as e:
+        logger.exception(f"Question {item['id']} failed")
+        return dict(item, mode=mode, error=str(e), timings={"total_s": time.perf_counter() - t0})
+    return dict(
+        item,
+        mode=mode,
+        answer=answer,
+        keywords=trace.get("keywords", []),
+        contexts=trace.get("contexts", []),
+        llm=trace.get("llm", {}),
+        timings=dict(trace.get("timings", {}), total_s=time.perf_counter() - t0),
+    )
+
+
+def run_batch(in_path, out_path, mode=DEFAULT_MODE, workers=BATCH_WORKERS, ollama_urls=None, retry_errors=False):
+    mod = importlib.import_module(MODES[mode])
+    if ollama_urls:
+        mod.OLLAMA_API_URLS = list(ollama_urls)
+    questions = read_questions(in_path)
+    if retry_errors:
+        logger.info(f"Retrying {drop_errors(out_path)} failed questions")
+    done = load_done(out_path)
+    todo = [q for q in questions if q["id"] not in done]
+    logger.info(f"{len(questions)} questions, {len(done)} already answered, {len(todo)} to go")
+    if not todo:
+        return 0
+
+    res = mod.load_resources()
+    if os.path.exists(out_path) and os.path.getsize(out_path):
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            partial = f.read(1) != b"\n"
+    else:
+        partial = False
+
+    n_ok, n_done = 0, 0
+    pending = iter(todo)
+    with open(out_path, "a", encoding="utf-8") as out:
+        if partial:
+            out.write("\n")
+
+        def write(rec):
+            nonlocal n_ok, n_done
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            n_ok += "error" not in rec
+            n_done += 1
+            if n_done % 50 == 0 or n_done == len(todo):
+                logger.info(f"{n_done}/{len(todo)} questions processed")
+
+        # only a few questions per worker are queued, so an interruption waits for those and not the whole file
+        ex = ThreadPoolExecutor(workers)
+        inflight = {ex.submit(answer_one, mod, res, mode, q)
+                    for q in itertools.islice(pending, workers * QUEUE_PER_WORKER)}
+        try:
+            while inflight:
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    inflight.discard(fut)
+                    write(fut.result())
+                    q = next(pending, None)
+                    if q is not None:
+                        inflight.add(ex.submit(answer_one, mod, res, mode, q))
+        finally:
+            ex.shutdown(cancel_futures=True)
+            # answers that were already running still get written
+            for fut in inflight:
+                if not fut.cancelled() and fut.exception() is None:
+                    write(fut.result())
+    return n_ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the offline RAG pipelines")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--mode", choices=sorted(MODES), default=DEFAULT_MODE)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--ollama-url", action="append", help="Ollama base URL (repeat for several)")
+    parser.add_argument("--retry-errors", action="store_true", help="answer questions whose earlier attempt failed again")
+    args = parser.parse_args()
+    try:
+        n = run_batch(args.input, args.output, args.mode, args.workers, args.ollama_url, args.retry_errors)
+    except KeyboardInterrupt:
+        logger.warning(f"Interrupted, rerun to continue with the unanswered questions in {args.output}")
+    else:
+        logger.info(f"Answered {n} questions, results in {args.output}")
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+BENCH_DIR         = "benchmarks"
+BENCH_SIZES       = (100, 1000, 5000)
+BENCH_REPEAT      = 5
+BENCH_QUERIES     = 20
+BENCH_SEED        = 13
+DOC_WORDS         = 200
+PROMPT_CONTEXTS   = 30
+E2E_MODES         = ("regular", "semantic", "hybrid")
+E2E_DOCS          = 200
+E2E_QUERIES       = 5
+E2E_LATENCY       = 0.05
+E2E_TOKEN_LATENCY = 0.002
+REGRESSION_RATIO  = 1.2
+
+MODES = {
+    "regular":  "ht_regular_offline_rag",
+    "semantic": "ht_semantic_offline_rag",
+    "hybrid":   "ht_hybrid_offline_rag",
+}
+
+# ordered roughly by frequency, sampled with Zipf-like weights so BM25 sees realistic idf spread
+WORDS = [
+    "ve", "bir", "bu", "için", "ile", "olarak", "daha", "çok", "en", "gibi",
+    "devlet", "şehir", "tarih", "yıl", "halk", "kanun", "meclis", "ekonomi", "savaş", "anlaşma",
+    "cumhuriyet", "başkent", "nüfus", "nehir", "dağ", "deniz", "ticaret", "liman", "üniversite", "okul",
+    "öğrenci", "öğretmen", "kitap", "yazar", "şiir", "roman", "müzik", "sanat", "mimari", "cami",
+    "saray", "köprü", "demiryolu", "fabrika", "tarım", "buğday", "pamuk", "zeytin", "çay", "fındık",
+    "iklim", "yağmur", "kar", "orman", "göl", "ada", "boğaz", "kıta", "sınır", "bölge",
+    "ankara", "istanbul", "izmir", "bursa", "trabzon", "konya", "erzurum", "antalya", "edirne", "kayseri",
+    "osmanlı", "selçuklu", "bizans", "anadolu", "karadeniz", "akdeniz", "ege", "marmara", "dicle", "fırat",
+    "kuruldu", "ilan", "edildi", "yapıldı", "bulunur", "sahiptir", "önemlidir", "bilinir", "yer", "alır",
+]
+QUESTION_TEMPLATES = [
+    "{a} ve {b} arasındaki ilişki nedir?",
+    "{a} hangi yıl {b} oldu?",
+    "{a} nerede bulunur?",
+    "{a} ile {b} hakkında ne biliniyor?",
+    "{a} neden {b} için önemlidir?",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_corpus(n_docs, words_per_doc=DOC_WORDS, seed=BENCH_SEED):
+    rng = random.Random(seed)
+    weights = [1.0 / (i + 1) for i in range(len(WORDS))]
+    docs, fnames = [], []
+    for d in range(n_docs):
+        words = rng.choices(WORDS, weights, k=words_per_doc)
+        sentences, i = [], 0
+        while i < len(words):
+            n = rng.randint(8, 15)
+            sentences.append(" ".join(words[i:i + n]).capitalize() + ".")
+            i += n
+        docs.append(" ".join(sentences))
+        fnames.append(f"belge_{d:05d}.txt")
+    return docs, fnames
+
+
+def synthetic_queries(n, seed=BENCH_SEED):
+    rng = random.Random(seed + 1)
+    content = WORDS[10:]
+    return [rng.choice(QUESTION_TEMPLATES).format(a=rng.choice(content), b=rng.choice(content))
+            for _ in range(n)]
+
+
+def measure(fn, repeat=BENCH_REPEAT, ops=1, warmup=True) -> dict:
+    if warmup:
+        fn()  # warm caches and lazy imports outside the timed runs
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000 / ops)
+    return {
+        "ops": ops, "repeat": repeat,
+        "min_ms": min(runs), "median_ms": statistics.median(runs), "mean_ms": statistics.fmean(runs),
+    }
+
+
+def flat_index(vectors):
+    import faiss
+    import numpy as np
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+
+def write_corpus(work_dir, docs, fnames, dim):
+    # lays out what the three scripts read: txt files, a FAISS index and its metadata pickle
+    import pickle
+    import faiss
+    from ht_mock_ollama import fake_embedding
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    for doc, fname in zip(docs, fnames):
+        with open(os.path.join(data_dir, fname), "w", encoding="utf-8") as f:
+            f.write(doc)
+    faiss.write_index(flat_index([fake_embedding(d, dim) for d in docs]), os.path.join(work_dir, "index.bin"))
+    with open(os.path.join(work_dir, "documents.pkl"), "wb") as f:
+        pickle.dump({"documents": docs, "file_names": fnames}, f)
+    return data_dir
+
+
+def point_module_at(mod, work_dir, data_dir, ollama_url):
+    mod.DATA_DIR = data_dir
+    mod.INDEX_PATH = os.path.join(work_dir, "index.bin")
+    mod.META_PATH = os.path.join(work_dir, "documents.pkl")
+    mod.HISTORY_DIR = os.path.join(work_dir, "history")
+    mod.INDEX_CACHE_DIR = os.path.join(work_dir, "index_cache")
+    mod.OLLAMA_API_URLS = [ollama_url]
+
+
+def bench_micro(sizes, repeat, n_queries, dim):
+    import numpy as np
+    import tiktoken
+    from ht_mock_ollama import fake_embedding, start_mock_server
+    from ht_prompt_builder import dedup_contexts, trim_prompt
+    from ht_embeddings_save import create_faiss_index
+    import ht_regular_offline_rag as reg
+    import ht_semantic_offline_rag as sem
+
+    results = []
+    queries = synthetic_queries(n_queries)
+    enc = tiktoken.get_encoding(reg.ENCODING_NAME)
+    server, url = start_mock_server(dim=dim)
+    try:
+        for size in sizes:
+            docs, fnames = synthetic_corpus(size)
+            logger.info(f"Benchmarking {size} documents")
+
+            def add(name, stats):
+                results.append({"name": name, "size": size, **stats})
+                logger.info(f"{name:<20} n={size:<6} median {stats['median_ms']:.3f} ms")
+
+            add("build_bm25_index", measure(lambda: reg.build_bm25_index(docs), repeat))
+            bm25 = reg.build_bm25_index(docs)
+            add("retrieve_bm25", measure(
+                lambda: [reg.retrieve_bm25(q, bm25, docs, fnames, reg.MAIN_BM25_K_MAX) for q in queries],
+                repeat, len(queries)))
+
+            index = flat_index([fake_embedding(d, dim) for d in docs])
+            q_embs = [np.asarray(fake_embedding(q, dim), dtype=np.float32) for q in queries]
+            add("retrieve_semantic", measure(
+                lambda: [sem.retrieve_semantic(e, index, docs, fnames, sem.MAIN_SEM_K_MAX) for e in q_embs],
+                repeat, len(q_embs)))
+
+            lists = [reg.retrieve_bm25(q, bm25, docs, fnames, reg.KW_BM25_K_MAX) for q in queries]
+            add("dedup_contexts", measure(lambda: dedup_contexts(*lists), repeat))
+
+            contexts = [{"id": i, "text": docs[i], "file_name": fnames[i], "sim": 1.0 / (i + 1)}
+                        for i in range(min(size, PROMPT_CONTEXTS))]
+            add("trim_prompt", measure(
+                lambda: trim_prompt(queries[0], contexts, enc, reg.MAX_CONTEXT_TOKENS, by_sim=True), repeat))
+
+            with tempfile.TemporaryDirectory() as tmp:
+                data_dir = write_corpus(tmp, docs, fnames, dim)
+                # one HTTP embedding call per document against the mock, so a single run is enough
+                add("create_faiss_index", measure(
+                    lambda: create_faiss_index(data_dir, "bench", f"{url}/v1/embeddings",
+                                               os.path.join(tmp, "out.bin"), os.path.join(tmp, "out.pkl")),
+                    1, warmup=False))
+    finally:
+        server.shutdown()
+    return results
+
+
+def bench_end_to_end(modes, n_docs, n_queries, latency, token_latency, dim):
+    import importlib
+    from ht_mock_ollama import start_mock_server
+
+    results = []
+    docs, fnames = synthetic_corpus(n_docs)
+    queries = synthetic_queries(n_queries)
+    server, url = start_mock_server(latency=latency, token_latency=token_latency, dim=dim)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = write_corpus(tmp, docs, fnames, dim)
+            for mode in modes:
+                mod = importlib.import_module(MODES[mode])
+                point_module_at(mod, tmp, data_dir, url)
+                t0 = time.perf_counter()
+                res = mod.load_resources()
+                load_ms = (time.perf_counter() - t0) * 1000
+                runs, calls, tokens = [], 0, 0
+                for q in queries:
+                    trace = {}
+                    t0 = time.perf_counter()
+                    mod.answer_query(q, res, None, trace)
+                    runs.append((time.perf_counter() - t0) * 1000)
+                    calls += trace["llm"]["calls"]
+                    tokens += trace["llm"]["prompt_tokens"] + trace["llm"]["completion_tokens"]
+                results.append({
+                    "name": f"e2e_{mode}", "size": n_docs, "ops": 1, "repeat": len(runs),
+                    "min_ms": min(runs), "median_ms": statistics.median(runs), "mean_ms": statistics.fmean(runs),
+                    "load_ms": load_ms, "llm_calls_per_query": calls / len(runs),
+                    "tokens_per_query": tokens / len(runs),
+                    "latency_s": latency, "token_latency_s": token_latency,
+                })
+                logger.info(f"e2e_{mode:<16} n={n_docs:<6} median {statistics.median(runs):.1f} ms, "
+                            f"{calls / len(runs):.1f} LLM calls/query")
+    finally:
+        server.shutdown()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def save_results(results, params, out_dir=BENCH_DIR) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def compare(baseline_path, results, threshold=REGRESSION_RATIO) -> int:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"{'benchmark':<20} {'size':>6} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    for r in results:
+        old = baseline.get((r["name"], r["size"]))
+        if old is None or not old["median_ms"]:
+            continue
+        ratio = r["median_ms"] / old["median_ms"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['name']:<20} {r['size']:>6} {old['median_ms']:>10.3f} {r['median_ms']:>10.3f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    from ht_mock_ollama import EMBED_DIM
+    parser = argparse.ArgumentParser(description="Micro and end-to-end benchmarks for the offline RAG pipelines")
+    parser.add_argument("--sizes", default=",".join(map(str, BENCH_SIZES)), help="comma separated corpus sizes")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    parser.add_argument("--queries", type=int, default=BENCH_QUERIES)
+    parser.add_argument("--dim", type=int, default=EMBED_DIM)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--e2e-modes", default=",".join(E2E_MODES))
+    parser.add_argument("--e2e-docs", type=int, default=E2E_DOCS)
+    parser.add_argument("--e2e-queries", type=int, default=E2E_QUERIES)
+    parser.add_argument("--latency", type=float, default=E2E_LATENCY, help="mock seconds per request")
+    parser.add_argument("--token-latency", type=float, default=E2E_TOKEN_LATENCY, help="mock seconds per streamed token")
+    parser.add_argument("--out", default=BENCH_DIR)
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args()
+
+    results = []
+    if not args.skip_micro:
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        results += bench_micro(sizes, args.repeat, args.queries, args.dim)
+    if not args.skip_e2e:
+        modes = [m.strip() for m in args.e2e_modes.split(",") if m.strip()]
+        results += bench_end_to_end(modes, args.e2e_docs, args.e2e_queries,
+                                    args.latency, args.token_latency, args.dim)
+    path = save_results(results, vars(args), args.out)
+    logger.info(f"Results written to {path}")
+    if args.compare:
+        sys.exit(1 if compare(args.compare, results, args.threshold) else 0)
@@ -0,0 +1,55 @@
+import logging
+import threading
+import tiktoken
+
+SESSION_MAX_TOKENS = 4000
+ENCODING_NAME      = "cl100k_base"
+NUM_CTX_MARGIN     = 256
+KEEP_ALIVE         = "30m"
+
+logger = logging.getLogger(__name__)
+
+
+def context_options(max_input_tokens, max_response_tokens, history_tokens=0) -> dict:
+    # Ollama's default num_ctx (2048) silently truncates longer prompts; the margin covers the chat template
+    return {"num_ctx": max_input_tokens + history_tokens + max_response_tokens + NUM_CTX_MARGIN}
+
+
+class ChatSession:
+    # Turns are replayed exactly as they were sent, so each follow-up shares the whole
+    # previous conversation as a prefix and Ollama only has to prefill the new turn.
+    # max_tokens is the history budget (system prompt included) on top of the pipeline's
+    # MAX_CONTEXT_TOKENS: trim_prompt fills that budget, so the history cannot share it.
+    def __init__(self, system: str, max_tokens=SESSION_MAX_TOKENS, encoding=ENCODING_NAME):
+        self.system = system
+        self.max_tokens = max_tokens
+        self.enc = tiktoken.get_encoding(encoding)
+        self.system_tokens = self.count_tokens(system)
+        self.turns = []
+        self.lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.enc.encode(text))
+
+    def messages(self, user: str) -> list[dict]:
+        budget = self.max_tokens - self.system_tokens
+        with self.lock:
+            while self.turns and sum(n for _, _, n in self.turns) > budget:
+                # dropping the oldest turn breaks the cached prefix once, not on every call
+                self.turns.pop(0)
+                logger.info(f"Session history over {max(budget, 0)} tokens, dropped oldest turn")
+            msgs = [{"role": "system", "content": self.system}]
+            for u, a, _ in self.turns:
+                msgs.append({"role": "user", "content": u})
+                msgs.append({"role": "assistant", "content": a})
+            msgs.append({"role": "user", "content": user})
+            return msgs
+
+    def add(self, user: str, answer: str):
+        n = self.count_tokens(user) + self.count_tokens(answer)
+        with self.lock:
+            self.turns.append((user, answer, n))
+
+    def reset(self):
+        with self.lock:
+            self.turns = []
@@ -0,0 +1,33 @@
+import time
+import logging
+
+# an optional stage only starts while elapsed < cutoff * budget; the rest is kept for generation
+STAGE_CUTOFFS = {
+    "extra_lists":       0.25,
+    "keyword_retrieval": 0.40,
+    "filter":            0.70,
+    "compress":          0.80,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    def __init__(self, budget=None, cutoffs=STAGE_CUTOFFS):
+        self.budget = budget
+        self.cutoffs = cutoffs
+        self.start = time.monotonic()
+        self.skipped = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def allows(self, stage) -> bool:
+        if self.budget is None:
+            return True
+        if self.elapsed() < self.cutoffs[stage] * self.budget:
+            return True
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+            logger.warning(f"Deadline: skipping {stage} after {self.elapsed():.1f}s of {self.budget:.0f}s budget")
+        return False
@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import argparse
+import importlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DOC2QUERY_PATH         = "doc2query.jsonl"
+DOC2QUERY_VECTORS_PATH = "doc2query_vectors.npz"
+DOC2QUERY_QUESTIONS    = 5
+DOC2QUERY_WORKERS      = 4
+DOC2QUERY_MAX_CHARS    = 6000
+DOC2QUERY_EMBED_BATCH  = 64
+DOC2QUERY_MIN_COVERAGE = 0.9
+SEARCH_OVERSAMPLE      = 4
+DEFAULT_MODE           = "hybrid"
+
+QUESTION_INSTRUCTION = "Sen bir Türkçe soru üretme asistanısın. Çıktını yalnızca JSON dizi formatında ver."
+
+MODES = {
+    "regular":  "ht_regular_offline_rag",
+    "semantic": "ht_semantic_offline_rag",
+    "hybrid":   "ht_hybrid_offline_rag",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_key(text: str) -> str:
+    # keyed by content, so the questions survive re-ordering or re-indexing of the corpus
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def parse_questions(raw: str) -> list[str]:
+    cleaned = re.sub(r"```(?:\w+)?\s*", "", raw).replace("```", "").strip()
+    m = re.search(r"\[.*\]", cleaned, flags=re.DOTALL)
+    try:
+        arr = json.loads(m.group(0) if m else cleaned)
+        questions = [q.strip() for q in arr if isinstance(q, str)]
+    except json.JSONDecodeError:
+        questions = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in cleaned.splitlines()]
+    return [q for q in questions if q]
+
+
+def generate_questions(mod, text, n=DOC2QUERY_QUESTIONS) -> list[str]:
+    from ht_llm_client import PRIORITY_EXTRACT, get_client
+    user = (
+        f"Aşağıdaki metni okuyan birinin sorabileceği {n} farklı Türkçe soru yaz. "
+        "Sorular yalnızca metindeki bilgilerle cevaplanabilmeli.\n\n"
+        f"Metin:\n{text[:DOC2QUERY_MAX_CHARS]}"
+    )
+    payload = {
+        "model": mod.CHAT_MODEL,
+        "messages": [
+            {"role": "system", "content": QUESTION_INSTRUCTION},
+            {"role": "user",   "content": user}
+        ],
+        "temperature": 0.3,
+        "max_tokens": 60 * n,
+    }
+    raw = get_client(mod.OLLAMA_API_URLS).chat_content(payload, PRIORITY_EXTRACT)
+    return parse_questions(raw)[:n]
+
+
+def load_doc2query(path=DOC2QUERY_PATH) -> dict:
+    # chunk key -> questions; a line cut off by an interruption is ignored
+    questions = {}
+    if not os.path.exists(path):
+        return questions
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            questions[rec["key"]] = rec["questions"]
+    return questions
+
+
+def expand_docs(docs, questions) -> list[str]:
+    # BM25 representation: the chunk followed by the questions it answers
+    if not questions:
+        return docs
+    return [doc + "\n" + "\n".join(questions.get(chunk_key(doc), [])) for doc in docs]
+
+
+def run_generation(mod, docs, fnames, out_path=DOC2QUERY_PATH, n=DOC2QUERY_QUESTIONS, workers=DOC2QUERY_WORKERS):
+    done = load_doc2query(out_path)
+    todo = [(chunk_key(d), d, f) for d, f in zip(docs, fnames)]
+    todo = [t for t in dict((t[0], t) for t in todo).values() if t[0] not in done]
+    logger.info(f"{len(docs)} chunks, {len(done)} already have questions, {len(todo)} to go")
+    if not todo:
+        return 0
+
+    partial = False
+    if os.path.exists(out_path) and os.path.getsize(out_path):
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            partial = f.read(1) != b"\n"
+
+    n_ok = 0
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(workers) as ex:
+        if partial:
+            out.write("\n")
+        futures = {ex.submit(generate_questions, mod, text, n): (key, fname) for key, text, fname in todo}
+        for i, fut in enumerate(as_completed(futures), 1):
+            key, fname = futures[fut]
+            try:
+                questions = fut.result()
+            except Exception:
+                # not written, so the next run retries it
+                logger.exception(f"Question generation failed for {fname}")
+                continue
+            out.write(json.dumps({"key": key, "file_name": fname, "questions": questions}, ensure_ascii=False) + "\n")
+            out.flush()
+            n_ok += 1
+            if i % 50 == 0 or i == len(todo):
+                logger.info(f"{i}/{len(todo)} chunks processed")
+    return n_ok
+
+
+def embed_questions(mod, questions, out_path=DOC2QUERY_VECTORS_PATH, batch=DOC2QUERY_EMBED_BATCH):
+    keys, texts = [], []
+    for key, qs in questions.items():
+        for q in qs:
+            keys.append(key)
+            texts.append(q)
+    vecs = [mod.embed_batch(texts[i:i + batch]) for i in range(0, len(texts), batch)]
+    vectors = np.vstack(vecs).astype(np.float32) if vecs else np.zeros((0, 0), dtype=np.float32)
+    tmp = out_path + ".tmp.npz"
+    np.savez(tmp, vectors=vectors, keys=np.array(keys))
+    os.replace(tmp, out_path)
+    logger.info(f"Embedded {len(texts)} questions into {out_path}")
+    return len(texts)
+
+
+class ChunkIndex:
+    # FAISS index with extra question vectors appended; search hits are mapped back to their chunk
+    def __init__(self, index, owners, n_chunks):
+        self.index = index
+        self.owners = np.asarray(owners, dtype=np.int64)
+        self.n_chunks = n_chunks
+
+    def search(self, x, k):
+        D, I = self.index.search(x, k * SEARCH_OVERSAMPLE)
+        out_D = np.full((len(x), k), np.inf, dtype=np.float32)
+        out_I = np.full((len(x), k), -1, dtype=np.int64)
+        for row in range(len(x)):
+            seen, j = set(), 0
+            for dist, idx in zip(D[row], I[row]):
+                if idx < 0:
+                    continue
+                chunk = int(self.owners[idx])
+                if chunk in seen:
+                    continue
+                seen.add(chunk)
+                out_D[row, j], out_I[row, j] = dist, chunk
+                j += 1
+                if j == k:
+                    break
+        return out_D, out_I
+
+    def __getattr__(self, name):
+        # reconstruct_batch etc. work unchanged, chunk vectors keep their original ids
+        return getattr(self.index, name)
+
+
+def attach_question_vectors(index, docs, path=DOC2QUERY_VECTORS_PATH):
+    if not os.path.exists(path):
+        return index
+    import faiss
+    data = np.load(path)
+    pos = {chunk_key(d): i for i, d in enumerate(docs)}
+    keep = [i for i, k in enumerate(data["keys"]) if str(k) in pos]
+    if not keep:
+        return index
+    n_chunks = index.ntotal
+    # the caller's index may be cached or shared, so the questions go into a copy
+    index = faiss.clone_index(index)
+    index.add(data["vectors"][keep])
+    owners = np.concatenate([np.arange(n_chunks), [pos[str(data["keys"][i])] for i in keep]])
+    logger.info(f"Added {len(keep)} doc2query vectors to the index ({n_chunks} chunks)")
+    return ChunkIndex(index, owners, n_chunks)
+
+
+def question_coverage(docs, questions=None, index=None) -> float:
+    # share of chunks with generated questions in the BM25 text or the FAISS index
+    covered = set()
+    if questions:
+        covered.update(i for i, d in enumerate(docs) if questions.get(chunk_key(d)))
+    if isinstance(index, ChunkIndex):
+        covered.update(index.owners[index.n_chunks:].tolist())
+    return len(covered) / len(docs) if docs else 0.0
+
+
+def covers_corpus(docs, questions=None, index=None, min_coverage=DOC2QUERY_MIN_COVERAGE) -> bool:
+    # keyword retrieval may only be dropped when nearly every chunk can be found through its questions
+    coverage = question_coverage(docs, questions, index)
+    if coverage:
+        logger.info(f"doc2query covers {coverage:.0%} of {len(docs)} chunks")
+    return coverage >= min_coverage
+
+
+def load_chunks(mod):
+    if hasattr(mod, "load_index_and_metadata"):
+        _, docs, fnames = mod.load_index_and_metadata()
+        return docs, fnames
+    return mod.load_corpus_from_dir()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Generate likely questions per chunk for retrieval (doc2query)")
+    parser.add_argument("--mode", choices=sorted(MODES), default=DEFAULT_MODE,
+                        help="pipeline whose corpus, chat and embedding models are used")
+    parser.add_argument("--out", default=DOC2QUERY_PATH)
+    parser.add_argument("--questions", type=int, default=DOC2QUERY_QUESTIONS, help="questions per chunk")
+    parser.add_argument("--workers", type=int, default=DOC2QUERY_WORKERS)
+    parser.add_argument("--ollama-url", action="append", help="Ollama base URL (repeat for several)")
+    parser.add_argument("--embed", action="store_true", help="also embed the questions as extra FAISS vectors")
+    parser.add_argument("--vectors", default=DOC2QUERY_VECTORS_PATH)
+    args = parser.parse_args()
+
+    mod = importlib.import_module(MODES[args.mode])
+    if args.ollama_url:
+        mod.OLLAMA_API_URLS = list(args.ollama_url)
+    docs, fnames = load_chunks(mod)
+    n = run_generation(mod, docs, fnames, args.out, args.questions, args.workers)
+    logger.info(f"Generated questions for {n} chunks, results in {args.out}")
+    if args.embed:
+        if not hasattr(mod, "embed_batch"):
+            parser.error(f"--embed needs an embedding model, {args.mode} has none")
+        embed_questions(mod, load_doc2query(args.out), args.vectors)
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from ht_metrics import add_llm_usage, capture_llm_usage, current_query_stats
+
+BATCH_WINDOW      = 0.003
+MAX_BATCH         = 64
+MAX_INFLIGHT      = 2
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    # collects embed() calls from concurrent queries into one /v1/embeddings request
+    def __init__(self, embed_fn, window=BATCH_WINDOW, max_batch=MAX_BATCH, max_inflight=MAX_INFLIGHT):
+        self.embed_fn = embed_fn
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = {}
+        self.inflight = {}
+        # text -> stats of the queries waiting for it; the request runs on our threads, outside their context
+        self.owners = {}
+        self.cond = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_inflight, thread_name_prefix="embed-batch")
+        self.thread = None
+        self.stats = {"requests": 0, "coalesced": 0, "batches": 0}
+
+    def _ensure_started(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True, name="embed-batcher")
+            self.thread.start()
+
+    def submit(self, text: str) -> Future:
+        stats = current_query_stats()
+        with self.cond:
+            self._ensure_started()
+            self.stats["requests"] += 1
+            if stats is not None:
+                self.owners.setdefault(text, []).append(stats)
+            fut = self.inflight.get(text)
+            if fut is not None:
+                self.stats["coalesced"] += 1
+                return fut
+            fut = Future()
+            self.pending[text] = fut
+            self.inflight[text] = fut
+            self.cond.notify()
+            return fut
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result().copy()
+
+    def embed_many(self, texts: list[str]) -> np.ndarray:
+        futs = [self.submit(t) for t in texts]
+        if not futs:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([f.result() for f in futs])
+
+    def _take_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            texts = list(self.pending)[:self.max_batch]
+            return [(t, self.pending.pop(t)) for t in texts]
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            self.executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        texts = [t for t, _ in batch]
+        error = None
+        with capture_llm_usage() as usage:
+            try:
+                embs = np.asarray(self.embed_fn(texts), dtype=np.float32)
+                if len(embs) != len(texts):
+                    raise ValueError(f"Expected {len(texts)} embeddings, got {len(embs)}")
+            except Exception as e:
+                error = e
+        with self.cond:
+            owners = [self.owners.pop(t, []) for t in texts]
+            for t in texts:
+                self.inflight.pop(t, None)
+            self.stats["batches"] += 1
+        # before the futures resolve, so a query's stats are complete when its embed() returns
+        self._attribute(owners, usage)
+        for i, (_, fut) in enumerate(batch):
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(embs[i])
+        logger.debug(f"Embedded batch of {len(texts)} texts")
+
+    def _attribute(self, owners, usage):
+        # every query waiting on the request gets the call and its share of the tokens by text count
+        shares = {}
+        for text_owners in owners:
+            for stats in text_owners:
+                shares.setdefault(id(stats), [stats, 0])[1] += 1
+        for stats, n in shares.values():
+            add_llm_usage(
+                stats,
+                usage["calls"],
+                round(usage["prompt_tokens"] * n / len(owners)),
+                round(usage["completion_tokens"] * n / len(owners)),
+            )
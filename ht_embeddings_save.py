@@ -4,8 +4,12 @@ import numpy as np
 import requests
 import pickle
 import logging
+import argparse
+from ht_profiling import add_profiling_args, apply_profiling_args, profile_section
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+LOG_LEVEL = logging.INFO
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 def embed_text_with_azure_openai(text, api_key, endpoint):
@@ -45,32 +49,37 @@ def load_documents_from_folder(folder_path):
 
 
 def create_faiss_index(folder_path, api_key, endpoint, output_index_path="faiss_index.bin", output_docs_path="documents.pkl"):
-    documents, file_names = load_documents_from_folder(folder_path)
+    with profile_section("load_documents"):
+        documents, file_names = load_documents_from_folder(folder_path)
     if not documents:
         logging.error("No documents found in the specified folder.")
         return
     embeddings = []
-    for idx, doc in enumerate(documents):
-        logging.info(f"Processing document {idx + 1}/{len(documents)}: {file_names[idx]}")
-        try:
-            embedding = embed_text_with_azure_openai(doc, api_key, endpoint)
-            embeddings.append(embedding)
-            logging.debug(f"Embedding for document {file_names[idx]}: {embedding[:5]}...")
-        except Exception as e:
-            logging.error(f"Skipping document {file_names[idx]} due to error: {e}")
-            continue
+    with profile_section("embed_documents"):
+        for idx, doc in enumerate(documents):
+            logging.info(f"Processing document {idx + 1}/{len(documents)}: {file_names[idx]}")
+            try:
+                embedding = embed_text_with_azure_openai(doc, api_key, endpoint)
+                embeddings.append(embedding)
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Embedding for document {file_names[idx]}: {embedding[:5]}...")
+            except Exception as e:
+                logging.error(f"Skipping document {file_names[idx]} due to error: {e}")
+                continue
     if not embeddings:
         logging.error("No embeddings were generated. Exiting.")
         return
-    embeddings = np.array(embeddings, dtype=np.float32)
-    embedding_dim = embeddings.shape[1]
-    faiss_index = faiss.IndexFlatL2(embedding_dim)
-    faiss_index.add(embeddings)
+    with profile_section("build_index"):
+        embeddings = np.array(embeddings, dtype=np.float32)
+        embedding_dim = embeddings.shape[1]
+        faiss_index = faiss.IndexFlatL2(embedding_dim)
+        faiss_index.add(embeddings)
     logging.info(f"FAISS index created with {len(embeddings)} embeddings.")
     try:
-        faiss.write_index(faiss_index, output_index_path)
-        with open(output_docs_path, "wb") as f:
-            pickle.dump({"documents": documents, "file_names": file_names}, f)
+        with profile_section("save_index"):
+            faiss.write_index(faiss_index, output_index_path)
+            with open(output_docs_path, "wb") as f:
+                pickle.dump({"documents": documents, "file_names": file_names}, f)
         logging.info(f"FAISS index saved to '{output_index_path}'.")
         logging.info(f"Document metadata saved to '{output_docs_path}'.")
     except Exception as e:
@@ -78,6 +87,9 @@ def create_faiss_index(folder_path, api_key, endpoint, output_index_path="faiss_
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed a folder of documents into a FAISS index")
+    add_profiling_args(parser)
+    apply_profiling_args(parser.parse_args())
     api_key = "xx"
     endpoint = "xx"
     folder_path = r"xx"
@@ -0,0 +1,31 @@
+import logging
+import numpy as np
+
+FUSION_K = 60
+
+logger = logging.getLogger(__name__)
+
+
+def reciprocal_rank_fusion(result_lists, weights=None, k=FUSION_K, top_n=None, key="file_name"):
+    # every list is ranked best-first; a doc scores sum(w_list / (k + rank))
+    slot, first = {}, []
+    cols, list_ids, ranks = [], [], []
+    for li, results in enumerate(result_lists):
+        for rank, ctx in enumerate(results, 1):
+            j = slot.get(ctx[key])
+            if j is None:
+                j = slot[ctx[key]] = len(first)
+                first.append(ctx)
+            cols.append(j)
+            list_ids.append(li)
+            ranks.append(rank)
+    if not first:
+        return []
+    w = np.ones(len(result_lists)) if weights is None else np.asarray(weights, dtype=np.float64)
+    contrib = w[np.asarray(list_ids)] / (k + np.asarray(ranks, dtype=np.float64))
+    scores = np.zeros(len(first))
+    np.add.at(scores, np.asarray(cols), contrib)
+    order = np.argsort(-scores, kind="stable")[:top_n]
+    fused = [dict(first[j], sim=float(scores[j])) for j in order]
+    logger.info(f"Fused {len(ranks)} hits from {len(result_lists)} lists into {len(fused)} candidates")
+    return fused
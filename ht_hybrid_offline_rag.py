@@ -2,35 +2,94 @@ import os
 import re
 import json
 import logging
+import argparse
 import faiss
 import pickle
-import requests
 import numpy as np
 import tiktoken
-from datetime import datetime
 from rank_bm25 import BM25Okapi
+from ht_phrase_index import build_positional_index, retrieve_phrase
+from ht_turkish_text import Analyzer, analyze, corpus_vocabulary, lemmas, turkish_lower, word_pairs
+from ht_typo_corrector import build_typo_index, correct_query
+from ht_query_expansion import expand_query, load_expansion_table
+from ht_fusion import reciprocal_rank_fusion
+from ht_mmr import mmr_contexts
+from ht_passage_compressor import compress_contexts
+from ht_embed_batcher import EmbeddingBatcher
+from ht_index_cache import corpus_key, load_or_build
+from ht_doc2query import attach_question_vectors, covers_corpus, expand_docs, load_doc2query
+from ht_query_log import get_query_log
+from ht_metrics import query_timer, stage, start_metrics_dump
+from ht_profiling import add_profiling_args, apply_profiling_args, profile_section
+from ht_deadline import Deadline
+from ht_adaptive_k import cut_results
+from ht_prompt_builder import trim_prompt
+from ht_speculative import SpeculativeAnswer
+from ht_chat_session import KEEP_ALIVE, ChatSession, context_options
+from ht_streaming import TokenPrinter, stream_chat_completion
+from ht_llm_client import (
+    PRIORITY_ANSWER, PRIORITY_EMBED, PRIORITY_EXTRACT, PRIORITY_FILTER, get_client
+)
 
 OLLAMA_API_URL       = "http://localhost:xxx"
+OLLAMA_API_URLS      = [OLLAMA_API_URL]
 EMBED_MODEL          = "mxbai-embed-large"
+EMBED_BATCH_WINDOW   = 0.003
+EMBED_MAX_BATCH      = 64
 CHAT_MODEL           = "gemma3:4b-it-q8_0"
 INDEX_PATH           = "xxx.bin"
 META_PATH            = "documents.pkl"
 HISTORY_DIR          = r"xxx"
-MAIN_SEM_K           = 3
-MAIN_BM25_K          = 3
-KW_SEM_K             = 2
-KW_BM25_K            = 2
+MAIN_SEM_K_MIN       = 1
+MAIN_SEM_K_MAX       = 5
+MAIN_BM25_K_MIN      = 1
+MAIN_BM25_K_MAX      = 5
+KW_SEM_K_MIN         = 0
+KW_SEM_K_MAX         = 3
+KW_BM25_K_MIN        = 0
+KW_BM25_K_MAX        = 3
+KW_MIN_SIM_REL       = 0.8
+KW_MIN_BM25          = 1.0
+PHRASE_K             = 3
+PHRASE_SLOP          = 1
+FUSION_K             = 60
+FUSION_TOP_N         = 8
+MAIN_FUSION_WEIGHT   = 1.0
+KW_FUSION_WEIGHT     = 0.5
+PHRASE_FUSION_WEIGHT = 1.0
+USE_MMR              = True
+MMR_TOP_N            = 5
+MMR_LAMBDA           = 0.7
+COMPRESS_CONTEXTS    = True
 MAX_KEYWORDS         = 10
 MAX_CONTEXT_TOKENS   = 4000
 ENCODING_NAME        = "cl100k_base"
 TEMPERATURE          = 0.2
 TOP_P                = 0.95
+USE_LLM_LEMMAS       = False
+USE_LLM_TYPOS        = False
+USE_LLM_KEYWORDS     = False
+EXPANSION_TABLE_PATH = "query_expansion_hybrid.json.gz"
 MAX_RESPONSE_TOKENS  = 2000
+STREAM_ANSWERS       = True
+QUERY_BUDGET         = 60.0
+SPECULATIVE_ANSWERS  = False
+SPECULATIVE_TOP_N    = 3
+LOG_LEVEL            = logging.INFO
+INDEX_CACHE_DIR      = "index_cache"
+DOC2QUERY_PATH       = "doc2query.jsonl"
+DOC2QUERY_VECTORS    = "doc2query_vectors.npz"
+DOC2QUERY_SKIP_KWS   = True
 
 RESPONSE_INSTRUCTION = (
     "Yukarıdaki belgeler ile bu soruyu cevapla!"
     "Sonra hangi belgede bu cevabı bulduğunu kısaca belirt."
 )
+EXTRACT_INSTRUCTION = "Sen bir Türkçe anahtar kelime çıkarma asistanısın. Çıktın JSON dizi formatında olsun."
+FILTER_INSTRUCTION = (
+    "Sen bir Türkçe soru-cevap asistanısın. "
+    "Aşağıdaki belgeyle soruyu cevaplayabilir misin? 'Evet' veya 'Hayır' ile yanıtla."
+)
 
 QUESTION_STOP = {
     "nedir","ne","kim","kimler","nerede","nerde",
@@ -38,7 +97,7 @@ QUESTION_STOP = {
     "nerden","nereden","niye"
 }
 
-logging.basicConfig(level=logging.DEBUG,
+logging.basicConfig(level=LOG_LEVEL,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -55,42 +114,56 @@ def load_index_and_metadata():
     logger.info(f"Index vectors: {index.ntotal}, metadata docs: {len(meta['documents'])}")
     return index, meta["documents"], meta["file_names"]
 
-def build_bm25_index(docs):
-    tokenized = [
-        re.findall(r"[A-Za-zÇĞİÖŞÜçğıöşü]+", doc.lower())
-        for doc in docs
-    ]
+def build_bm25_index(docs, analyzer=None):
+    tokenized = [analyze(doc, analyzer) for doc in docs]
     bm25 = BM25Okapi(tokenized)
     logger.info("Built BM25 index")
     return bm25
 
 def embed(text: str) -> np.ndarray:
-    payload = {"model": EMBED_MODEL, "input": [text]}
-    logger.debug(f"Embedding payload: {json.dumps(payload, ensure_ascii=False)}")
-    resp = requests.post(f"{OLLAMA_API_URL}/v1/embeddings", json=payload)
-    resp.raise_for_status()
-    emb = np.array(resp.json()["data"][0]["embedding"], dtype=np.float32)
-    logger.debug(f"Received embedding (dim={emb.shape[0]}) preview={emb[:5]}")
+    with stage("embed"):
+        emb = embed_batcher.embed(text)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received embedding (dim={emb.shape[0]}) preview={emb[:5]}")
     return emb
 
+def embed_batch(texts: list[str]) -> np.ndarray:
+    payload = {"model": EMBED_MODEL, "input": texts}
+    resp = get_client(OLLAMA_API_URLS).embeddings(payload, PRIORITY_EMBED)
+    data = sorted(resp["data"], key=lambda d: d["index"])
+    logger.debug(f"Received {len(data)} embeddings")
+    return np.array([d["embedding"] for d in data], dtype=np.float32)
+
+
+embed_batcher = EmbeddingBatcher(embed_batch, EMBED_BATCH_WINDOW, EMBED_MAX_BATCH)
+
+
+def embed_many(texts: list[str]) -> np.ndarray:
+    with stage("embed"):
+        return embed_batcher.embed_many(texts)
+
 def retrieve_semantic(query_emb, index, docs, fnames, k):
-    D, I = index.search(query_emb.reshape(1, -1), k)
+    with stage("faiss"):
+        D, I = index.search(query_emb.reshape(1, -1), k)
     out = []
     for dist, idx in zip(D[0], I[0]):
+        if idx < 0:
+            continue
         sim = 1.0 / (1.0 + dist)
-        out.append({"text": docs[idx], "file_name": fnames[idx], "sim": sim, "type": "semantic"})
+        out.append({"id": int(idx), "text": docs[idx], "file_name": fnames[idx], "sim": sim, "type": "semantic"})
         logger.info(f"Semantic: {fnames[idx]} dist={dist:.4f} sim={sim:.4f}")
     return out
 
-def retrieve_bm25(query, bm25, docs, fnames, k):
-    tokens = re.findall(r"[A-Za-zÇĞİÖŞÜçğıöşü]+", query.lower())
+def retrieve_bm25(query, bm25, docs, fnames, k, analyzer=None):
+    tokens = analyze(query, analyzer)
     logger.debug(f"BM25 query tokens: {tokens}")
-    scores = bm25.get_scores(tokens)
+    with stage("bm25"):
+        scores = bm25.get_scores(tokens)
     idxs = np.argsort(scores)[::-1][:k]
     out = []
     for idx in idxs:
         sim = float(scores[idx])
-        out.append({"text": docs[idx], "file_name": fnames[idx], "sim": sim, "type": "bm25"})
+        out.append({"id": int(idx), "text": docs[idx], "file_name": fnames[idx], "sim": sim, "type": "bm25"})
         logger.info(f"BM25: {fnames[idx]} score={sim:.4f}")
     return out
 
@@ -102,12 +175,12 @@ def call_llm_for_list(prompt_system: str, prompt_user: str) -> list[str]:
             {"role": "user",   "content": prompt_user}
         ],
         "temperature": TEMPERATURE,
-        "max_tokens": 200
+        "max_tokens": 200,
+        "keep_alive": KEEP_ALIVE
     }
-    logger.debug("LLM list‐call payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
-    r = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=payload)
-    r.raise_for_status()
-    raw = r.json()["choices"][0]["message"]["content"]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM list‐call payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
+    raw = get_client(OLLAMA_API_URLS).chat_content(payload, PRIORITY_EXTRACT)
     logger.debug(f"LLM raw list response:\n{raw!r}")
 
     cleaned = re.sub(r"```(?:\w+)?\s*", "", raw).replace("```", "").strip()
@@ -116,31 +189,29 @@ def call_llm_for_list(prompt_system: str, prompt_user: str) -> list[str]:
 
     try:
         arr = json.loads(arr_text)
-        kws = [w.strip().lower() for w in arr if isinstance(w, str)]
+        kws = [turkish_lower(w.strip()) for w in arr if isinstance(w, str)]
         logger.debug(f"Parsed JSON list: {kws}")
         return kws
     except json.JSONDecodeError:
         logger.warning("JSON parse failed; falling back to regex")
         quotes = re.findall(r'"([^"]+)"', cleaned)
         if quotes:
-            kws = [w.strip().lower() for w in quotes]
+            kws = [turkish_lower(w.strip()) for w in quotes]
             logger.debug(f"Regex‐quoted fallback: {kws}")
             return kws
         words = re.findall(r"[A-Za-zÇĞİÖŞÜçğıöşü]+(?: [A-Za-zÇĞİÖŞÜçğıöşü]+)*", cleaned)
-        kws = [w.lower() for w in words]
+        kws = [turkish_lower(w) for w in words]
         logger.debug(f"Regex‐word fallback: {kws}")
         return kws
 
 
 def extract_keywords(query: str) -> list[str]:
-    system = (
-        "Sen bir Türkçe anahtar kelime çıkarma asistanısın. "
+    user = (
         "Bu soruya cevap vermek için hangi kelimeler aranmalı? "
         "Kesinlikle soru-ekleri (nedir, nasıl, kim, ne, hangi…) olmasın. "
-        "Cevabını yalnızca JSON dizi formatında ver."
+        f"Soru: \"{query}\""
     )
-    user = f"Soru: \"{query}\""
-    kws = call_llm_for_list(system, user)
+    kws = call_llm_for_list(EXTRACT_INSTRUCTION, user)
     # filter stop-words
     filtered = [kw for kw in kws if kw not in QUESTION_STOP]
     trimmed = filtered[:MAX_KEYWORDS]
@@ -148,8 +219,8 @@ def extract_keywords(query: str) -> list[str]:
     return trimmed
 
 
-def extract_additional_lists(query: str) -> dict:
-    base_sys = "Sen bir Türkçe anahtar kelime çıkarma asistanısın. Çıktın JSON dizi formatında olsun."
+def extract_additional_lists(query: str, tindex=None, use_llm=True, analyzer=None) -> dict:
+    base_sys = EXTRACT_INSTRUCTION
     prompts = {
         "subject":   f"Bu sorunun öznesi kim veya ne? Soru: \"{query}\"",
         "predicate": f"Bu sorunun yüklemi ne? Soru: \"{query}\"",
@@ -168,6 +239,13 @@ def extract_additional_lists(query: str) -> dict:
         )
 
     }
+    if not use_llm or not USE_LLM_LEMMAS:
+        prompts.pop("lemmas")
+    if tindex is not None and (not use_llm or not USE_LLM_TYPOS):
+        prompts.pop("typos")
+    if not use_llm:
+        for key in ("subject", "predicate", "names", "multiword"):
+            prompts.pop(key)
     result = {}
     for key, user_p in prompts.items():
         logger.debug(f"Extracting {key} with prompt: {user_p}")
@@ -175,95 +253,270 @@ def extract_additional_lists(query: str) -> dict:
         lst = [w for w in lst if w not in QUESTION_STOP]
         result[key] = lst[:MAX_KEYWORDS]
         logger.info(f"{key.capitalize()} extracted: {result[key]}")
+    if "lemmas" not in result:
+        result["lemmas"] = lemmas(query, QUESTION_STOP, analyzer)[:MAX_KEYWORDS]
+        logger.info(f"Lemmas (local stemmer): {result['lemmas']}")
+    if "typos" not in result:
+        result["typos"] = correct_query(query, tindex, QUESTION_STOP, analyzer)[:MAX_KEYWORDS] if tindex else []
+    if "multiword" not in result:
+        result["multiword"] = word_pairs(query, QUESTION_STOP)[:MAX_KEYWORDS]
+        logger.info(f"Multiword (query word pairs): {result['multiword']}")
+    for key in ("subject", "predicate", "names"):
+        result.setdefault(key, [])
     return result
 
 
-def chat_with_all(query, sem_main, bm25_main, sem_kws, bm25_kws):
-    enc = tiktoken.get_encoding(ENCODING_NAME)
-    contexts = sem_main + bm25_main + sem_kws + bm25_kws
-    seen = set()
-    unique = []
-    for c in contexts:
-        if c["file_name"] not in seen:
-            unique.append(c)
-            seen.add(c["file_name"])
-    contexts = unique
-    logger.info(f"{len(contexts)} contexts after deduplication")
-    filtered = []
-    filter_sys = (
-        "Sen bir Türkçe soru-cevap asistanısın. "
-        "Aşağıdaki belgeyle soruyu cevaplayabilir misin? 'Evet' veya 'Hayır' ile yanıtla."
-    )
-    for ctx in contexts:
+def collect_keywords(query, tindex=None, xtable=None, deadline=None, analyzer=None, local_only=False):
+    # local_only: no LLM calls and no expansion keywords, just typos, lemmas and word pairs
+    main_kws = []
+    if xtable is not None and not USE_LLM_KEYWORDS and not local_only:
+        main_kws = expand_query(query, xtable, QUESTION_STOP, MAX_KEYWORDS, analyzer)
+    if main_kws or local_only:
+        extras = extract_additional_lists(query, tindex, use_llm=False, analyzer=analyzer)
+    else:
+        main_kws = extract_keywords(query)
+        use_llm = deadline is None or deadline.allows("extra_lists")
+        extras = extract_additional_lists(query, tindex, use_llm, analyzer)
+    logger.info(f"Main keywords: {main_kws}")
+    logger.info(f"Subjects: {extras['subject']}")
+    logger.info(f"Predicates: {extras['predicate']}")
+    logger.info(f"Names: {extras['names']}")
+    logger.info(f"Multiword: {extras['multiword']}")
+    logger.info(f"Typos: {extras['typos']}")
+    logger.info(f"Lemmas: {extras['lemmas']}")
+    all_kws = main_kws \
+              + extras['subject'] + extras['predicate'] \
+              + extras['names'] + extras['multiword'] \
+              + extras['typos'] + extras['lemmas']
+    all_kws = list(dict.fromkeys(all_kws))
+    logger.info(f"All retrieval keywords ({len(all_kws)}): {all_kws}")
+    return all_kws, extras
+
+
+def retrieve_fused(query, all_kws, phrases, index, bm25, pindex, docs, fnames,
+                   top_n=FUSION_TOP_N, q_emb=None, deadline=None, analyzer=None):
+    deadline = deadline or Deadline()
+    lists, weights = [], []
+    with stage("phrase"):
+        for phrase in phrases:
+            lists.append(retrieve_phrase(phrase, pindex, docs, fnames, PHRASE_K, PHRASE_SLOP, analyzer))
+            weights.append(PHRASE_FUSION_WEIGHT)
+    if q_emb is None:
+        q_emb = embed(query)
+    main_sem = cut_results(retrieve_semantic(q_emb, index, docs, fnames, MAIN_SEM_K_MAX),
+                           MAIN_SEM_K_MIN, MAIN_SEM_K_MAX, label="query")
+    main_bm25 = cut_results(retrieve_bm25(query, bm25, docs, fnames, MAIN_BM25_K_MAX, analyzer),
+                            MAIN_BM25_K_MIN, MAIN_BM25_K_MAX, label="query")
+    lists += [main_sem, main_bm25]
+    # a keyword is only worth its contexts if it matches nearly as well as the question itself
+    sem_floor = KW_MIN_SIM_REL * main_sem[0]["sim"] if main_sem else 0.0
+    weights += [MAIN_FUSION_WEIGHT, MAIN_FUSION_WEIGHT]
+    for kw in all_kws:
+        if not deadline.allows("keyword_retrieval"):
+            break
+        lists.append(cut_results(retrieve_semantic(embed(kw), index, docs, fnames, KW_SEM_K_MAX),
+                                 KW_SEM_K_MIN, KW_SEM_K_MAX, floor=sem_floor, label=kw))
+        lists.append(cut_results(retrieve_bm25(kw, bm25, docs, fnames, KW_BM25_K_MAX, analyzer),
+                                 KW_BM25_K_MIN, KW_BM25_K_MAX, floor=KW_MIN_BM25, label=kw))
+        weights += [KW_FUSION_WEIGHT, KW_FUSION_WEIGHT]
+    with stage("fusion"):
+        fused = reciprocal_rank_fusion(lists, weights, FUSION_K, top_n)
+    # lets the deadline path tell the main-query hits from keyword and phrase ones
+    main_names = {c["file_name"] for c in main_sem + main_bm25}
+    for c in fused:
+        c["main"] = c["file_name"] in main_names
+    if USE_MMR and fused:
+        # keep the fused ranking as relevance, MMR only adds the redundancy penalty
+        best = fused[0]["sim"]
+        with stage("mmr"):
+            fused = mmr_contexts(q_emb, fused, index, MMR_TOP_N, MMR_LAMBDA,
+                                 [c["sim"] / best for c in fused])
+    return fused
+
+
+def generate_answer(query, contexts, keywords, enc, deadline, query_emb=None, session=None, on_token=None, cancel=None,
+                    analyzer=None):
+    if COMPRESS_CONTEXTS and deadline.allows("compress"):
+        with stage("compress"):
+            contexts = compress_contexts(contexts, query, keywords, query_emb, embed_many, analyzer)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, ctx in enumerate(contexts, 1):
+            logger.debug(f"belge{i} (sim={ctx['sim']:.4f}): {ctx['text'][:100]}…")
+    prompt, contexts = trim_prompt(query, contexts, enc, MAX_CONTEXT_TOKENS, by_sim=True)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Full chat prompt:\n{prompt}")
+
+    final_payload = {
+        "model":      CHAT_MODEL,
+        "messages":   session.messages(prompt) if session is not None else [
+            {"role": "system", "content": RESPONSE_INSTRUCTION},
+            {"role": "user",   "content": prompt}
+        ],
+        "temperature": TEMPERATURE,
+        "top_p":       TOP_P,
+        "max_tokens":  MAX_RESPONSE_TOKENS,
+        "keep_alive":  KEEP_ALIVE,
+        "options":     context_options(MAX_CONTEXT_TOKENS, MAX_RESPONSE_TOKENS,
+                                       session.max_tokens if session is not None else 0)
+    }
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Final chat payload:\n" + json.dumps(final_payload, ensure_ascii=False, indent=2))
+    with stage("generate"):
+        if on_token is not None or cancel is not None:
+            answer = stream_chat_completion(OLLAMA_API_URLS, final_payload, on_token, cancel=cancel)
+        else:
+            answer = get_client(OLLAMA_API_URLS).chat_content(final_payload, PRIORITY_ANSWER)
+    logger.debug(f"Final answer len={len(answer)}")
+    return answer, final_payload, prompt, contexts
+
+
+def filter_contexts(query, contexts, deadline):
+    filtered, verdicts, unchecked = [], [], []
+    for i, ctx in enumerate(contexts):
+        if not deadline.allows("filter"):
+            unchecked = contexts[i:]
+            break
         payload = {
             "model": CHAT_MODEL,
             "messages": [
-                {"role": "system", "content": filter_sys},
-                {"role": "user",   "content": f"Belge:\n{ctx['text']}\n\nSoru: \"{query}\""}
+                {"role": "system", "content": FILTER_INSTRUCTION},
+                {"role": "user",   "content": f"Soru: \"{query}\"\n\nBelge:\n{ctx['text']}"}
             ],
             "temperature": 0.0,
-            "max_tokens": 3
+            "max_tokens": 3,
+            "keep_alive": KEEP_ALIVE
         }
-        r = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=payload)
-        r.raise_for_status()
-        ans = r.json()["choices"][0]["message"]["content"].strip().lower()
+        with stage("filter"):
+            ans = get_client(OLLAMA_API_URLS).chat_content(payload, PRIORITY_FILTER).strip().lower()
+        verdicts.append({"id": ctx["id"], "file_name": ctx["file_name"], "verdict": ans})
         if ans.startswith("evet"):
             filtered.append(ctx)
             logger.info(f"Kept {ctx['file_name']} (Evet)")
         else:
             logger.info(f"Dropped {ctx['file_name']} (Hayır)")
+    return filtered, verdicts, unchecked
+
+
+def chat_with_all(query, contexts, keywords=(), query_emb=None, on_token=None, trace=None, session=None, deadline=None,
+                  analyzer=None):
+    deadline = deadline or Deadline()
+    enc = tiktoken.get_encoding(ENCODING_NAME)
+    logger.info(f"{len(contexts)} fused candidate contexts")
+    spec = None
+    if SPECULATIVE_ANSWERS and contexts:
+        # the top hits usually survive the filter, so start answering on them right away
+        spec_ctx = contexts[:SPECULATIVE_TOP_N]
+        spec = SpeculativeAnswer(spec_ctx, lambda tok, cancel: generate_answer(
+            query, spec_ctx, keywords, enc, deadline, query_emb, session, tok, cancel, analyzer))
+    try:
+        filtered, verdicts, unchecked = filter_contexts(query, contexts, deadline)
+    except BaseException:
+        # a failed filter call must not leave the speculative answer generating
+        if spec is not None:
+            spec.abort()
+        raise
+    if unchecked:
+        # out of time: trust the main-query hits that were not checked yet
+        filtered += [c for c in unchecked if c.get("main")]
+        logger.warning(f"Deadline: {len(unchecked)} contexts not filtered, kept the main-query ones")
     if not filtered:
-        logger.warning("All contexts dropped; falling back to top-5 by similarity")
-        contexts.sort(key=lambda c: c["sim"], reverse=True)
+        # contexts are already in fused (and MMR) order; re-sorting by sim would mix score scales
+        logger.warning("All contexts dropped; falling back to the top-5 fused contexts")
         filtered = contexts[:5]
+    result = spec.commit(on_token) if spec is not None and spec.matches(filtered) else None
+    if result is None:
+        if spec is not None:
+            spec.abort()
+        result = generate_answer(query, filtered, keywords, enc, deadline, query_emb, session, on_token,
+                                 analyzer=analyzer)
+    answer, final_payload, prompt, filtered = result
+    if trace is not None:
+        trace["retrieved"] = [v["id"] for v in verdicts]
+        trace["verdicts"] = verdicts
+        trace["contexts"] = [{"id": c["id"], "file_name": c["file_name"], "sim": float(c["sim"])}
+                             for c in filtered]
+        if spec is not None:
+            trace["speculative"] = spec.outcome
+    if session is not None:
+        session.add(prompt, answer)
+    return answer, final_payload, prompt
 
-    sections = []
-    for i, ctx in enumerate(filtered, 1):
-        sections.append(f"{'*'*5} start of belge {i} {'*'*5}")
-        sections.append(ctx["text"])
-        sections.append(f"{'*'*5} end of belge {i} {'*'*5}")
-        logger.debug(f"belge{i} (sim={ctx['sim']:.4f}): {ctx['text'][:100]}…")
-
-    prompt = "\n\n".join(sections) + f"\n\nsoru: \"{query}\"\n" + RESPONSE_INSTRUCTION
-    logger.debug(f"Full chat prompt:\n{prompt}")
-
-    toks = enc.encode(prompt)
-    if len(toks) > MAX_CONTEXT_TOKENS:
-        logger.info(f"Prompt {len(toks)} tokens > {MAX_CONTEXT_TOKENS}, trimming...")
-        filtered.sort(key=lambda c: c["sim"], reverse=True)
-        while len(enc.encode(prompt)) > MAX_CONTEXT_TOKENS and filtered:
-            dropped = filtered.pop()
-            logger.debug(f"Dropped low‐sim belge '{dropped['file_name']}'")
-            secs = []
-            for j, c in enumerate(filtered, 1):
-                secs.append(f"{'*'*5} start of belge {j} {'*'*5}")
-                secs.append(c["text"])
-                secs.append(f"{'*'*5} end of belge {j} {'*'*5}")
-            prompt = "\n\n".join(secs) + f"\n\nsoru: \"{query}\"\n" + RESPONSE_INSTRUCTION
-        logger.info(f"Trimmed to {len(filtered)} contexts")
 
-    final_payload = {
-        "model":      CHAT_MODEL,
-        "messages": [
-            {"role": "system", "content": RESPONSE_INSTRUCTION},
-            {"role": "user",   "content": prompt}
-        ],
-        "temperature": TEMPERATURE,
-        "top_p":       TOP_P,
-        "max_tokens":  MAX_RESPONSE_TOKENS
+def load_resources():
+    with profile_section("load_index"):
+        index, docs, fnames = load_index_and_metadata()
+    key = corpus_key(docs)
+    with profile_section("load_vocabulary"):
+        analyzer = Analyzer(load_or_build("hybrid_vocab", docs, corpus_vocabulary, INDEX_CACHE_DIR, key))
+    with profile_section("load_doc2query"):
+        d2q = load_doc2query(DOC2QUERY_PATH)
+        bm25_docs = expand_docs(docs, d2q)
+        index = attach_question_vectors(index, docs, DOC2QUERY_VECTORS)
+    with profile_section("build_bm25"):
+        bm25 = load_or_build("hybrid_bm25", bm25_docs, lambda d: build_bm25_index(d, analyzer),
+                             INDEX_CACHE_DIR, corpus_key(bm25_docs) if d2q else key)
+    with profile_section("build_phrase_index"):
+        pindex = load_or_build("hybrid_phrase", docs, lambda d: build_positional_index(d, analyzer),
+                               INDEX_CACHE_DIR, key)
+    with profile_section("build_typo_index"):
+        tindex = load_or_build("hybrid_typo", docs, lambda d: build_typo_index(d, analyzer=analyzer),
+                               INDEX_CACHE_DIR, key)
+    with profile_section("load_expansion_table"):
+        xtable = load_expansion_table(EXPANSION_TABLE_PATH)
+    return {
+        "index":    index,
+        "docs":     docs,
+        "fnames":   fnames,
+        "analyzer": analyzer,
+        "bm25":     bm25,
+        "pindex":   pindex,
+        "tindex":   tindex,
+        "xtable":   xtable,
+        "doc2query": covers_corpus(docs, d2q, index),
     }
-    logger.debug("Final chat payload:\n" + json.dumps(final_payload, ensure_ascii=False, indent=2))
-    res = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=final_payload)
-    res.raise_for_status()
-    answer = res.json()["choices"][0]["message"]["content"]
-    logger.debug(f"Final answer len={len(answer)}")
-    return answer, final_payload, prompt
+
+
+def answer_query(query, res, on_token=None, trace=None, session=None):
+    deadline = Deadline(QUERY_BUDGET)
+    with query_timer("hybrid") as stats:
+        with stage("keywords"):
+            # generated questions already cover the wording, so only the cheap local lists are added
+            all_kws, extras = collect_keywords(query, res["tindex"], res["xtable"], deadline, res["analyzer"],
+                                               local_only=res["doc2query"] and DOC2QUERY_SKIP_KWS)
+        q_emb    = embed(query)
+        contexts = retrieve_fused(
+            query, all_kws, extras['multiword'], res["index"], res["bm25"], res["pindex"],
+            res["docs"], res["fnames"], q_emb=q_emb, deadline=deadline, analyzer=res["analyzer"]
+        )
+        result = chat_with_all(query, contexts, all_kws, q_emb, on_token, trace, session, deadline,
+                               res["analyzer"])
+    if trace is not None:
+        trace["keywords"] = all_kws
+        trace["budget_s"] = QUERY_BUDGET
+        trace["skipped"] = deadline.skipped
+        trace.update(stats)
+    return result
+
+
+def save_history(query, prompt, payload, answer, trace=None):
+    record = {"mode": "hybrid", "query": query, "model": payload["model"]}
+    record.update(trace or {})
+    record.update(prompt=prompt, answer=answer)
+    get_query_log(HISTORY_DIR).log(record)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Hybrid offline RAG REPL")
+    parser.add_argument("--session", action="store_true", help="keep follow-up questions in one conversation")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    apply_profiling_args(args)
     ensure_history_dir()
-    index, docs, fnames = load_index_and_metadata()
-    bm25 = build_bm25_index(docs)
+    start_metrics_dump(os.path.join(HISTORY_DIR, "metrics.prom"))
+    res = load_resources()
+
+    session = ChatSession(RESPONSE_INSTRUCTION, encoding=ENCODING_NAME) if args.session else None
 
     print("RAG ready.")
     while True:
@@ -271,42 +524,21 @@ def main():
         if query.lower() in ("exit", "quit"):
             print("bye")
             break
+        if query.lower() == "/yeni" and session is not None:
+            session.reset()
+            print("Yeni sohbet başlatıldı.")
+            continue
 
         try:
-            main_kws = extract_keywords(query)
-            logger.info(f"Main keywords: {main_kws}")
-            extras = extract_additional_lists(query)
-            logger.info(f"Subjects: {extras['subject']}")
-            logger.info(f"Predicates: {extras['predicate']}")
-            logger.info(f"Names: {extras['names']}")
-            logger.info(f"Multiword: {extras['multiword']}")
-            logger.info(f"Typos: {extras['typos']}")
-            logger.info(f"Lemmas: {extras['lemmas']}")
-            all_kws = main_kws \
-                      + extras['subject'] + extras['predicate'] \
-                      + extras['names'] + extras['multiword'] \
-                      + extras['typos'] + extras['lemmas']
-            all_kws = list(dict.fromkeys(all_kws))
-            logger.info(f"All retrieval keywords ({len(all_kws)}): {all_kws}")
-            q_emb     = embed(query)
-            sem_main  = retrieve_semantic(q_emb, index, docs, fnames, MAIN_SEM_K)
-            bm25_main = retrieve_bm25(query, bm25, docs, fnames, MAIN_BM25_K)
-            sem_kws, bm25_kws = [], []
-            for kw in all_kws:
-                sem_kws.extend(retrieve_semantic(embed(kw), index, docs, fnames, KW_SEM_K))
-                bm25_kws.extend(retrieve_bm25(kw, bm25, docs, fnames, KW_BM25_K))
-            answer, payload, prompt = chat_with_all(
-                query, sem_main, bm25_main, sem_kws, bm25_kws
-            )
-            print("gem:", answer)
-            ts   = datetime.now().strftime("%Y%m%d_%H%M%S")
-            path = os.path.join(HISTORY_DIR, f"{ts}.txt")
-            with open(path, "w", encoding="utf-8") as hf:
-                hf.write(f"Soru: {query}\n\n")
-                hf.write("Prompt:\n" + prompt + "\n\n")
-                hf.write("Payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
-                hf.write("\n\nCevap:\n" + answer)
-            logger.info(f"Wrote QA to {path}")
+            printer = TokenPrinter("gem: ") if STREAM_ANSWERS else None
+            trace = {}
+            with profile_section("query"):
+                answer, payload, prompt = answer_query(query, res, printer, trace, session)
+            if printer is not None:
+                printer.finish()
+            else:
+                print("gem:", answer)
+            save_history(query, prompt, payload, answer, trace)
 
         except Exception:
             logger.exception("Error in main loop")
@@ -0,0 +1,39 @@
+import os
+import pickle
+import hashlib
+import logging
+
+INDEX_CACHE_DIR = "index_cache"
+CACHE_VERSION   = 2
+
+logger = logging.getLogger(__name__)
+
+
+def corpus_key(docs) -> str:
+    h = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for doc in docs:
+        h.update(doc.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def load_or_build(name, docs, build_fn, cache_dir=INDEX_CACHE_DIR, key=None):
+    # rebuilds whenever the corpus (or CACHE_VERSION) changes
+    key = key or corpus_key(docs)
+    path = os.path.join(cache_dir, f"{name}.pkl")
+    if os.path.isfile(path):
+        try:
+            with open(path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("key") == key:
+                logger.info(f"Loaded cached {name} from {path}")
+                return cached["value"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            logger.warning(f"Ignoring unreadable cache {path}")
+    value = build_fn(docs)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"key": key, "value": value}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return value
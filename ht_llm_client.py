@@ -0,0 +1,296 @@
+import json
+import time
+import heapq
+import random
+import logging
+import threading
+import itertools
+import requests
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from ht_metrics import record_llm_call
+
+CONNECT_TIMEOUT   = 5.0
+READ_TIMEOUT      = 300.0
+MAX_RETRIES       = 3
+BACKOFF_BASE      = 0.5
+BACKOFF_MAX       = 8.0
+MAX_CONCURRENCY   = 4
+POOL_SIZE         = 16
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN  = 30.0
+HEALTH_INTERVAL   = 10.0
+HEALTH_TIMEOUT    = 2.0
+
+# lower value = served first when all slots are busy
+PRIORITY_ANSWER  = 0
+PRIORITY_EMBED   = 1
+PRIORITY_FILTER  = 2
+PRIORITY_EXTRACT = 3
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(RuntimeError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self.lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_running:
+                return False
+            # half-open: let a single trial request through
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(f"Circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+
+class PriorityGate:
+    def __init__(self, slots=MAX_CONCURRENCY):
+        self.free = slots
+        self.waiting = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, priority):
+        ticket = (priority, next(self.counter))
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+            while self.free == 0 or self.waiting[0] != ticket:
+                self.cond.wait()
+            heapq.heappop(self.waiting)
+            self.free -= 1
+            self.cond.notify_all()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.free += 1
+                self.cond.notify_all()
+
+
+def iter_sse_deltas(resp, usage=None):
+    resp.encoding = "utf-8"
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if usage is not None and chunk.get("usage"):
+            usage.update(chunk["usage"])
+        if not chunk.get("choices"):
+            continue
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+class LLMClient:
+    def __init__(self, base_url, max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.gate = PriorityGate(max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.healthy = True
+        self.outstanding = 0
+        self.count_lock = threading.Lock()
+
+    @contextmanager
+    def _tracked(self):
+        with self.count_lock:
+            self.outstanding += 1
+        try:
+            yield
+        finally:
+            with self.count_lock:
+                self.outstanding -= 1
+
+    @property
+    def available(self):
+        return self.healthy and not self.breaker.is_open
+
+    def check_health(self) -> bool:
+        try:
+            resp = self.session.get(f"{self.base_url}/api/tags", timeout=HEALTH_TIMEOUT)
+            ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok != self.healthy:
+            logger.warning(f"Endpoint {self.base_url} is now {'healthy' if ok else 'unhealthy'}")
+        self.healthy = ok
+        if ok and self.breaker.is_open:
+            self.breaker.record_success()
+        return ok
+
+    def _backoff(self, attempt):
+        # full jitter
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def _post(self, path, payload, stream=False):
+        last_exc = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.base_url} is unavailable (circuit open)")
+            try:
+                resp = self.session.post(f"{self.base_url}{path}", json=payload,
+                                         timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure()
+                last_exc = e
+                logger.warning(f"POST {path} failed ({e.__class__.__name__}), attempt {attempt + 1}")
+            else:
+                if resp.status_code not in RETRY_STATUS:
+                    self.breaker.record_success()
+                    resp.raise_for_status()
+                    return resp
+                self.breaker.record_failure()
+                last_exc = requests.HTTPError(f"{resp.status_code} from {path}", response=resp)
+                logger.warning(f"POST {path} returned {resp.status_code}, attempt {attempt + 1}")
+                resp.close()
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt))
+        raise last_exc
+
+    def post_json(self, path, payload, priority=PRIORITY_ANSWER) -> dict:
+        with self._tracked(), self.gate.slot(priority):
+            data = self._post(path, payload).json()
+        record_llm_call(path.rsplit("/", 1)[-1], self.base_url, data.get("usage"))
+        return data
+
+    def chat(self, payload, priority=PRIORITY_ANSWER) -> dict:
+        return self.post_json("/v1/chat/completions", payload, priority)
+
+    def chat_content(self, payload, priority=PRIORITY_ANSWER) -> str:
+        return self.chat(payload, priority)["choices"][0]["message"]["content"]
+
+    def embeddings(self, payload, priority=PRIORITY_EMBED) -> dict:
+        return self.post_json("/v1/embeddings", payload, priority)
+
+    def stream_chat(self, payload, on_token=None, priority=PRIORITY_ANSWER, cancel=None) -> str:
+        parts, usage = [], {}
+        stream_payload = dict(payload, stream=True, stream_options={"include_usage": True})
+        with self._tracked(), self.gate.slot(priority):
+            with self._post("/v1/chat/completions", stream_payload, stream=True) as resp:
+                for delta in iter_sse_deltas(resp, usage):
+                    # closing the connection makes Ollama stop generating
+                    if cancel is not None and cancel.is_set():
+                        break
+                    parts.append(delta)
+                    if on_token is not None:
+                        on_token(delta)
+        record_llm_call("completions", self.base_url, usage)
+        if cancel is not None and cancel.is_set():
+            raise GenerationCancelled(f"Stream from {self.base_url} cancelled after {len(parts)} chunks")
+        return "".join(parts)
+
+
+class BalancedLLMClient:
+    # same interface as LLMClient, spread over several Ollama instances
+    def __init__(self, base_urls, health_interval=HEALTH_INTERVAL):
+        self.clients = [LLMClient(u) for u in base_urls]
+        self.health_interval = health_interval
+        self.stop_event = threading.Event()
+        threading.Thread(target=self._health_loop, daemon=True, name="ollama-health").start()
+
+    def _health_loop(self):
+        while not self.stop_event.wait(self.health_interval):
+            for client in self.clients:
+                client.check_health()
+
+    def close(self):
+        self.stop_event.set()
+
+    def _candidates(self):
+        live = [c for c in self.clients if c.available]
+        if not live:
+            raise CircuitOpenError("No healthy Ollama endpoint available")
+        # least outstanding requests first, random among ties
+        random.shuffle(live)
+        return sorted(live, key=lambda c: c.outstanding)
+
+    def _call(self, method, *args):
+        last_exc = None
+        for client in self._candidates():
+            try:
+                return getattr(client, method)(*args)
+            except (CircuitOpenError, requests.ConnectionError, requests.Timeout) as e:
+                client.healthy = False
+                last_exc = e
+                logger.warning(f"Endpoint {client.base_url} failed ({e.__class__.__name__}); failing over")
+        raise last_exc
+
+    def post_json(self, path, payload, priority=PRIORITY_ANSWER) -> dict:
+        return self._call("post_json", path, payload, priority)
+
+    def chat(self, payload, priority=PRIORITY_ANSWER) -> dict:
+        return self._call("chat", payload, priority)
+
+    def chat_content(self, payload, priority=PRIORITY_ANSWER) -> str:
+        return self._call("chat_content", payload, priority)
+
+    def embeddings(self, payload, priority=PRIORITY_EMBED) -> dict:
+        return self._call("embeddings", payload, priority)
+
+    def stream_chat(self, payload, on_token=None, priority=PRIORITY_ANSWER, cancel=None) -> str:
+        # no failover once tokens have been handed to the caller
+        return self._candidates()[0].stream_chat(payload, on_token, priority, cancel)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url):
+    # a single URL or a list of URLs of equivalent Ollama instances
+    urls = (base_url,) if isinstance(base_url, str) else tuple(base_url)
+    with _clients_lock:
+        client = _clients.get(urls)
+        if client is None:
+            client = LLMClient(urls[0]) if len(urls) == 1 else BalancedLLMClient(urls)
+            _clients[urls] = client
+        return client
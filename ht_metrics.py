@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+METRICS_DUMP_INTERVAL = 60.0
+BUCKETS               = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "rag_stage_seconds":     "Wall time spent in a pipeline stage",
+    "rag_query_seconds":     "End to end wall time of a query",
+    "rag_queries_total":     "Answered queries",
+    "llm_calls_total":       "Requests sent to the LLM endpoints",
+    "llm_tokens_total":      "Tokens reported by the LLM endpoints",
+}
+
+logger = logging.getLogger(__name__)
+
+_query_stats = contextvars.ContextVar("query_stats", default=None)
+_usage_lock = threading.Lock()
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def render(self) -> str:
+        lines, seen = [], set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.append(f"{name}{_label_str(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                header(name, "histogram")
+                for b, c in zip(hist.buckets, hist.counts):
+                    lines.append(f"{name}_bucket{_label_str(labels + (('le', b),))} {c}")
+                lines.append(f"{name}_bucket{_label_str(labels + (('le', '+Inf'),))} {hist.count}")
+                lines.append(f"{name}_sum{_label_str(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_label_str(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+@contextmanager
+def stage(name):
+    # stages may nest (e.g. embed inside compress); each one is timed inclusively
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        dt = time.monotonic() - t0
+        registry.observe("rag_stage_seconds", dt, stage=name)
+        stats = _query_stats.get()
+        if stats is not None:
+            key = f"{name}_s"
+            stats["timings"][key] = stats["timings"].get(key, 0.0) + dt
+
+
+@contextmanager
+def query_timer(mode):
+    stats = {"timings": {}, "llm": {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}}
+    token = _query_stats.set(stats)
+    t0 = time.monotonic()
+    try:
+        yield stats
+    finally:
+        dt = time.monotonic() - t0
+        stats["timings"]["total_s"] = dt
+        _query_stats.reset(token)
+        registry.observe("rag_query_seconds", dt, mode=mode)
+        registry.inc("rag_queries_total", mode=mode)
+
+
+def record_llm_call(kind, endpoint, usage=None):
+    registry.inc("llm_calls_total", kind=kind, endpoint=endpoint)
+    usage = usage or {}
+    prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    if prompt:
+        registry.inc("llm_tokens_total", prompt, kind=kind, type="prompt")
+    if completion:
+        registry.inc("llm_tokens_total", completion, kind=kind, type="completion")
+    stats = _query_stats.get()
+    if stats is not None:
+        stats["llm"]["calls"] += 1
+        stats["llm"]["prompt_tokens"] += prompt
+        stats["llm"]["completion_tokens"] += completion
+
+
+def current_query_stats():
+    return _query_stats.get()
+
+
+@contextmanager
+def capture_llm_usage():
+    # collects the usage of a call made on behalf of several queries, to be shared out with add_llm_usage
+    stats = {"timings": {}, "llm": {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}}
+    token = _query_stats.set(stats)
+    try:
+        yield stats["llm"]
+    finally:
+        _query_stats.reset(token)
+
+
+def add_llm_usage(stats, calls=0, prompt_tokens=0, completion_tokens=0):
+    # per-query counts only; the global counters were already incremented by record_llm_call
+    with _usage_lock:
+        stats["llm"]["calls"] += calls
+        stats["llm"]["prompt_tokens"] += prompt_tokens
+        stats["llm"]["completion_tokens"] += completion_tokens
+
+
+def render_prometheus() -> str:
+    return registry.render()
+
+
+def dump_metrics(path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def start_metrics_dump(path, interval=METRICS_DUMP_INTERVAL):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                dump_metrics(path)
+            except OSError:
+                logger.exception(f"Could not write metrics to {path}")
+
+    threading.Thread(target=loop, daemon=True, name="metrics-dump").start()
+    logger.info(f"Dumping metrics to {path} every {interval:.0f}s")
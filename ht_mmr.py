@@ -0,0 +1,45 @@
+import logging
+import numpy as np
+
+MMR_LAMBDA = 0.7
+MMR_TOP_N  = 5
+
+logger = logging.getLogger(__name__)
+
+
+def reconstruct_vectors(index, ids) -> np.ndarray:
+    return index.reconstruct_batch(np.asarray(ids, dtype=np.int64)).astype(np.float32)
+
+
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def mmr_select(query_emb, cand_embs, top_n=MMR_TOP_N, lam=MMR_LAMBDA, relevance=None) -> list[int]:
+    cands = _normalize(np.asarray(cand_embs, dtype=np.float32))
+    if relevance is None:
+        relevance = cands @ _normalize(np.asarray(query_emb, dtype=np.float32))
+    relevance = np.asarray(relevance, dtype=np.float32)
+    pairwise = cands @ cands.T
+    n = len(cands)
+    max_sim = np.zeros(n, dtype=np.float32)
+    chosen = np.zeros(n, dtype=bool)
+    order = []
+    for _ in range(min(top_n, n)):
+        score = lam * relevance - (1.0 - lam) * max_sim
+        score[chosen] = -np.inf
+        pick = int(np.argmax(score))
+        order.append(pick)
+        chosen[pick] = True
+        max_sim = np.maximum(max_sim, pairwise[pick])
+    return order
+
+
+def mmr_contexts(query_emb, contexts, index, top_n=MMR_TOP_N, lam=MMR_LAMBDA, relevance=None):
+    if len(contexts) <= top_n:
+        return contexts
+    vecs = reconstruct_vectors(index, [c["id"] for c in contexts])
+    order = mmr_select(query_emb, vecs, top_n, lam, relevance)
+    picked = [contexts[i] for i in order]
+    logger.info(f"MMR kept {len(picked)}/{len(contexts)} contexts: {[c['file_name'] for c in picked]}")
+    return picked
@@ -0,0 +1,188 @@
+import re
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MOCK_PORT          = 11435
+EMBED_DIM          = 64
+REQUEST_LATENCY    = 0.0
+TOKEN_LATENCY      = 0.0
+MOCK_ANSWER        = "Bu bir deneme cevabıdır. Bilgi belge 1 içinde bulundu."
+
+logger = logging.getLogger(__name__)
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> list[float]:
+    # deterministic bag-of-words hashing, so similar texts get similar vectors
+    vec = np.zeros(dim, dtype=np.float32)
+    for tok in re.findall(r"\w+", text.lower()):
+        h = int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest()[:4], "little")
+        vec[h % dim] += 1.0 if h & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm else vec).tolist()
+
+
+def fake_reply(messages) -> str:
+    system = " ".join(m["content"] for m in messages if m["role"] == "system" and isinstance(m["content"], str))
+    user = messages[-1]["content"] if messages else ""
+    if "'Evet' veya 'Hayır'" in system:
+        return "Evet"
+    if "soru üretme" in system:
+        words = re.findall(r"\w+", user.split("Metin:", 1)[-1].lower())
+        return json.dumps([f"{w} nedir?" for w in dict.fromkeys(w for w in words if len(w) > 3)][:5], ensure_ascii=False)
+    if "JSON dizi" in system or "JSON dizi" in user:
+        m = re.search(r'Soru: "([^"]*)"', user)
+        words = re.findall(r"\w+", (m.group(1) if m else user).lower())
+        return json.dumps([w for w in words if len(w) > 3][:5], ensure_ascii=False)
+    return MOCK_ANSWER
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes; with Nagle on, every keep-alive
+    # request waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        logger.debug("mock ollama: " + fmt % args)
+
+    def _json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path in ("/api/tags", "/v1/models"):
+            self._json({"models": [{"name": "mock"}], "data": [{"id": "mock"}]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        req = self._body()
+        time.sleep(self.server.latency)
+        if self.path == "/v1/embeddings":
+            texts = req.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t, self.server.dim)}
+                    for i, t in enumerate(texts)]
+            self._json({"object": "list", "data": data, "model": req.get("model", "mock")})
+        elif self.path == "/v1/chat/completions":
+            self._chat(req)
+        elif self.path == "/v1/messages":
+            self._messages(req)
+        elif self.path in ("/api/generate", "/api/embed"):
+            # model load / keep-alive requests
+            self._json({"model": req.get("model", "mock"), "done": True, "response": "", "embeddings": []})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def _chat(self, req):
+        reply = fake_reply(req.get("messages", []))
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in req.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply) // 4,
+                 "total_tokens": prompt_tokens + len(reply) // 4}
+        if not req.get("stream"):
+            self._json({"object": "chat.completion", "model": req.get("model", "mock"), "usage": usage,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": reply}}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in re.findall(r"\S+\s*", reply):
+            time.sleep(self.server.token_latency)
+            self._chunk({"object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": piece}}]})
+        self._chunk({"object": "chat.completion.chunk", "usage": usage,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _messages(self, req):
+        # Anthropic Messages API; the answer cites the first document block of the last user turn
+        content = req.get("messages", [{}])[-1].get("content", [])
+        docs = [b for b in content if isinstance(b, dict) and b.get("type") == "document"]
+        citations = []
+        if docs:
+            text = docs[0]["source"]["data"]
+            citations.append({"type": "char_location", "cited_text": text[:80], "document_index": 0,
+                              "document_title": docs[0].get("title"), "start_char_index": 0,
+                              "end_char_index": min(len(text), 80)})
+        usage = {"input_tokens": len(json.dumps(content, ensure_ascii=False)) // 4,
+                 "output_tokens": len(MOCK_ANSWER) // 4}
+        message = {"id": "msg_mock", "type": "message", "role": "assistant", "model": req.get("model", "mock"),
+                   "stop_reason": "end_turn", "stop_sequence": None, "usage": usage,
+                   "content": [{"type": "text", "text": MOCK_ANSWER, "citations": citations or None}]}
+        if not req.get("stream"):
+            self._json(message)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._event("message_start", {"type": "message_start", "message": dict(
+            message, content=[], stop_reason=None, usage=dict(usage, output_tokens=0))})
+        self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                            "content_block": {"type": "text", "text": "", "citations": []}})
+        for c in citations:
+            self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "citations_delta", "citation": c}})
+        for piece in re.findall(r"\S+\s*", MOCK_ANSWER):
+            time.sleep(self.server.token_latency)
+            self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "text_delta", "text": piece}})
+        self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._event("message_delta", {"type": "message_delta", "usage": {"output_tokens": usage["output_tokens"]},
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None}})
+        self._event("message_stop", {"type": "message_stop"})
+        self._write_chunk(b"")
+
+    def _event(self, name, obj):
+        self._write_chunk(f"event: {name}\ndata: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _chunk(self, obj):
+        self._write_chunk(f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_mock_server(port=0, latency=REQUEST_LATENCY, token_latency=TOKEN_LATENCY, dim=EMBED_DIM):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockOllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_latency = token_latency
+    server.dim = dim
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-ollama").start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    logger.info(f"Mock Ollama listening on {url}")
+    return server, url
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ollama OpenAI-compatible and Anthropic Messages APIs")
+    parser.add_argument("--port", type=int, default=MOCK_PORT)
+    parser.add_argument("--latency", type=float, default=REQUEST_LATENCY, help="seconds added to every request")
+    parser.add_argument("--token-latency", type=float, default=TOKEN_LATENCY, help="seconds between streamed tokens")
+    parser.add_argument("--dim", type=int, default=EMBED_DIM)
+    args = parser.parse_args()
+    server, _ = start_mock_server(args.port, args.latency, args.token_latency, args.dim)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
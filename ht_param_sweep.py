@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import argparse
+import itertools
+import importlib
+import statistics
+from datetime import datetime
+from ht_batch_qa import MODES, answer_one
+
+SWEEP_DIR   = "sweeps"
+SWEEP_COSTS = ("wall_s", "llm_calls", "tokens")
+
+# constants each script reads at query time, so they can be swept on an already loaded index
+DEFAULT_GRIDS = {
+    "regular": {
+        "MAIN_BM25_K_MAX":    [3, 5],
+        "KW_BM25_K_MAX":      [0, 2, 3],
+        "MAX_KEYWORDS":       [5, 10],
+        "MAX_CONTEXT_TOKENS": [2000, 4000],
+    },
+    "semantic": {
+        "MAIN_SEM_K_MAX":     [3, 5, 8],
+        "KW_SEM_K_MAX":       [0, 2, 3],
+        "MAX_KEYWORDS":       [5, 10],
+        "MAX_CONTEXT_TOKENS": [2000, 4000],
+    },
+    "hybrid": {
+        "MAIN_SEM_K_MAX":     [3, 5],
+        "MAIN_BM25_K_MAX":    [3, 5],
+        "KW_SEM_K_MAX":       [0, 2],
+        "KW_BM25_K_MAX":      [0, 2],
+        "MAX_KEYWORDS":       [5, 10],
+        "MAX_CONTEXT_TOKENS": [2000, 4000],
+    },
+}
+
+logger = logging.getLogger(__name__)
+
+
+def read_gold(path: str) -> list[dict]:
+    # one JSON object per line: "query" (or "question"), "expected" (or "sources") file names, optional "id"
+    gold = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            query = item.get("query") or item.get("question")
+            expected = item.get("expected") or item.get("sources") or []
+            if isinstance(expected, str):
+                expected = [expected]
+            if not query or not expected:
+                logger.warning(f"Line {n} of {path} needs a query and expected sources, skipping")
+                continue
+            gold.append({"id": str(item.get("id", n)), "query": query, "expected": expected})
+    return gold
+
+
+def expand_grid(grid: dict) -> list[dict]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def recall(expected, found) -> float:
+    expected = set(expected)
+    return len(expected & set(found)) / len(expected)
+
+
+def run_config(mod, res, mode, gold, params) -> dict:
+    saved = {name: getattr(mod, name) for name in params}
+    for name, value in params.items():
+        setattr(mod, name, value)
+    try:
+        records = [answer_one(mod, res, mode, item) for item in gold]
+    finally:
+        for name, value in saved.items():
+            setattr(mod, name, value)
+
+    ok = [r for r in records if "error" not in r]
+    if not ok:
+        return {"mode": mode, "params": params, "errors": len(records)}
+    # contexts are what reached the answer prompt, candidates also include what the filter dropped
+    ctx_recall = [recall(r["expected"], [c["file_name"] for c in r["contexts"]]) for r in ok]
+    llm = [r["llm"] for r in ok]
+    return {
+        "mode":        mode,
+        "params":      params,
+        "questions":   len(ok),
+        "errors":      len(records) - len(ok),
+        "recall":      statistics.fmean(ctx_recall),
+        "contexts":    statistics.fmean(len(r["contexts"]) for r in ok),
+        "llm_calls":   statistics.fmean(u.get("calls", 0) for u in llm),
+        "tokens":      statistics.fmean(u.get("prompt_tokens", 0) + u.get("completion_tokens", 0) for u in llm),
+        "wall_s":      statistics.fmean(r["timings"]["total_s"] for r in ok),
+        "wall_p95_s":  sorted(r["timings"]["total_s"] for r in ok)[int(0.95 * (len(ok) - 1))],
+    }
+
+
+def pareto_front(rows, cost="wall_s") -> list[dict]:
+    # a configuration stays if no other one has at least its recall at no more cost, and is better in one
+    rows = [r for r in rows if "recall" in r]
+    front = []
+    for r in rows:
+        dominated = any(
+            o["recall"] >= r["recall"] and o[cost] <= r[cost] and (o["recall"] > r["recall"] or o[cost] < r[cost])
+            for o in rows
+        )
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r[cost])
+
+
+def sweep(mode, gold_path, grid=None, ollama_urls=None, out_dir=SWEEP_DIR, cost="wall_s"):
+    mod = importlib.import_module(MODES[mode])
+    if ollama_urls:
+        mod.OLLAMA_API_URLS = list(ollama_urls)
+    grid = grid or DEFAULT_GRIDS[mode]
+    unknown = [name for name in grid if not hasattr(mod, name)]
+    if unknown:
+        raise ValueError(f"{MODES[mode]} has no constant(s) {', '.join(unknown)}")
+    gold = read_gold(gold_path)
+    configs = expand_grid(grid)
+    logger.info(f"Sweeping {len(configs)} configurations of {mode} over {len(gold)} questions")
+    res = mod.load_resources()
+
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.join(out_dir, f"sweep_{mode}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    rows = []
+    with open(stem + ".jsonl", "w", encoding="utf-8") as out:
+        for i, params in enumerate(configs, 1):
+            row = run_config(mod, res, mode, gold, params)
+            rows.append(row)
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            if "recall" in row:
+                logger.info(f"[{i}/{len(configs)}] {params} recall={row['recall']:.3f} "
+                            f"calls={row['llm_calls']:.1f} tokens={row['tokens']:.0f} wall={row['wall_s']:.2f}s")
+            else:
+                logger.warning(f"[{i}/{len(configs)}] {params} failed on every question")
+    front = pareto_front(rows, cost)
+    with open(stem + "_pareto.json", "w", encoding="utf-8") as f:
+        json.dump({"mode": mode, "cost": cost, "front": front}, f, ensure_ascii=False, indent=2)
+    return rows, front, stem
+
+
+def print_front(front, cost):
+    print(f"Pareto frontier (recall vs {cost}):")
+    print(f"{'recall':>7} {'calls':>6} {'tokens':>8} {'wall s':>7}  params")
+    for r in front:
+        params = ", ".join(f"{k}={v}" for k, v in r["params"].items())
+        print(f"{r['recall']:>7.3f} {r['llm_calls']:>6.1f} {r['tokens']:>8.0f} {r['wall_s']:>7.2f}  {params}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Sweep retrieval constants and report recall against latency and cost")
+    parser.add_argument("gold", help="JSONL with query and expected source file names per line")
+    parser.add_argument("--mode", choices=sorted(MODES), action="append",
+                        help="pipeline(s) to sweep (repeat for several, default: all)")
+    parser.add_argument("--grid", help="JSON file mapping constant names to lists of values")
+    parser.add_argument("--cost", choices=SWEEP_COSTS, default="wall_s", help="cost axis of the Pareto frontier")
+    parser.add_argument("--ollama-url", action="append", help="Ollama base URL (repeat for several)")
+    parser.add_argument("--out", default=SWEEP_DIR)
+    args = parser.parse_args()
+
+    grid = None
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid = json.load(f)
+    for mode in args.mode or list(MODES):
+        _, front, stem = sweep(mode, args.gold, grid, args.ollama_url, args.out, args.cost)
+        print(f"\n== {mode} ({stem}.jsonl)")
+        print_front(front, args.cost)
@@ -0,0 +1,91 @@
+import re
+import logging
+import numpy as np
+from collections import Counter
+from ht_turkish_text import analyze
+
+COMPRESS_TOP_SENTENCES = 6
+COMPRESS_WINDOW        = 1
+MIN_SENTENCES          = 8
+BM25_WEIGHT            = 0.5
+BM25_K1                = 1.5
+BM25_B                 = 0.75
+
+logger = logging.getLogger(__name__)
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s for s in re.split(r"(?<=[.!?])\s+", text.strip()) if s]
+
+
+def bm25_sentence_scores(sentences, terms, analyzer=None) -> np.ndarray:
+    terms = list(dict.fromkeys(terms))
+    counts = [Counter(analyze(s, analyzer)) for s in sentences]
+    if not terms or not counts:
+        return np.zeros(len(sentences))
+    tf = np.array([[c[t] for t in terms] for c in counts], dtype=np.float64)
+    lens = np.array([sum(c.values()) for c in counts], dtype=np.float64)
+    avg = max(lens.mean(), 1.0)
+    n = len(sentences)
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lens / avg)
+    # terms no sentence contains have tf 0 everywhere and add nothing
+    return (tf * (BM25_K1 + 1) / (tf + norm[:, None])) @ idf
+
+
+def _scaled(x):
+    x = np.asarray(x, dtype=np.float64)
+    span = x.max() - x.min()
+    return (x - x.min()) / span if span > 0 else np.zeros_like(x)
+
+
+def _unit(x):
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def _compress_sentences(sentences, terms, sims=None, analyzer=None,
+                        top_n=COMPRESS_TOP_SENTENCES, window=COMPRESS_WINDOW):
+    score = _scaled(bm25_sentence_scores(sentences, terms, analyzer))
+    if sims is not None:
+        score = BM25_WEIGHT * score + (1.0 - BM25_WEIGHT) * _scaled(sims)
+    ranked = [i for i in np.argsort(-score, kind="stable") if score[i] > 0][:top_n]
+    if not ranked:
+        return None
+    keep = set()
+    for i in ranked:
+        keep.update(range(max(0, i - window), min(len(sentences), i + window + 1)))
+    parts, prev = [], None
+    for i in sorted(keep):
+        if prev is not None and i != prev + 1:
+            parts.append("…")
+        parts.append(sentences[i])
+        prev = i
+    return " ".join(parts)
+
+
+def _sentence_sims(groups, query_emb, embed_many):
+    # every sentence of every context in one embed_many call, scored with one matrix product
+    flat = [s for sentences in groups for s in sentences]
+    emb = _unit(np.asarray(embed_many(flat), dtype=np.float32))
+    sims = emb @ _unit(np.asarray(query_emb, dtype=np.float32))
+    bounds = np.cumsum([0] + [len(sentences) for sentences in groups])
+    return [sims[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def compress_contexts(contexts, query, keywords=(), query_emb=None, embed_many=None, analyzer=None):
+    terms = analyze(query, analyzer) + analyze(" ".join(keywords), analyzer)
+    split = [split_sentences(ctx["text"]) for ctx in contexts]
+    long_ids = [i for i, sentences in enumerate(split) if len(sentences) >= MIN_SENTENCES]
+    sims = {}
+    if embed_many is not None and query_emb is not None and long_ids:
+        sims = dict(zip(long_ids, _sentence_sims([split[i] for i in long_ids], query_emb, embed_many)))
+    out = []
+    for i, ctx in enumerate(contexts):
+        short = ctx["text"]
+        if len(split[i]) >= MIN_SENTENCES:
+            short = _compress_sentences(split[i], terms, sims.get(i), analyzer) or short
+        if short is not ctx["text"]:
+            logger.info(f"Compressed {ctx['file_name']}: {len(ctx['text'])} -> {len(short)} chars")
+        out.append(dict(ctx, text=short, full_text=ctx["text"]))
+    return out
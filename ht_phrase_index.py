@@ -0,0 +1,66 @@
+import math
+import logging
+from bisect import bisect_left
+from ht_turkish_text import analyze
+
+PHRASE_SLOP = 0
+PHRASE_K    = 3
+
+logger = logging.getLogger(__name__)
+
+
+def build_positional_index(docs, analyzer=None):
+    postings = {}
+    for doc_id, doc in enumerate(docs):
+        for pos, tok in enumerate(analyze(doc, analyzer)):
+            postings.setdefault(tok, {}).setdefault(doc_id, []).append(pos)
+    logger.info(f"Built positional index ({len(postings)} terms, {len(docs)} docs)")
+    return {"postings": postings, "n_docs": len(docs)}
+
+
+def _match_count(positions, slop):
+    # positions[i] is the sorted position list of the i-th phrase token in one doc;
+    # exact matches count 1, looser proximity matches count less
+    count = 0.0
+    for start in positions[0]:
+        prev, gaps = start, 0
+        for plist in positions[1:]:
+            j = bisect_left(plist, prev + 1)
+            if j == len(plist) or plist[j] - prev > slop + 1:
+                break
+            gaps += plist[j] - prev - 1
+            prev = plist[j]
+        else:
+            count += 1.0 / (1.0 + gaps)
+    return count
+
+
+def phrase_search(pindex, phrase: str, slop: int = PHRASE_SLOP, analyzer=None):
+    tokens = analyze(phrase, analyzer)
+    postings = pindex["postings"]
+    if not tokens or any(t not in postings for t in tokens):
+        return {}
+    lists = [postings[t] for t in tokens]
+    candidates = set(min(lists, key=len))
+    for plist in lists:
+        candidates.intersection_update(plist)
+    hits = {}
+    for doc_id in candidates:
+        count = _match_count([plist[doc_id] for plist in lists], slop)
+        if count:
+            hits[doc_id] = count
+    if not hits:
+        return {}
+    # rarer phrases weigh more, repeated occurrences saturate
+    idf = math.log(1.0 + pindex["n_docs"] / len(hits))
+    return {doc_id: idf * count / (count + 1.0) for doc_id, count in hits.items()}
+
+
+def retrieve_phrase(phrase, pindex, docs, fnames, k=PHRASE_K, slop=PHRASE_SLOP, analyzer=None):
+    scores = phrase_search(pindex, phrase, slop, analyzer)
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+    out = []
+    for idx, score in ranked:
+        out.append({"id": idx, "text": docs[idx], "file_name": fnames[idx], "sim": score, "type": "phrase"})
+        logger.info(f"Phrase: '{phrase}' {fnames[idx]} score={score:.4f}")
+    return out
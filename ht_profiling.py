@@ -0,0 +1,105 @@
+import io
+import os
+import re
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager, nullcontext
+
+PROFILE_DIR    = "profiles"
+PROFILE_TOP    = 30
+MEMORY_TOP     = 15
+TRACE_FRAMES   = 1
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler:
+    def __init__(self, out_dir=PROFILE_DIR, top=PROFILE_TOP):
+        self.out_dir = out_dir
+        self.top = top
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        os.makedirs(out_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+
+    @contextmanager
+    def section(self, name):
+        # cProfile cannot nest, so an inner section is folded into the outer one
+        if getattr(self.local, "active", False):
+            yield
+            return
+        self.local.active = True
+        prof = cProfile.Profile()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        before = tracemalloc.take_snapshot()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            wall = time.perf_counter() - t0
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            self.local.active = False
+            self._write(name, prof, wall, peak - base, current - base, after.compare_to(before, "lineno"))
+
+    def _write(self, name, prof, wall, peak, retained, mem_diff):
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        safe = re.sub(r"[^\w.-]+", "_", name)
+        stem = os.path.join(self.out_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{seq:03d}_{safe}")
+        prof.dump_stats(stem + ".prof")
+
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(self.top)
+        with open(stem + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"section: {name}\nwall: {wall:.3f}s\n")
+            f.write(f"peak allocated: {peak / 1024:.1f} KiB\nretained: {retained / 1024:.1f} KiB\n\n")
+            f.write("top allocation growth:\n")
+            for stat in mem_diff[:MEMORY_TOP]:
+                f.write(f"  {stat}\n")
+            f.write("\n" + buf.getvalue())
+        with open(os.path.join(self.out_dir, "summary.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "section": name, "report": os.path.basename(stem) + ".txt",
+                "wall_s": wall, "peak_kib": peak / 1024, "retained_kib": retained / 1024,
+            }) + "\n")
+        logger.info(f"Profiled {name}: {wall:.3f}s, peak {peak / 1024:.1f} KiB -> {stem}.txt")
+
+
+_profiler = None
+
+
+def enable_profiling(out_dir=PROFILE_DIR) -> Profiler:
+    global _profiler
+    _profiler = Profiler(out_dir)
+    logger.info(f"Profiling enabled, reports go to {out_dir}")
+    return _profiler
+
+
+def profile_section(name):
+    return _profiler.section(name) if _profiler is not None else nullcontext()
+
+
+def add_profiling_args(parser):
+    parser.add_argument("--profile", nargs="?", const=PROFILE_DIR, metavar="DIR",
+                        help=f"write cProfile and tracemalloc reports per stage (default dir: {PROFILE_DIR})")
+    parser.add_argument("--debug", action="store_true", help="enable DEBUG logging")
+
+
+def apply_profiling_args(args):
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    if args.profile:
+        enable_profiling(args.profile)
@@ -0,0 +1,41 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def dedup_contexts(*lists, key="file_name") -> list[dict]:
+    seen, contexts = set(), []
+    for results in lists:
+        for c in results:
+            if c[key] not in seen:
+                contexts.append(c)
+                seen.add(c[key])
+    return contexts
+
+
+def format_prompt(query, contexts) -> str:
+    sections = []
+    for i, ctx in enumerate(contexts, 1):
+        sections.append(f"{'*'*5} start of belge {i} {'*'*5}")
+        sections.append(ctx["text"])
+        sections.append(f"{'*'*5} end of belge {i} {'*'*5}")
+    return "\n\n".join(sections) + f"\n\nsoru: \"{query}\""
+
+
+def trim_prompt(query, contexts, enc, max_tokens, by_sim=False):
+    # drops the last (or, with by_sim, the least similar) belge until the prompt fits
+    contexts = list(contexts)
+    prompt = format_prompt(query, contexts)
+    n_tokens = len(enc.encode(prompt))
+    if n_tokens <= max_tokens:
+        return prompt, contexts
+    logger.info(f"Prompt {n_tokens} tokens > {max_tokens}, trimming...")
+    if by_sim:
+        contexts.sort(key=lambda c: c["sim"], reverse=True)
+    while n_tokens > max_tokens and contexts:
+        dropped = contexts.pop()
+        logger.debug(f"Dropped belge '{dropped['file_name']}'")
+        prompt = format_prompt(query, contexts)
+        n_tokens = len(enc.encode(prompt))
+    logger.info(f"Trimmed to {len(contexts)} contexts")
+    return prompt, contexts
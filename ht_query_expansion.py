@@ -0,0 +1,195 @@
+import os
+import gzip
+import json
+import logging
+import argparse
+import importlib
+import numpy as np
+from collections import Counter
+from ht_turkish_text import Analyzer, tokenize, stem
+
+EMBED_MODEL          = "mxbai-embed-large"
+EXPANSION_TABLE_PATH = "query_expansion.json.gz"
+DEFAULT_MODE         = "hybrid"
+MAX_VOCAB            = 5000
+MIN_DF               = 2
+MAX_DF_RATIO         = 0.5
+MIN_COOCCUR          = 2
+TOP_COOCCUR          = 5
+TOP_NEIGHBOURS       = 5
+MIN_NEIGHBOUR_SIM    = 0.6
+EMBED_BATCH          = 64
+ROW_BLOCK            = 2048
+
+MODES = {
+    "regular":  "ht_regular_offline_rag",
+    "semantic": "ht_semantic_offline_rag",
+    "hybrid":   "ht_hybrid_offline_rag",
+}
+
+logger = logging.getLogger(__name__)
+
+
+# scipy and requests are only needed to build a table, the pipelines just look it up
+def embed_many(texts: list[str], url, model=EMBED_MODEL) -> np.ndarray:
+    import requests
+    out = []
+    for i in range(0, len(texts), EMBED_BATCH):
+        payload = {"model": model, "input": texts[i:i + EMBED_BATCH]}
+        resp = requests.post(f"{url}/v1/embeddings", json=payload)
+        resp.raise_for_status()
+        out.extend(d["embedding"] for d in resp.json()["data"])
+        logger.info(f"Embedded {min(i + EMBED_BATCH, len(texts))}/{len(texts)} vocabulary terms")
+    return np.array(out, dtype=np.float32)
+
+
+def _select_vocab(docs, stop, analyzer=None):
+    df, surfaces = Counter(), {}
+    doc_stems = []
+    for doc in docs:
+        stems = set()
+        for tok in tokenize(doc):
+            if tok in stop:
+                continue
+            s = stem(tok, analyzer)
+            if len(s) < 3:
+                continue
+            surfaces.setdefault(s, Counter())[tok] += 1
+            stems.add(s)
+        df.update(stems)
+        doc_stems.append(stems)
+    max_df = MAX_DF_RATIO * len(docs)
+    vocab = [s for s, c in df.most_common() if MIN_DF <= c <= max_df][:MAX_VOCAB]
+    terms = {s: surfaces[s].most_common(1)[0][0] for s in vocab}
+    return vocab, terms, doc_stems
+
+
+def _top_k(scores, k, min_score):
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        return [[] for _ in range(scores.shape[0])]
+    part = np.argpartition(-scores, k, axis=1)[:, :k]
+    rows = np.arange(scores.shape[0])[:, None]
+    order = np.argsort(-scores[rows, part], axis=1)
+    best = part[rows, order]
+    return [[j for j in row if scores[i, j] >= min_score] for i, row in enumerate(best)]
+
+
+def cooccurrence_neighbours(vocab, doc_stems):
+    from scipy import sparse
+    col = {s: j for j, s in enumerate(vocab)}
+    V, N = len(vocab), len(doc_stems)
+    rows, cols = [], []
+    for r, stems in enumerate(doc_stems):
+        idx = [col[s] for s in stems if s in col]
+        rows.extend([r] * len(idx))
+        cols.extend(idx)
+    X = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(N, V))
+    counts = (X.T @ X).tocoo()
+    df = np.asarray(X.sum(axis=0)).ravel()
+    # only pairs seen together often enough get a score, the V x V matrix stays sparse
+    keep = (counts.data >= MIN_COOCCUR) & (counts.row != counts.col)
+    a, b, c = counts.row[keep], counts.col[keep], counts.data[keep]
+    p_ab = c / N
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # normalized PMI in [-1, 1]
+        npmi = np.log(p_ab / (df[a] / N * df[b] / N)) / -np.log(p_ab)
+    # best TOP_COOCCUR per term: sort by term, then score (NaN last), and rank within each term
+    order = np.lexsort((-npmi, a))
+    a, b, npmi = a[order], b[order], npmi[order]
+    rank = np.arange(len(a)) - np.searchsorted(a, a)
+    sel = (rank < TOP_COOCCUR) & (npmi >= 0.0)
+    out = [[] for _ in range(V)]
+    for i, j in zip(a[sel], b[sel]):
+        out[i].append(int(j))
+    return out
+
+
+def embedding_neighbours(emb):
+    emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+    out = []
+    for start in range(0, emb.shape[0], ROW_BLOCK):
+        sims = emb[start:start + ROW_BLOCK] @ emb.T
+        sims[np.arange(sims.shape[0]), np.arange(start, start + sims.shape[0])] = -np.inf
+        out.extend(_top_k(sims, TOP_NEIGHBOURS, MIN_NEIGHBOUR_SIM))
+    return out
+
+
+def build_expansion_table(docs, embed_fn=None, stop=(), analyzer=None):
+    vocab, terms, doc_stems = _select_vocab(docs, stop, analyzer)
+    logger.info(f"Expansion vocabulary: {len(vocab)} terms from {len(docs)} docs")
+    neighbours = cooccurrence_neighbours(vocab, doc_stems)
+    if embed_fn is not None and vocab:
+        emb = embed_fn([terms[s] for s in vocab])
+        for row, extra in zip(neighbours, embedding_neighbours(emb)):
+            row.extend(j for j in extra if j not in row)
+    expansions = {vocab[i]: [vocab[j] for j in row] for i, row in enumerate(neighbours) if row}
+    logger.info(f"Expansion table covers {len(expansions)} terms")
+    return {"terms": terms, "expansions": expansions}
+
+
+def save_expansion_table(table, path=EXPANSION_TABLE_PATH):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+    logger.info(f"Saved expansion table to '{path}'")
+
+
+def load_expansion_table(path=EXPANSION_TABLE_PATH):
+    if not os.path.isfile(path):
+        logger.info(f"No expansion table at '{path}'")
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        table = json.load(f)
+    logger.info(f"Loaded expansion table ({len(table['expansions'])} terms)")
+    return table
+
+
+def expand_query(query: str, table, stop=(), max_terms=10, analyzer=None) -> list[str]:
+    terms, expansions = table["terms"], table["expansions"]
+    own = [tok for tok in tokenize(query) if tok not in stop]
+    if not any(stem(tok, analyzer) in terms for tok in own):
+        return []
+    out = list(own)
+    # round-robin so every query term contributes its strongest neighbours first
+    per_term = [[terms[s] for s in expansions.get(stem(tok, analyzer), ())] for tok in own]
+    for rank in range(max((len(row) for row in per_term), default=0)):
+        out.extend(row[rank] for row in per_term if rank < len(row))
+    out = list(dict.fromkeys(out))[:max_terms]
+    logger.info(f"Expanded keywords (lookup): {out}")
+    return out
+
+
+def load_docs(mod):
+    # the corpus the pipeline retrieves from: .txt files for regular, the indexed chunks otherwise
+    if hasattr(mod, "load_index_and_metadata"):
+        _, docs, _ = mod.load_index_and_metadata()
+        return docs
+    docs, _ = mod.load_corpus_from_dir()
+    return docs
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Build the offline query-expansion table for one pipeline")
+    parser.add_argument("--mode", choices=sorted(MODES), default=DEFAULT_MODE,
+                        help="pipeline whose corpus (and embedding model) the table is built from")
+    parser.add_argument("--out", help="output path (default: the pipeline's EXPANSION_TABLE_PATH)")
+    parser.add_argument("--no-embed", action="store_true", help="co-occurrence neighbours only")
+    parser.add_argument("--embed-url", help="embedding server for pipelines without their own embed_many "
+                                            "(regular); without it regular uses co-occurrence only")
+    args = parser.parse_args()
+
+    mod = importlib.import_module(MODES[args.mode])
+    docs = load_docs(mod)
+    embed_fn = None
+    if args.no_embed:
+        logger.info("Building co-occurrence neighbours only")
+    elif hasattr(mod, "embed_many"):
+        embed_fn = mod.embed_many
+    elif args.embed_url:
+        embed_fn = lambda texts: embed_many(texts, args.embed_url, getattr(mod, "EMBED_MODEL", EMBED_MODEL))
+    else:
+        logger.info(f"Mode '{args.mode}' has no embedding model, building co-occurrence neighbours only")
+    # stems have to match the ones the pipeline computes for this corpus
+    table = build_expansion_table(docs, embed_fn, mod.QUESTION_STOP, Analyzer.for_corpus(docs))
+    save_expansion_table(table, args.out or mod.EXPANSION_TABLE_PATH)
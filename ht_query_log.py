@@ -0,0 +1,129 @@
+import os
+import glob
+import json
+import queue
+import atexit
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+LOG_FILE_NAME = "queries.jsonl"
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUPS   = 10
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueryLog:
+    # append-only JSONL log written by a background thread; log() never touches the disk
+    def __init__(self, log_dir, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = os.path.join(log_dir, LOG_FILE_NAME)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue()
+        os.makedirs(log_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="query-log")
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, record: dict):
+        record.setdefault("ts", datetime.now().isoformat(timespec="milliseconds"))
+        self.queue.put(record)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        logger.info(f"Rotated query log {self.path}")
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            # drain whatever else is queued so a burst costs one write
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stop = True
+                batch = [r for r in batch if r is not _STOP]
+            if not batch:
+                continue
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for rec in batch:
+                        f.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+                if os.path.getsize(self.path) > self.max_bytes:
+                    self._rotate()
+            except OSError:
+                logger.exception(f"Could not write {len(batch)} records to {self.path}")
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_query_log(log_dir) -> QueryLog:
+    with _logs_lock:
+        qlog = _logs.get(log_dir)
+        if qlog is None:
+            qlog = _logs[log_dir] = QueryLog(log_dir)
+        return qlog
+
+
+def log_files(log_dir) -> list[str]:
+    # oldest first
+    path = os.path.join(log_dir, LOG_FILE_NAME)
+    rotated = sorted(glob.glob(path + ".*"), key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def iter_records(log_dir, since=None, until=None, contains=None, mode=None):
+    for path in log_files(log_dir):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                ts = rec.get("ts", "")
+                if since and ts < since or until and ts >= until:
+                    continue
+                if mode and rec.get("mode") != mode:
+                    continue
+                if contains and contains.lower() not in rec.get("query", "").lower():
+                    continue
+                yield rec
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the structured query log")
+    parser.add_argument("log_dir")
+    parser.add_argument("--since", help="ISO timestamp or date, inclusive")
+    parser.add_argument("--until", help="ISO timestamp or date, exclusive")
+    parser.add_argument("--contains", help="substring of the query")
+    parser.add_argument("--mode")
+    parser.add_argument("--limit", type=int, default=20, help="show the last N matches")
+    parser.add_argument("--full", action="store_true", help="print whole records")
+    args = parser.parse_args()
+    matches = list(iter_records(args.log_dir, args.since, args.until, args.contains, args.mode))
+    for rec in matches[-args.limit:]:
+        if args.full:
+            print(json.dumps(rec, ensure_ascii=False, indent=2))
+        else:
+            total = rec.get("timings", {}).get("total_s")
+            took = f"{total:.2f}s" if total is not None else "-"
+            print(f"{rec.get('ts')}  {rec.get('mode', '-'):8}  {took:>7}  {rec.get('query')}")
+    print(f"{len(matches)} matching records")
@@ -0,0 +1,122 @@
+import os
+import logging
+import argparse
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ht_profiling import add_profiling_args, apply_profiling_args, profile_section
+
+DEFAULT_MODE      = "hybrid"
+WARMUP_KEEP_ALIVE = "30m"
+WARMUP_TEXT       = "merhaba"
+
+# heavy dependencies (faiss, tiktoken, rank_bm25, numpy) are imported with the chosen module only
+MODES = {
+    "regular":  "ht_regular_offline_rag",
+    "semantic": "ht_semantic_offline_rag",
+    "hybrid":   "ht_hybrid_offline_rag",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up(mod, keep_alive=WARMUP_KEEP_ALIVE, history_tokens=0):
+    # Ollama loads a model on an empty generate/embed request and keeps it resident for keep_alive
+    from ht_llm_client import get_client
+    from ht_chat_session import context_options
+    # loaded with the num_ctx the answers use, otherwise the first answer reloads the model
+    options = context_options(mod.MAX_CONTEXT_TOKENS, mod.MAX_RESPONSE_TOKENS, history_tokens)
+    jobs = [("/api/generate", {"model": mod.CHAT_MODEL, "keep_alive": keep_alive, "options": options})]
+    if hasattr(mod, "EMBED_MODEL"):
+        jobs.append(("/api/embed", {"model": mod.EMBED_MODEL, "input": WARMUP_TEXT, "keep_alive": keep_alive}))
+    client = get_client(mod.OLLAMA_API_URLS)
+    for endpoint in getattr(client, "clients", [client]):
+        for path, payload in jobs:
+            try:
+                endpoint.post_json(path, payload)
+                logger.info(f"Warmed up {payload['model']} on {endpoint.base_url}")
+            except Exception as e:
+                logger.warning(f"Warm-up of {payload['model']} on {endpoint.base_url} failed: {e}")
+
+
+def load_mode(mode, ollama_urls=None, warmup=True, budget=None, speculative=False, session=False):
+    with profile_section("import"):
+        mod = importlib.import_module(MODES[mode])
+    if ollama_urls:
+        mod.OLLAMA_API_URLS = list(ollama_urls)
+    if budget is not None:
+        mod.QUERY_BUDGET = budget
+    if speculative:
+        mod.SPECULATIVE_ANSWERS = True
+    if warmup:
+        from ht_chat_session import SESSION_MAX_TOKENS
+        history_tokens = SESSION_MAX_TOKENS if session else 0
+        threading.Thread(target=warm_up, args=(mod, WARMUP_KEEP_ALIVE, history_tokens),
+                         daemon=True, name="warm-up").start()
+    mod.ensure_history_dir()
+    res = mod.load_resources()
+    from ht_metrics import start_metrics_dump
+    start_metrics_dump(os.path.join(mod.HISTORY_DIR, "metrics.prom"))
+    return mod, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Turkish RAG REPL")
+    parser.add_argument("--mode", choices=sorted(MODES), default=DEFAULT_MODE)
+    parser.add_argument("--ollama-url", action="append", help="Ollama base URL (repeat for several)")
+    parser.add_argument("--no-warmup", action="store_true", help="skip the model warm-up requests")
+    parser.add_argument("--session", action="store_true", help="keep follow-up questions in one conversation")
+    parser.add_argument("--budget", type=float, help="per-query latency budget in seconds")
+    parser.add_argument("--speculative", action="store_true", help="start answering before the relevance filter is done")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    apply_profiling_args(args)
+
+    loader = ThreadPoolExecutor(1, thread_name_prefix="loader").submit(
+        load_mode, args.mode, args.ollama_url, not args.no_warmup, args.budget, args.speculative, args.session
+    )
+    session = None
+    print(f"RAG ({args.mode}) is loading in the background, you can already type your question.")
+    while True:
+        query = input("You: ").strip()
+        if query.lower() in ("exit", "quit"):
+            print("bye")
+            break
+        if not query:
+            continue
+        if query.lower() == "/yeni":
+            session = None
+            print("Yeni sohbet başlatıldı.")
+            continue
+        if not loader.done():
+            print("… index is still loading")
+        try:
+            mod, res = loader.result()
+            if args.session and session is None:
+                from ht_chat_session import ChatSession
+                session = ChatSession(mod.RESPONSE_INSTRUCTION, encoding=mod.ENCODING_NAME)
+        except Exception:
+            logger.exception("Loading failed")
+            print("❗️ Could not load the index. Check logs.")
+            break
+
+        try:
+            from ht_streaming import TokenPrinter
+            printer = TokenPrinter("gem: ") if mod.STREAM_ANSWERS else None
+            trace = {}
+            with profile_section("query"):
+                answer, payload, prompt = mod.answer_query(query, res, printer, trace, session)
+            if printer is not None:
+                printer.finish()
+            else:
+                print("gem:", answer)
+            mod.save_history(query, prompt, payload, answer, trace)
+
+        except Exception:
+            logger.exception("Error in main loop")
+            print("❗️ Something went wrong. Check logs.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import json
+import asyncio
+import logging
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from ht_metrics import render_prometheus
+
+SERVER_HOST    = "127.0.0.1"
+SERVER_PORT    = 8080
+SERVER_WORKERS = 8
+DEFAULT_MODE   = "hybrid"
+
+MODES = {
+    "regular":  "ht_regular_offline_rag",
+    "semantic": "ht_semantic_offline_rag",
+    "hybrid":   "ht_hybrid_offline_rag",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _line(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class RagService:
+    def __init__(self, modes, ollama_urls=None, workers=SERVER_WORKERS, default_mode=DEFAULT_MODE, budget=None,
+                 speculative=False):
+        self.modules = {m: importlib.import_module(MODES[m]) for m in modes}
+        if ollama_urls:
+            for mod in self.modules.values():
+                mod.OLLAMA_API_URLS = list(ollama_urls)
+        if budget is not None:
+            for mod in self.modules.values():
+                mod.QUERY_BUDGET = budget
+        if speculative:
+            for mod in self.modules.values():
+                mod.SPECULATIVE_ANSWERS = True
+        self.default_mode = default_mode if default_mode in self.modules else next(iter(self.modules))
+        self.resources = {}
+        self.load_errors = {}
+        self.loader = None
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="rag")
+
+    async def load(self, app=None):
+        loop = asyncio.get_running_loop()
+        for mode, mod in self.modules.items():
+            try:
+                mod.ensure_history_dir()
+                self.resources[mode] = await loop.run_in_executor(self.executor, mod.load_resources)
+                logger.info(f"Loaded resources for mode '{mode}'")
+            except Exception as e:
+                logger.exception(f"Loading mode '{mode}' failed")
+                self.load_errors[mode] = str(e)
+
+    async def start_loading(self, app=None):
+        # the server accepts requests right away, /health and /ask report 503 until a mode is loaded
+        self.loader = asyncio.create_task(self.load())
+
+    async def close(self, app=None):
+        if self.loader is not None:
+            self.loader.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _save(self, mod, query, result, trace):
+        answer, payload, prompt = result
+        self.executor.submit(mod.save_history, query, prompt, payload, answer, trace)
+
+    async def health(self, request):
+        loading = [m for m in self.modules if m not in self.resources and m not in self.load_errors]
+        status = "loading" if loading else "error" if self.load_errors else "ok"
+        return web.json_response({
+            "status": status,
+            "modes": sorted(self.resources),
+            "errors": self.load_errors,
+            "default_mode": self.default_mode,
+        }, status=200 if status == "ok" else 503)
+
+    async def metrics(self, request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def ask(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": "invalid JSON body"}, status=400)
+        query = str(body.get("query", "")).strip()
+        mode = body.get("mode", self.default_mode)
+        if not query:
+            return web.json_response({"error": "query is required"}, status=400)
+        if mode not in self.modules:
+            return web.json_response({"error": f"unknown mode '{mode}'", "modes": sorted(self.modules)}, status=400)
+        if mode in self.load_errors:
+            return web.json_response({"error": f"mode '{mode}' failed to load: {self.load_errors[mode]}"}, status=503)
+        if mode not in self.resources:
+            return web.json_response({"error": f"mode '{mode}' is still loading"}, status=503)
+        mod, res = self.modules[mode], self.resources[mode]
+        loop = asyncio.get_running_loop()
+        trace = {}
+
+        if not body.get("stream", True):
+            try:
+                result = await loop.run_in_executor(self.executor, mod.answer_query, query, res, None, trace)
+            except Exception as e:
+                logger.exception("Error answering query")
+                return web.json_response({"error": str(e)}, status=500)
+            self._save(mod, query, result, trace)
+            return web.json_response({"mode": mode, "query": query, "answer": result[0]})
+
+        queue = asyncio.Queue()
+
+        def on_token(tok):
+            loop.call_soon_threadsafe(queue.put_nowait, ("token", tok))
+
+        def run():
+            try:
+                result = mod.answer_query(query, res, on_token, trace)
+                loop.call_soon_threadsafe(queue.put_nowait, ("done", result))
+            except Exception as e:
+                logger.exception("Error answering query")
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", str(e)))
+
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+        await resp.prepare(request)
+        loop.run_in_executor(self.executor, run)
+        while True:
+            kind, value = await queue.get()
+            if kind == "token":
+                await resp.write(_line({"token": value}))
+            elif kind == "done":
+                self._save(mod, query, value, trace)
+                await resp.write(_line({"done": True, "mode": mode, "answer": value[0]}))
+                break
+            else:
+                await resp.write(_line({"done": True, "error": value}))
+                break
+        await resp.write_eof()
+        return resp
+
+
+def create_app(service: RagService) -> web.Application:
+    app = web.Application()
+    app.router.add_post("/ask", service.ask)
+    app.router.add_get("/health", service.health)
+    app.router.add_get("/metrics", service.metrics)
+    app.on_startup.append(service.start_loading)
+    app.on_cleanup.append(service.close)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="HTTP service for the offline RAG pipelines")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated subset of " + ",".join(MODES))
+    parser.add_argument("--default-mode", default=DEFAULT_MODE)
+    parser.add_argument("--ollama-url", action="append", help="Ollama base URL (repeat for several)")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--budget", type=float, help="per-query latency budget in seconds")
+    parser.add_argument("--speculative", action="store_true", help="start answering before the relevance filter is done")
+    args = parser.parse_args()
+    service = RagService([m.strip() for m in args.modes.split(",") if m.strip()],
+                         args.ollama_url, args.workers, args.default_mode, args.budget, args.speculative)
+    web.run_app(create_app(service), host=args.host, port=args.port)
@@ -2,29 +2,72 @@ import os
 import re
 import json
 import logging
-import requests
+import argparse
 import numpy as np
 import tiktoken
-from datetime import datetime
 from rank_bm25 import BM25Okapi
+from ht_phrase_index import build_positional_index, retrieve_phrase
+from ht_fusion import reciprocal_rank_fusion
+from ht_turkish_text import Analyzer, analyze, corpus_vocabulary, lemmas, turkish_lower, word_pairs
+from ht_typo_corrector import build_typo_index, correct_query
+from ht_query_expansion import expand_query, load_expansion_table
+from ht_passage_compressor import compress_contexts
+from ht_index_cache import corpus_key, load_or_build
+from ht_doc2query import covers_corpus, expand_docs, load_doc2query
+from ht_query_log import get_query_log
+from ht_metrics import query_timer, stage, start_metrics_dump
+from ht_profiling import add_profiling_args, apply_profiling_args, profile_section
+from ht_deadline import Deadline
+from ht_adaptive_k import cut_results
+from ht_prompt_builder import dedup_contexts, trim_prompt
+from ht_speculative import SpeculativeAnswer
+from ht_chat_session import KEEP_ALIVE, ChatSession, context_options
+from ht_streaming import TokenPrinter, stream_chat_completion
+from ht_llm_client import (
+    PRIORITY_ANSWER, PRIORITY_EXTRACT, PRIORITY_FILTER, get_client
+)
 
 OLLAMA_API_URL       = "http://localhost:xx"
+OLLAMA_API_URLS      = [OLLAMA_API_URL]
 CHAT_MODEL           = "gemma3:4b-it-q8_0"
 DATA_DIR             = r"xxx"
 HISTORY_DIR          = r"xxx"
-MAIN_BM25_K          = 3
-KW_BM25_K            = 2
+MAIN_BM25_K_MIN      = 1
+MAIN_BM25_K_MAX      = 5
+KW_BM25_K_MIN        = 0
+KW_BM25_K_MAX        = 3
+KW_MIN_BM25          = 1.0
+PHRASE_K             = 3
+PHRASE_SLOP          = 1
+COMPRESS_CONTEXTS    = True
 MAX_KEYWORDS         = 10
 MAX_CONTEXT_TOKENS   = 4000
 ENCODING_NAME        = "cl100k_base"
 TEMPERATURE          = 0.2
 TOP_P                = 0.95
+USE_LLM_LEMMAS       = False
+USE_LLM_TYPOS        = False
+USE_LLM_KEYWORDS     = False
+EXPANSION_TABLE_PATH = "query_expansion_regular.json.gz"
 MAX_RESPONSE_TOKENS  = 2000
+STREAM_ANSWERS       = True
+QUERY_BUDGET         = 60.0
+SPECULATIVE_ANSWERS  = False
+SPECULATIVE_TOP_N    = 3
+LOG_LEVEL            = logging.INFO
+INDEX_CACHE_DIR      = "index_cache"
+DOC2QUERY_PATH       = "doc2query.jsonl"
+DOC2QUERY_SKIP_KWS   = True
 
 RESPONSE_INSTRUCTION = (
     "Yukarıdaki belgeler ile bu soruyu cevapla! "
     "Sonra hangi belgede bu cevabı bulduğunu kısaca belirt."
 )
+EXTRACT_INSTRUCTION = "Sen bir Türkçe anahtar kelime çıkarma asistanısın. Çıktını JSON dizi formatında ver."
+FILTER_INSTRUCTION = (
+    "Sen bir Türkçe soru-cevap asistanısın. "
+    "Aşağıdaki belgeyle soruyu cevaplayabilir misin? 'Evet' veya 'Hayır' ile yanıtla."
+)
 
 QUESTION_STOP = {
     "nedir","ne","kim","kimler","nerede","nerde",
@@ -32,7 +75,7 @@ QUESTION_STOP = {
     "nerden","nereden","niye"
 }
 
-logging.basicConfig(level=logging.DEBUG,
+logging.basicConfig(level=LOG_LEVEL,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -55,11 +98,8 @@ def load_corpus_from_dir():
     return docs, fnames
 
 
-def build_bm25_index(docs):
-    tokenized = [
-        re.findall(r"[a-zçğıöşü]+", doc.lower())
-        for doc in docs
-    ]
+def build_bm25_index(docs, analyzer=None):
+    tokenized = [analyze(doc, analyzer) for doc in docs]
     bm25 = BM25Okapi(tokenized)
     logger.info("Built BM25 index")
     return bm25
@@ -73,12 +113,12 @@ def call_llm_for_list(prompt_system: str, prompt_user: str) -> list[str]:
             {"role": "user",   "content": prompt_user}
         ],
         "temperature": TEMPERATURE,
-        "max_tokens": 200
+        "max_tokens": 200,
+        "keep_alive": KEEP_ALIVE
     }
-    logger.debug("LLM list-call payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
-    r = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=payload)
-    r.raise_for_status()
-    raw = r.json()["choices"][0]["message"]["content"]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM list-call payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
+    raw = get_client(OLLAMA_API_URLS).chat_content(payload, PRIORITY_EXTRACT)
     logger.debug(f"LLM raw list response:\n{raw!r}")
 
     cleaned = re.sub(r"```(?:\w+)?\s*", "", raw).replace("```", "").strip()
@@ -87,36 +127,34 @@ def call_llm_for_list(prompt_system: str, prompt_user: str) -> list[str]:
 
     try:
         arr = json.loads(arr_text)
-        kws = [w.strip().lower() for w in arr if isinstance(w, str)]
+        kws = [turkish_lower(w.strip()) for w in arr if isinstance(w, str)]
         logger.debug(f"Parsed JSON list: {kws}")
         return kws
     except json.JSONDecodeError:
         logger.warning("JSON parse failed; falling back to regex")
         quotes = re.findall(r'"([^"]+)"', cleaned)
         if quotes:
-            kws = [w.strip().lower() for w in quotes]
+            kws = [turkish_lower(w.strip()) for w in quotes]
             logger.debug(f"Regex-quoted fallback: {kws}")
             return kws
-        words = re.findall(r"[a-zçğıöşü]+(?: [a-zçğıöşü]+)*", cleaned.lower())
+        words = re.findall(r"[a-zçğıöşü]+(?: [a-zçğıöşü]+)*", turkish_lower(cleaned))
         logger.debug(f"Regex-word fallback: {words}")
         return words
 
 def extract_keywords(query: str) -> list[str]:
-    system = (
-        "Sen bir Türkçe anahtar kelime çıkarma asistanısın. "
+    user = (
         "Bu soruya cevap vermek için hangi kelimeler aranmalı? "
         "Kesinlikle soru-ekleri (nedir, nasıl, kim, ne, hangi…) olmasın. "
-        "Cevabını yalnızca JSON dizi formatında ver."
+        f"Soru: \"{query}\""
     )
-    user = f"Soru: \"{query}\""
-    kws = call_llm_for_list(system, user)
+    kws = call_llm_for_list(EXTRACT_INSTRUCTION, user)
     filtered = [kw for kw in kws if kw not in QUESTION_STOP]
     trimmed = filtered[:MAX_KEYWORDS]
     logger.info(f"Extracted keywords (stop-filtered & trimmed): {trimmed}")
     return trimmed
 
-def extract_additional_lists(query: str) -> dict:
-    base_sys = "Sen bir Türkçe anahtar kelime çıkarma asistanısın. Çıktını JSON dizi formatında ver."
+def extract_additional_lists(query: str, tindex=None, use_llm=True, analyzer=None) -> dict:
+    base_sys = EXTRACT_INSTRUCTION
     prompts = {
         "subject":   f"Bu sorunun öznesi kim veya ne? max 3 Soru: \"{query}\"",
         "predicate": f"Bu sorunun yüklemi ne? max 2 Soru: \"{query}\"",
@@ -133,6 +171,13 @@ def extract_additional_lists(query: str) -> dict:
             f"Soru: \"{query}\""
         )
     }
+    if not use_llm or not USE_LLM_LEMMAS:
+        prompts.pop("lemmas")
+    if tindex is not None and (not use_llm or not USE_LLM_TYPOS):
+        prompts.pop("typos")
+    if not use_llm:
+        for key in ("subject", "predicate", "names", "multiword"):
+            prompts.pop(key)
     result = {}
     for key, user_p in prompts.items():
         logger.debug(f"Extracting {key} with prompt: {user_p}")
@@ -140,17 +185,29 @@ def extract_additional_lists(query: str) -> dict:
         lst = [w for w in lst if w not in QUESTION_STOP]
         result[key] = lst[:MAX_KEYWORDS]
         logger.info(f"{key.capitalize()} extracted: {result[key]}")
+    if "lemmas" not in result:
+        result["lemmas"] = lemmas(query, QUESTION_STOP, analyzer)[:MAX_KEYWORDS]
+        logger.info(f"Lemmas (local stemmer): {result['lemmas']}")
+    if "typos" not in result:
+        result["typos"] = correct_query(query, tindex, QUESTION_STOP, analyzer)[:MAX_KEYWORDS] if tindex else []
+    if "multiword" not in result:
+        result["multiword"] = word_pairs(query, QUESTION_STOP)[:MAX_KEYWORDS]
+        logger.info(f"Multiword (query word pairs): {result['multiword']}")
+    for key in ("subject", "predicate", "names"):
+        result.setdefault(key, [])
     return result
 
-def retrieve_bm25(query, bm25, docs, fnames, k):
-    tokens = re.findall(r"[a-zçğıöşü]+", query.lower())
+def retrieve_bm25(query, bm25, docs, fnames, k, analyzer=None):
+    tokens = analyze(query, analyzer)
     logger.debug(f"BM25 query tokens: {tokens}")
-    scores = bm25.get_scores(tokens)
+    with stage("bm25"):
+        scores = bm25.get_scores(tokens)
     idxs = np.argsort(scores)[::-1][:k]
     out = []
     for idx in idxs:
         sim = float(scores[idx])
         out.append({
+            "id": int(idx),
             "text": docs[idx],
             "file_name": fnames[idx],
             "sim": sim,
@@ -160,116 +217,236 @@ def retrieve_bm25(query, bm25, docs, fnames, k):
     return out
 
 
-def chat_with_bm25(query, docs, fnames, bm25, all_kws):
-    enc = tiktoken.get_encoding(ENCODING_NAME)
-    main_ctx = retrieve_bm25(query, bm25, docs, fnames, MAIN_BM25_K)
-    kw_ctx = []
-    for kw in all_kws:
-        kw_ctx.extend(retrieve_bm25(kw, bm25, docs, fnames, KW_BM25_K))
-    seen, contexts = set(), []
-    for c in main_ctx + kw_ctx:
-        if c["file_name"] not in seen:
-            contexts.append(c)
-            seen.add(c["file_name"])
-    logger.info(f"{len(contexts)} total contexts after deduplication")
-    filtered = []
-    filter_sys = (
-        "Sen bir Türkçe soru-cevap asistanısın. "
-        "Aşağıdaki belgeyle soruyu cevaplayabilir misin? 'Evet' veya 'Hayır' ile yanıtla."
+def collect_keywords(query, tindex=None, xtable=None, deadline=None, analyzer=None, local_only=False):
+    # local_only: no LLM calls and no expansion keywords, just typos, lemmas and word pairs
+    main_kws = []
+    if xtable is not None and not USE_LLM_KEYWORDS and not local_only:
+        main_kws = expand_query(query, xtable, QUESTION_STOP, MAX_KEYWORDS, analyzer)
+    if main_kws or local_only:
+        extras = extract_additional_lists(query, tindex, use_llm=False, analyzer=analyzer)
+    else:
+        main_kws = extract_keywords(query)
+        use_llm = deadline is None or deadline.allows("extra_lists")
+        extras = extract_additional_lists(query, tindex, use_llm, analyzer)
+    logger.info(f"Main keywords: {main_kws}")
+    all_kws = (
+        main_kws
+        + extras['subject'] + extras['predicate']
+        + extras['names'] + extras['multiword']
+        + extras['typos'] + extras['lemmas']
     )
-    for ctx in contexts:
+    all_kws = list(dict.fromkeys([w.lower() for w in all_kws]))
+    logger.info(f"All retrieval keywords ({len(all_kws)}): {all_kws}")
+    return all_kws, extras
+
+
+def generate_answer(query, contexts, all_kws, enc, deadline, session=None, on_token=None, cancel=None, analyzer=None):
+    if COMPRESS_CONTEXTS and deadline.allows("compress"):
+        with stage("compress"):
+            contexts = compress_contexts(contexts, query, all_kws, analyzer=analyzer)
+    prompt, contexts = trim_prompt(query, contexts, enc, MAX_CONTEXT_TOKENS)
+    logger.debug(f"Full chat prompt:\n{prompt[:200]}…")
+
+    # final LLM call
+    final_payload = {
+        "model":      CHAT_MODEL,
+        "messages":   session.messages(prompt) if session is not None else [
+            {"role": "system", "content": RESPONSE_INSTRUCTION},
+            {"role": "user",   "content": prompt}
+        ],
+        "temperature": TEMPERATURE,
+        "top_p":       TOP_P,
+        "max_tokens":  MAX_RESPONSE_TOKENS,
+        "keep_alive":  KEEP_ALIVE,
+        "options":     context_options(MAX_CONTEXT_TOKENS, MAX_RESPONSE_TOKENS,
+                                       session.max_tokens if session is not None else 0)
+    }
+    logger.debug("Final chat payload…")
+    with stage("generate"):
+        if on_token is not None or cancel is not None:
+            answer = stream_chat_completion(OLLAMA_API_URLS, final_payload, on_token, cancel=cancel)
+        else:
+            answer = get_client(OLLAMA_API_URLS).chat_content(final_payload, PRIORITY_ANSWER)
+    return answer, final_payload, prompt, contexts
+
+
+def filter_contexts(query, contexts, deadline):
+    filtered, verdicts, unchecked = [], [], []
+    for i, ctx in enumerate(contexts):
+        if not deadline.allows("filter"):
+            unchecked = contexts[i:]
+            break
         payload = {
             "model": CHAT_MODEL,
             "messages": [
-                {"role": "system", "content": filter_sys},
-                {"role": "user",   "content": f"Belge:\n{ctx['text']}\n\nSoru: \"{query}\""}
+                {"role": "system", "content": FILTER_INSTRUCTION},
+                {"role": "user",   "content": f"Soru: \"{query}\"\n\nBelge:\n{ctx['text']}"}
             ],
             "temperature": 0.0,
-            "max_tokens": 3
+            "max_tokens": 3,
+            "keep_alive": KEEP_ALIVE
         }
-        r = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=payload)
-        r.raise_for_status()
-        ans = r.json()["choices"][0]["message"]["content"].strip().lower()
+        with stage("filter"):
+            ans = get_client(OLLAMA_API_URLS).chat_content(payload, PRIORITY_FILTER).strip().lower()
+        verdicts.append({"id": ctx["id"], "file_name": ctx["file_name"], "verdict": ans})
         if ans.startswith("evet"):
             filtered.append(ctx)
             logger.info(f"Kept {ctx['file_name']} (Evet)")
         else:
             logger.info(f"Dropped {ctx['file_name']} (Hayır)")
+    return filtered, verdicts, unchecked
+
+
+def chat_with_bm25(query, docs, fnames, bm25, all_kws, pindex=None, phrases=(), on_token=None, trace=None, session=None, deadline=None, analyzer=None):
+    deadline = deadline or Deadline()
+    enc = tiktoken.get_encoding(ENCODING_NAME)
+    phrase_ctx = []
+    if pindex is not None:
+        with stage("phrase"):
+            for phrase in phrases:
+                phrase_ctx.extend(retrieve_phrase(phrase, pindex, docs, fnames, PHRASE_K, PHRASE_SLOP, analyzer))
+    main_ctx = cut_results(retrieve_bm25(query, bm25, docs, fnames, MAIN_BM25_K_MAX, analyzer),
+                           MAIN_BM25_K_MIN, MAIN_BM25_K_MAX, label="query")
+    kw_lists = []
+    for kw in all_kws:
+        if not deadline.allows("keyword_retrieval"):
+            break
+        kw_lists.append(cut_results(retrieve_bm25(kw, bm25, docs, fnames, KW_BM25_K_MAX, analyzer),
+                                    KW_BM25_K_MIN, KW_BM25_K_MAX, floor=KW_MIN_BM25, label=kw))
+    contexts = dedup_contexts(phrase_ctx, main_ctx, *kw_lists)
+    logger.info(f"{len(contexts)} total contexts after deduplication")
+    spec = None
+    if SPECULATIVE_ANSWERS and contexts:
+        # the top hits usually survive the filter, so start answering on them right away
+        spec_ctx = contexts[:SPECULATIVE_TOP_N]
+        spec = SpeculativeAnswer(spec_ctx, lambda tok, cancel: generate_answer(
+            query, spec_ctx, all_kws, enc, deadline, session, tok, cancel, analyzer))
+    try:
+        filtered, verdicts, unchecked = filter_contexts(query, contexts, deadline)
+    except BaseException:
+        # a failed filter call must not leave the speculative answer generating
+        if spec is not None:
+            spec.abort()
+        raise
+    if unchecked:
+        # out of time: trust the main-query hits that were not checked yet
+        main_ids = {c["id"] for c in main_ctx}
+        filtered += [c for c in unchecked if c["id"] in main_ids]
+        logger.warning(f"Deadline: {len(unchecked)} contexts not filtered, kept the main-query ones")
     if not filtered:
-        logger.warning("All contexts dropped; falling back to top-5 by similarity")
-        contexts.sort(key=lambda c: c["sim"], reverse=True)
-        filtered = contexts[:5]
-    sections = []
-    for i, ctx in enumerate(filtered, 1):
-        sections.append(f"{'*'*5} start of belge {i} {'*'*5}")
-        sections.append(ctx["text"])
-        sections.append(f"{'*'*5} end of belge {i} {'*'*5}")
-
-    prompt = "\n\n".join(sections) + f"\n\nsoru: \"{query}\"\n" + RESPONSE_INSTRUCTION
-    logger.debug(f"Full chat prompt:\n{prompt[:200]}…")
-    while len(enc.encode(prompt)) > MAX_CONTEXT_TOKENS and filtered:
-        filtered.pop()
-        sec = []
-        for j, c in enumerate(filtered, 1):
-            sec.append(f"{'*'*5} start of belge {j} {'*'*5}")
-            sec.append(c["text"])
-            sec.append(f"{'*'*5} end of belge {j} {'*'*5}")
-        prompt = "\n\n".join(sec) + f"\n\nsoru: \"{query}\"\n" + RESPONSE_INSTRUCTION
+        # phrase and BM25 scores (and BM25 scores of different keywords) are not comparable, ranks are
+        logger.warning("All contexts dropped; falling back to top-5 by fused rank")
+        filtered = reciprocal_rank_fusion([phrase_ctx, main_ctx, *kw_lists], top_n=5)
+    result = spec.commit(on_token) if spec is not None and spec.matches(filtered) else None
+    if result is None:
+        if spec is not None:
+            spec.abort()
+        result = generate_answer(query, filtered, all_kws, enc, deadline, session, on_token, analyzer=analyzer)
+    answer, final_payload, prompt, filtered = result
+    if trace is not None:
+        trace["retrieved"] = [v["id"] for v in verdicts]
+        trace["verdicts"] = verdicts
+        trace["contexts"] = [{"id": c["id"], "file_name": c["file_name"], "sim": float(c["sim"])}
+                             for c in filtered]
+        if spec is not None:
+            trace["speculative"] = spec.outcome
+    if session is not None:
+        session.add(prompt, answer)
+    return answer, final_payload, prompt
 
-    # final LLM call
-    final_payload = {
-        "model":      CHAT_MODEL,
-        "messages": [
-            {"role": "system", "content": RESPONSE_INSTRUCTION},
-            {"role": "user",   "content": prompt}
-        ],
-        "temperature": TEMPERATURE,
-        "top_p":       TOP_P,
-        "max_tokens":  MAX_RESPONSE_TOKENS
+def load_resources():
+    with profile_section("load_corpus"):
+        docs, fnames = load_corpus_from_dir()
+    key = corpus_key(docs)
+    with profile_section("load_vocabulary"):
+        analyzer = Analyzer(load_or_build("regular_vocab", docs, corpus_vocabulary, INDEX_CACHE_DIR, key))
+    with profile_section("load_doc2query"):
+        d2q = load_doc2query(DOC2QUERY_PATH)
+        bm25_docs = expand_docs(docs, d2q)
+    with profile_section("build_bm25"):
+        bm25 = load_or_build("regular_bm25", bm25_docs, lambda d: build_bm25_index(d, analyzer),
+                             INDEX_CACHE_DIR, corpus_key(bm25_docs) if d2q else key)
+    with profile_section("build_phrase_index"):
+        pindex = load_or_build("regular_phrase", docs, lambda d: build_positional_index(d, analyzer),
+                               INDEX_CACHE_DIR, key)
+    with profile_section("build_typo_index"):
+        tindex = load_or_build("regular_typo", docs, lambda d: build_typo_index(d, analyzer=analyzer),
+                               INDEX_CACHE_DIR, key)
+    with profile_section("load_expansion_table"):
+        xtable = load_expansion_table(EXPANSION_TABLE_PATH)
+    return {
+        "docs":     docs,
+        "fnames":   fnames,
+        "analyzer": analyzer,
+        "bm25":     bm25,
+        "pindex":   pindex,
+        "tindex":   tindex,
+        "xtable":   xtable,
+        "doc2query": covers_corpus(docs, d2q),
     }
-    logger.debug("Final chat payload…")
-    res = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=final_payload)
-    res.raise_for_status()
-    answer = res.json()["choices"][0]["message"]["content"]
-    return answer, final_payload, prompt
+
+
+def answer_query(query, res, on_token=None, trace=None, session=None):
+    deadline = Deadline(QUERY_BUDGET)
+    with query_timer("regular") as stats:
+        with stage("keywords"):
+            # generated questions already cover the wording, so only the cheap local lists are added
+            all_kws, extras = collect_keywords(query, res["tindex"], res["xtable"], deadline, res["analyzer"],
+                                               local_only=res["doc2query"] and DOC2QUERY_SKIP_KWS)
+        result = chat_with_bm25(
+            query, res["docs"], res["fnames"], res["bm25"], all_kws,
+            res["pindex"], extras['multiword'], on_token, trace, session, deadline, res["analyzer"]
+        )
+    if trace is not None:
+        trace["keywords"] = all_kws
+        trace["budget_s"] = QUERY_BUDGET
+        trace["skipped"] = deadline.skipped
+        trace.update(stats)
+    return result
+
+
+def save_history(query, prompt, payload, answer, trace=None):
+    record = {"mode": "regular", "query": query, "model": payload["model"]}
+    record.update(trace or {})
+    record.update(prompt=prompt, answer=answer)
+    get_query_log(HISTORY_DIR).log(record)
 
 def main():
+    parser = argparse.ArgumentParser(description="Regular offline RAG REPL")
+    parser.add_argument("--session", action="store_true", help="keep follow-up questions in one conversation")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    apply_profiling_args(args)
     ensure_history_dir()
-    docs, fnames = load_corpus_from_dir()
-    bm25 = build_bm25_index(docs)
+    start_metrics_dump(os.path.join(HISTORY_DIR, "metrics.prom"))
+    res = load_resources()
+
+    session = ChatSession(RESPONSE_INSTRUCTION, encoding=ENCODING_NAME) if args.session else None
 
     print("RAG ready.")
     while True:
         query = input("You: ").strip()
         if query.lower() in ("exit","quit"):
             break
+        if query.lower() == "/yeni" and session is not None:
+            session.reset()
+            print("Yeni sohbet başlatıldı.")
+            continue
 
         try:
-            main_kws = extract_keywords(query)
-            logger.info(f"Main keywords: {main_kws}")
-
-            extras = extract_additional_lists(query)
-            all_kws = (
-                main_kws
-                + extras['subject'] + extras['predicate']
-                + extras['names'] + extras['multiword']
-                + extras['typos'] + extras['lemmas']
-            )
-            all_kws = list(dict.fromkeys([w.lower() for w in all_kws]))
-            logger.info(f"All retrieval keywords ({len(all_kws)}): {all_kws}")
-            answer, payload, prompt = chat_with_bm25(
-                query, docs, fnames, bm25, all_kws
-            )
-            print("gem:", answer)
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            with open(os.path.join(HISTORY_DIR, f"{ts}.txt"), "w", encoding="utf-8") as hf:
-                hf.write(f"Soru: {query}\n\nPrompt:\n{prompt}\n\nPayload:\n")
-                hf.write(json.dumps(payload, ensure_ascii=False, indent=2))
-                hf.write("\n\nCevap:\n" + answer)
+            printer = TokenPrinter("gem: ") if STREAM_ANSWERS else None
+            trace = {}
+            with profile_section("query"):
+                answer, payload, prompt = answer_query(query, res, printer, trace, session)
+            if printer is not None:
+                printer.finish()
+            else:
+                print("gem:", answer)
+            save_history(query, prompt, payload, answer, trace)
 
         except Exception:
             logger.exception("Error in main loop")
             print("❗️ Something went wrong.")
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
@@ -1,16 +1,34 @@
+import asyncio
 import anthropic
 import faiss
 import pickle
 import numpy as np
 import requests
 import logging
+import argparse
+from ht_metrics import query_timer, record_llm_call, stage, start_metrics_dump
+from ht_profiling import add_profiling_args, apply_profiling_args, profile_section
 
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+LOG_LEVEL = logging.INFO
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
 
 #KEYS
 ANTHROPIC_API_KEY = "xx"
 AZURE_OPENAI_API_KEY = "xx"
 AZURE_OPENAI_ENDPOINT = "xx"
+ANTHROPIC_BASE_URL = None  # None = api.anthropic.com, or a local stub such as ht_mock_ollama
+
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+SYSTEM_PROMPT = (
+    "Sen bir türkçe soru-cevap asistanısın. Sana yöneltilen sorulara yalnızca "
+    "sağlanan belgelerden referans alarak cevap ver. Belgelerdeki metinleri "
+    "değiştirmen gerekmez; ancak, varsa yazım ve dilbilgisi hatalarını düzelt. "
+    "Ana fikir ve konudan sapmadığından emin ol ve cevaplarını her zaman "
+    "dikkatlice değerlendir. Verdiğin her cevaba mutlaka belgelerden bir referans "
+    "ekle. Sağlanan kaynaklarda bir bilgi bulunmaz ise: cevap verme, bulamadığını belirt. "
+    "Referansları cevabın sonunda listele."
+)
 
 #Anthropic client
 try:
@@ -29,8 +47,10 @@ def embed_text_with_azure_openai(text, api_key, endpoint):
         "input": text,
     }
     try:
-        response = requests.post(endpoint, headers=headers, json=payload)
+        with stage("embed"):
+            response = requests.post(endpoint, headers=headers, json=payload)
         response.raise_for_status()
+        record_llm_call("embeddings", endpoint, response.json().get("usage"))
         logging.info(f"Embedding generated for text of length {len(text)}.")
         return response.json()["data"][0]["embedding"]
     except requests.exceptions.RequestException as e:
@@ -53,10 +73,11 @@ def load_faiss_index(index_path="faiss_index.bin", docs_path="documents.pkl"):
 def search_faiss_index(query_embedding, faiss_index, documents, file_names,
                        top_k=10, distance_threshold=0.5):
     try:
-        distances, indices = faiss_index.search(
-            np.array([query_embedding], dtype=np.float32),
-            top_k
-        )
+        with stage("faiss"):
+            distances, indices = faiss_index.search(
+                np.array([query_embedding], dtype=np.float32),
+                top_k
+            )
         results = []
         for dist, idx in zip(distances[0], indices[0]):
             results.append({
@@ -77,6 +98,13 @@ def search_faiss_index(query_embedding, faiss_index, documents, file_names,
         logging.error(f"Error searching FAISS index: {e}")
         return []
 
+def format_citation(c):
+    # SDK citation objects and plain dicts both occur
+    get = c.get if isinstance(c, dict) else lambda key, default=None: getattr(c, key, default)
+    doc_title = get("document_title") or "Unknown"
+    return f"[{doc_title} (chars {get('start_char_index', 0)}-{get('end_char_index', 0)})]"
+
+
 def parse_claude_response(claude_message):
     if not hasattr(claude_message, "content"):
         return "No content found in the response."
@@ -87,28 +115,14 @@ def parse_claude_response(claude_message):
 
             #citations append
             if getattr(block, "citations", None):
-                citations_list = []
-                for c in block.citations:
-                    doc_title = c.get("document_title", "Unknown")
-                    start_idx = c.get("start_char_index", 0)
-                    end_idx = c.get("end_char_index", 0)
-                    citations_list.append(f"[{doc_title} (chars {start_idx}-{end_idx})]")
+                citations_list = [format_citation(c) for c in block.citations]
                 if citations_list:
                     output += " " + ", ".join(citations_list)
 
     return output.strip()
 
 
-def chat_with_claude(query, relevant_documents, model="claude-3-5-sonnet-20241022", max_tokens=4000, temperature=0.2):
-    system_prompt = (
-        "Sen bir türkçe soru-cevap asistanısın. Sana yöneltilen sorulara yalnızca "
-        "sağlanan belgelerden referans alarak cevap ver. Belgelerdeki metinleri "
-        "değiştirmen gerekmez; ancak, varsa yazım ve dilbilgisi hatalarını düzelt. "
-        "Ana fikir ve konudan sapmadığından emin ol ve cevaplarını her zaman "
-        "dikkatlice değerlendir. Verdiğin her cevaba mutlaka belgelerden bir referans "
-        "ekle. Sağlanan kaynaklarda bir bilgi bulunmaz ise: cevap verme, bulamadığını belirt. "
-        "Referansları cevabın sonunda listele."
-    )
+def build_messages(query, relevant_documents):
     sources = [
         {
             "type": "document",
@@ -127,48 +141,209 @@ def chat_with_claude(query, relevant_documents, model="claude-3-5-sonnet-2024102
         "role": "user",
         "content": sources + [{"type": "text", "text": query}]
     }
-    messages = [user_message]
+    return [user_message]
+
+
+def chat_with_claude(query, relevant_documents, model=CLAUDE_MODEL, max_tokens=4000, temperature=0.2):
+    # temperature goes through extra_body: not every SDK release exposes it, the API accepts it either way
+    messages = build_messages(query, relevant_documents)
 
     try:
-        response = client.messages.create(
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            system=system_prompt,
-            messages=messages
-        )
-        logging.debug(f"Raw response from Claude: {response}")
+        with stage("generate"):
+            response = client.messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                system=SYSTEM_PROMPT,
+                messages=messages,
+                extra_body={"temperature": temperature}
+            )
+        record_llm_call("messages", "anthropic", {
+            "prompt_tokens": response.usage.input_tokens,
+            "completion_tokens": response.usage.output_tokens,
+        })
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Raw response from Claude: {response}")
         return parse_claude_response(response)
     except Exception as e:
         logging.error(f"Error during API call: {e}")
         return "An unexpected error occurred. Please check the logs."
 
 
+_async_client = None
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL)
+    return _async_client
+
+
+async def stream_chat_with_claude(query, relevant_documents, on_text=None, model=CLAUDE_MODEL,
+                                  max_tokens=4000, temperature=0.2):
+    # same output as parse_claude_response, but text is handed out as it arrives and
+    # a block's citations are appended as soon as the block is complete
+    parts, citations = [], []
+    emit = on_text or (lambda text: None)
+    try:
+        with stage("generate"):
+            async with get_async_client().messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                system=SYSTEM_PROMPT,
+                messages=build_messages(query, relevant_documents),
+                extra_body={"temperature": temperature}
+            ) as stream:
+                async for event in stream:
+                    if event.type == "text":
+                        parts.append(event.text)
+                        emit(event.text)
+                    elif event.type == "citation":
+                        citations.append(format_citation(event.citation))
+                    elif event.type == "content_block_stop" and citations:
+                        tail = " " + ", ".join(citations)
+                        parts.append(tail)
+                        emit(tail)
+                        citations = []
+                response = await stream.get_final_message()
+        record_llm_call("messages", "anthropic", {
+            "prompt_tokens": response.usage.input_tokens,
+            "completion_tokens": response.usage.output_tokens,
+        })
+        return "".join(parts).strip()
+    except Exception as e:
+        logging.error(f"Error during streaming API call: {e}")
+        return "An unexpected error occurred. Please check the logs."
+
+
+async def retrieve_async(query, faiss_index, documents, file_names, top_k=20, distance_threshold=0.5):
+    # the embedding call and FAISS are blocking, so they run in a worker thread (which keeps the query's metrics context)
+    query_embedding = await asyncio.to_thread(
+        embed_text_with_azure_openai, query, AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT
+    )
+    return await asyncio.to_thread(
+        search_faiss_index, query_embedding, faiss_index, documents, file_names, top_k, distance_threshold
+    )
+
+
+def print_delta(text):
+    print(text, end="", flush=True)
+
+
+async def answer_after(query, previous, faiss_index, documents, file_names):
+    with query_timer("self_rag") as stats:
+        try:
+            relevant_docs = await retrieve_async(query, faiss_index, documents, file_names)
+        except Exception:
+            relevant_docs = None
+        if previous is not None:
+            # answers are printed in order, so wait for the one still streaming
+            t0 = asyncio.get_running_loop().time()
+            await previous
+            stats["timings"]["wait_previous_s"] = asyncio.get_running_loop().time() - t0
+        if relevant_docs is None:
+            print("Claude: Failed to generate query embedding. Please try again.")
+            return None
+        if not relevant_docs:
+            print("Claude: Sorry, I couldn't find any relevant documents.")
+            return None
+        print("Claude: ", end="", flush=True)
+        response_text = await stream_chat_with_claude(query, relevant_docs, print_delta)
+        print()
+    logging.info(f"Query timings: {stats['timings']}, LLM usage: {stats['llm']}")
+    return response_text
+
+
+async def stream_from_queue(queue, faiss_index, documents, file_names):
+    # query n+1 is embedded and searched while answer n is still streaming; None ends the stream
+    previous = None
+    while (query := await queue.get()) is not None:
+        task = asyncio.create_task(answer_after(query, previous, faiss_index, documents, file_names))
+        if previous is not None:
+            await previous
+        previous = task
+    if previous is not None:
+        await previous
+
+
+async def run_streaming(queries, faiss_index, documents, file_names):
+    queue = asyncio.Queue()
+    for query in queries:
+        queue.put_nowait(query)
+    queue.put_nowait(None)
+    await stream_from_queue(queue, faiss_index, documents, file_names)
+
+
+async def streaming_repl(faiss_index, documents, file_names):
+    # input is read in its own thread, so the next question is retrieved while the answer is printing
+    queue = asyncio.Queue()
+    answers = asyncio.create_task(stream_from_queue(queue, faiss_index, documents, file_names))
+    print("Type a question and press Enter; the next one can be typed while an answer is printing.")
+    while True:
+        try:
+            user_input = await asyncio.to_thread(input)
+        except EOFError:
+            break
+        if user_input.lower() in ["exit", "quit"]:
+            break
+        if user_input.strip():
+            queue.put_nowait(user_input)
+    queue.put_nowait(None)
+    await answers
+    print("Goodbye!")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Claude chat with citations over the FAISS index")
+    parser.add_argument("--stream", action="store_true", help="print the answer while it is generated and read the next question meanwhile")
+    parser.add_argument("--questions", metavar="FILE", help="answer one question per line, streaming and pipelined")
+    parser.add_argument("--anthropic-url", help="Anthropic API base URL (e.g. a local stub)")
+    parser.add_argument("--embedding-url", help="embedding endpoint overriding AZURE_OPENAI_ENDPOINT")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    apply_profiling_args(args)
+    if args.anthropic_url:
+        ANTHROPIC_BASE_URL = args.anthropic_url
+        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL)
+    if args.embedding_url:
+        AZURE_OPENAI_ENDPOINT = args.embedding_url
     index_path = "faiss_index.bin"
     docs_path = "documents.pkl"
-    faiss_index, documents, file_names = load_faiss_index(index_path, docs_path)
+    with profile_section("load_index"):
+        faiss_index, documents, file_names = load_faiss_index(index_path, docs_path)
+    start_metrics_dump("metrics.prom")
+
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        asyncio.run(run_streaming(questions, faiss_index, documents, file_names))
+        exit()
 
     print("Welcome to the Claude Chat with Citations!")
+    if args.stream:
+        asyncio.run(streaming_repl(faiss_index, documents, file_names))
+        exit()
     while True:
         user_input = input("You: ")
         if user_input.lower() in ["exit", "quit"]:
             print("Goodbye!")
             break
-        try:
-            query_embedding = embed_text_with_azure_openai(
-                user_input,
-                AZURE_OPENAI_API_KEY,
-                AZURE_OPENAI_ENDPOINT
-            )
-        except Exception:
-            print("Claude: Failed to generate query embedding. Please try again.")
-            continue
+        with profile_section("query"), query_timer("self_rag") as stats:
+            try:
+                query_embedding = embed_text_with_azure_openai(
+                    user_input,
+                    AZURE_OPENAI_API_KEY,
+                    AZURE_OPENAI_ENDPOINT
+                )
+            except Exception:
+                print("Claude: Failed to generate query embedding. Please try again.")
+                continue
 
-        relevant_docs = search_faiss_index(query_embedding, faiss_index, documents, file_names, top_k=20, distance_threshold=0.5)
-        if not relevant_docs:
-            print("Claude: Sorry, I couldn't find any relevant documents.")
-            continue
+            relevant_docs = search_faiss_index(query_embedding, faiss_index, documents, file_names, top_k=20, distance_threshold=0.5)
+            if not relevant_docs:
+                print("Claude: Sorry, I couldn't find any relevant documents.")
+                continue
 
-        response_text = chat_with_claude(user_input, relevant_docs)
+            response_text = chat_with_claude(user_input, relevant_docs)
         print(f"Claude: {response_text}")
+        logging.info(f"Query timings: {stats['timings']}, LLM usage: {stats['llm']}")
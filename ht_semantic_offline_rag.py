@@ -2,32 +2,78 @@ import os
 import re
 import json
 import logging
+import argparse
 import faiss
 import pickle
-import requests
 import numpy as np
 import tiktoken
-from datetime import datetime
+from ht_turkish_text import Analyzer, corpus_vocabulary, lemmas, turkish_lower, word_pairs
+from ht_typo_corrector import build_typo_index, correct_query
+from ht_query_expansion import expand_query, load_expansion_table
+from ht_mmr import mmr_contexts
+from ht_passage_compressor import compress_contexts
+from ht_embed_batcher import EmbeddingBatcher
+from ht_index_cache import corpus_key, load_or_build
+from ht_doc2query import attach_question_vectors, covers_corpus
+from ht_query_log import get_query_log
+from ht_metrics import query_timer, stage, start_metrics_dump
+from ht_profiling import add_profiling_args, apply_profiling_args, profile_section
+from ht_deadline import Deadline
+from ht_adaptive_k import cut_results
+from ht_prompt_builder import dedup_contexts, trim_prompt
+from ht_speculative import SpeculativeAnswer
+from ht_chat_session import KEEP_ALIVE, ChatSession, context_options
+from ht_streaming import TokenPrinter, stream_chat_completion
+from ht_llm_client import (
+    PRIORITY_ANSWER, PRIORITY_EMBED, PRIORITY_EXTRACT, PRIORITY_FILTER, get_client
+)
 
 OLLAMA_API_URL       = "http://localhost:xxx"
+OLLAMA_API_URLS      = [OLLAMA_API_URL]
 EMBED_MODEL          = "mxbai-embed-large"
+EMBED_BATCH_WINDOW   = 0.003
+EMBED_MAX_BATCH      = 64
 CHAT_MODEL           = "gemma3:4b-it-q8_0"
 INDEX_PATH           = "xxx.bin"
 META_PATH            = "documents.pkl"
 HISTORY_DIR          = r"xxx"
-MAIN_SEM_K           = 5
-KW_SEM_K             = 2
+MAIN_SEM_K_MIN       = 2
+MAIN_SEM_K_MAX       = 8
+KW_SEM_K_MIN         = 0
+KW_SEM_K_MAX         = 3
+KW_MIN_SIM_REL       = 0.8
+USE_MMR              = True
+MMR_TOP_N            = 5
+MMR_LAMBDA           = 0.7
+COMPRESS_CONTEXTS    = True
 MAX_KEYWORDS         = 10
 MAX_CONTEXT_TOKENS   = 4000
 ENCODING_NAME        = "cl100k_base"
 TEMPERATURE          = 0.2
 TOP_P                = 0.95
+USE_LLM_LEMMAS       = False
+USE_LLM_TYPOS        = False
+USE_LLM_KEYWORDS     = False
+EXPANSION_TABLE_PATH = "query_expansion_semantic.json.gz"
 MAX_RESPONSE_TOKENS  = 2000
+STREAM_ANSWERS       = True
+QUERY_BUDGET         = 60.0
+SPECULATIVE_ANSWERS  = False
+SPECULATIVE_TOP_N    = 3
+LOG_LEVEL            = logging.INFO
+INDEX_CACHE_DIR      = "index_cache"
+DOC2QUERY_VECTORS    = "doc2query_vectors.npz"
+DOC2QUERY_SKIP_KWS   = True
 
 RESPONSE_INSTRUCTION = (
     "Yukarıdaki belgeler ile bu soruyu cevapla! "
     "Sonra hangi belgede bu cevabı bulduğunu kısaca belirt."
 )
+EXTRACT_INSTRUCTION = "Sen bir Türkçe anahtar kelime çıkarma asistanısın. Çıktını JSON dizi formatında ver."
+FILTER_INSTRUCTION = (
+    "Sen bir Türkçe soru-cevap asistanısın. "
+    "Aşağıdaki belgeyle soruyu cevaplayabilir misin? 'Evet' veya 'Hayır' ile yanıtla."
+)
 
 QUESTION_STOP = {
     "nedir","ne","kim","kimler","nerede","nerde",
@@ -35,7 +81,7 @@ QUESTION_STOP = {
     "nerden","nereden","niye"
 }
 
-logging.basicConfig(level=logging.DEBUG,
+logging.basicConfig(level=LOG_LEVEL,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -56,21 +102,39 @@ def load_index_and_metadata():
 
 
 def embed(text: str) -> np.ndarray:
-    payload = {"model": EMBED_MODEL, "input": [text]}
-    logger.debug(f"Embedding payload: {json.dumps(payload, ensure_ascii=False)}")
-    resp = requests.post(f"{OLLAMA_API_URL}/v1/embeddings", json=payload)
-    resp.raise_for_status()
-    emb = np.array(resp.json()["data"][0]["embedding"], dtype=np.float32)
-    logger.debug(f"Received embedding (dim={emb.shape[0]}) preview={emb[:5]}")
+    with stage("embed"):
+        emb = embed_batcher.embed(text)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received embedding (dim={emb.shape[0]}) preview={emb[:5]}")
     return emb
 
 
+def embed_batch(texts: list[str]) -> np.ndarray:
+    payload = {"model": EMBED_MODEL, "input": texts}
+    resp = get_client(OLLAMA_API_URLS).embeddings(payload, PRIORITY_EMBED)
+    data = sorted(resp["data"], key=lambda d: d["index"])
+    logger.debug(f"Received {len(data)} embeddings")
+    return np.array([d["embedding"] for d in data], dtype=np.float32)
+
+
+embed_batcher = EmbeddingBatcher(embed_batch, EMBED_BATCH_WINDOW, EMBED_MAX_BATCH)
+
+
+def embed_many(texts: list[str]) -> np.ndarray:
+    with stage("embed"):
+        return embed_batcher.embed_many(texts)
+
+
 def retrieve_semantic(query_emb, index, docs, fnames, k):
-    D, I = index.search(query_emb.reshape(1, -1), k)
+    with stage("faiss"):
+        D, I = index.search(query_emb.reshape(1, -1), k)
     out = []
     for dist, idx in zip(D[0], I[0]):
+        if idx < 0:
+            continue
         sim = 1.0 / (1.0 + dist)
         out.append({
+            "id": int(idx),
             "text": docs[idx],
             "file_name": fnames[idx],
             "sim": sim,
@@ -88,42 +152,40 @@ def call_llm_for_list(prompt_system: str, prompt_user: str) -> list[str]:
             {"role": "user",   "content": prompt_user}
         ],
         "temperature": TEMPERATURE,
-        "max_tokens": 200
+        "max_tokens": 200,
+        "keep_alive": KEEP_ALIVE
     }
-    logger.debug("LLM list‐call payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
-    r = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=payload)
-    r.raise_for_status()
-    raw = r.json()["choices"][0]["message"]["content"]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM list‐call payload:\n" + json.dumps(payload, ensure_ascii=False, indent=2))
+    raw = get_client(OLLAMA_API_URLS).chat_content(payload, PRIORITY_EXTRACT)
     cleaned = re.sub(r"```(?:\w+)?\s*", "", raw).replace("```", "").strip()
     m = re.search(r"\[.*\]", cleaned, flags=re.DOTALL)
     arr_text = m.group(0) if m else cleaned
     try:
         arr = json.loads(arr_text)
-        return [w.strip().lower() for w in arr if isinstance(w, str)]
+        return [turkish_lower(w.strip()) for w in arr if isinstance(w, str)]
     except json.JSONDecodeError:
         quotes = re.findall(r'"([^"]+)"', cleaned)
         if quotes:
-            return [w.strip().lower() for w in quotes]
-        return re.findall(r"[a-zçğıöşü]+(?: [a-zçğıöşü]+)*", cleaned.lower())
+            return [turkish_lower(w.strip()) for w in quotes]
+        return re.findall(r"[a-zçğıöşü]+(?: [a-zçğıöşü]+)*", turkish_lower(cleaned))
 
 
 def extract_keywords(query: str) -> list[str]:
-    system = (
-        "Sen bir Türkçe anahtar kelime çıkarma asistanısın. "
+    user = (
         "Bu soruya cevap vermek için hangi kelimeler aranmalı? "
-        "Kesinlikle soru-ekleri (nedir, nasıl, kim, ne, hangi vs) olmasın."
-        "Cevabını yalnızca JSON dizi formatında ver."
+        "Kesinlikle soru-ekleri (nedir, nasıl, kim, ne, hangi vs) olmasın. "
+        f"Soru: \"{query}\""
     )
-    user = f"Soru: \"{query}\""
-    kws = call_llm_for_list(system, user)
+    kws = call_llm_for_list(EXTRACT_INSTRUCTION, user)
     filtered = [kw for kw in kws if kw not in QUESTION_STOP]
     trimmed = filtered[:MAX_KEYWORDS]
     logger.info(f"Extracted keywords (stop-filtered & trimmed): {trimmed}")
     return trimmed
 
 
-def extract_additional_lists(query: str) -> dict:
-    base_sys = "Sen bir Türkçe anahtar kelime çıkarma asistanısın. Çıktını JSON dizi formatında ver."
+def extract_additional_lists(query: str, tindex=None, use_llm=True, analyzer=None) -> dict:
+    base_sys = EXTRACT_INSTRUCTION
     prompts = {
         "subject":   f"Bu sorunun öznesi kim veya ne? Soru: \"{query}\"",
         "predicate": f"Bu sorunun yüklemi ne? Soru: \"{query}\"",
@@ -140,109 +202,246 @@ def extract_additional_lists(query: str) -> dict:
             f"Soru: \"{query}\""
         )
     }
+    if not use_llm or not USE_LLM_LEMMAS:
+        prompts.pop("lemmas")
+    if tindex is not None and (not use_llm or not USE_LLM_TYPOS):
+        prompts.pop("typos")
+    if not use_llm:
+        for key in ("subject", "predicate", "names", "multiword"):
+            prompts.pop(key)
     result = {}
     for key, user_p in prompts.items():
         lst = call_llm_for_list(base_sys, user_p)
         lst = [w for w in lst if w not in QUESTION_STOP]
         result[key] = lst[:MAX_KEYWORDS]
         logger.info(f"{key.capitalize()} extracted: {result[key]}")
+    if "lemmas" not in result:
+        result["lemmas"] = lemmas(query, QUESTION_STOP, analyzer)[:MAX_KEYWORDS]
+        logger.info(f"Lemmas (local stemmer): {result['lemmas']}")
+    if "typos" not in result:
+        result["typos"] = correct_query(query, tindex, QUESTION_STOP, analyzer)[:MAX_KEYWORDS] if tindex else []
+    if "multiword" not in result:
+        result["multiword"] = word_pairs(query, QUESTION_STOP)[:MAX_KEYWORDS]
+        logger.info(f"Multiword (query word pairs): {result['multiword']}")
+    for key in ("subject", "predicate", "names"):
+        result.setdefault(key, [])
     return result
 
 
-def chat_with_semantic(query, index, docs, fnames, all_kws):
-    enc = tiktoken.get_encoding(ENCODING_NAME)
-    main_ctx = retrieve_semantic(embed(query), index, docs, fnames, MAIN_SEM_K)
-    kw_ctx = []
-    for kw in all_kws:
-        kw_ctx.extend(retrieve_semantic(embed(kw), index, docs, fnames, KW_SEM_K))
-    seen, contexts = set(), []
-    for c in main_ctx + kw_ctx:
-        if c["file_name"] not in seen:
-            contexts.append(c)
-            seen.add(c["file_name"])
-    logger.info(f"{len(contexts)} contexts after deduplication")
-    filtered = []
-    filter_sys = (
-        "Sen bir Türkçe soru-cevap asistanısın. "
-        "Aşağıdaki belgeyle soruyu cevaplayabilir misin? 'Evet' veya 'Hayır' ile yanıtla."
+def collect_keywords(query, tindex=None, xtable=None, deadline=None, analyzer=None, local_only=False):
+    # local_only: no LLM calls and no expansion keywords, just typos, lemmas and word pairs
+    main_kws = []
+    if xtable is not None and not USE_LLM_KEYWORDS and not local_only:
+        main_kws = expand_query(query, xtable, QUESTION_STOP, MAX_KEYWORDS, analyzer)
+    if main_kws or local_only:
+        extras = extract_additional_lists(query, tindex, use_llm=False, analyzer=analyzer)
+    else:
+        main_kws = extract_keywords(query)
+        use_llm = deadline is None or deadline.allows("extra_lists")
+        extras = extract_additional_lists(query, tindex, use_llm, analyzer)
+    logger.info(f"Main keywords: {main_kws}")
+    all_kws = (
+        main_kws
+        + extras['subject'] + extras['predicate']
+        + extras['names'] + extras['multiword']
+        + extras['typos'] + extras['lemmas']
     )
-    for ctx in contexts:
+    all_kws = list(dict.fromkeys([w.lower() for w in all_kws]))
+    logger.info(f"All retrieval keywords ({len(all_kws)}): {all_kws}")
+    return all_kws, extras
+
+
+def generate_answer(query, contexts, all_kws, enc, deadline, q_emb, session=None, on_token=None, cancel=None,
+                    analyzer=None):
+    if COMPRESS_CONTEXTS and deadline.allows("compress"):
+        with stage("compress"):
+            contexts = compress_contexts(contexts, query, all_kws, q_emb, embed_many, analyzer)
+    prompt, contexts = trim_prompt(query, contexts, enc, MAX_CONTEXT_TOKENS)
+    final_payload = {
+        "model":      CHAT_MODEL,
+        "messages":   session.messages(prompt) if session is not None else [
+            {"role": "system", "content": RESPONSE_INSTRUCTION},
+            {"role": "user",   "content": prompt}
+        ],
+        "temperature": TEMPERATURE,
+        "top_p":       TOP_P,
+        "max_tokens":  MAX_RESPONSE_TOKENS,
+        "keep_alive":  KEEP_ALIVE,
+        "options":     context_options(MAX_CONTEXT_TOKENS, MAX_RESPONSE_TOKENS,
+                                       session.max_tokens if session is not None else 0)
+    }
+    with stage("generate"):
+        if on_token is not None or cancel is not None:
+            answer = stream_chat_completion(OLLAMA_API_URLS, final_payload, on_token, cancel=cancel)
+        else:
+            answer = get_client(OLLAMA_API_URLS).chat_content(final_payload, PRIORITY_ANSWER)
+    return answer, final_payload, prompt, contexts
+
+
+def filter_contexts(query, contexts, deadline):
+    filtered, verdicts, unchecked = [], [], []
+    for i, ctx in enumerate(contexts):
+        if not deadline.allows("filter"):
+            unchecked = contexts[i:]
+            break
         payload = {
             "model": CHAT_MODEL,
             "messages": [
-                {"role": "system", "content": filter_sys},
-                {"role": "user",   "content": f"Belge:\n{ctx['text']}\n\nSoru: \"{query}\""}
+                {"role": "system", "content": FILTER_INSTRUCTION},
+                {"role": "user",   "content": f"Soru: \"{query}\"\n\nBelge:\n{ctx['text']}"}
             ],
             "temperature": 0.0,
-            "max_tokens": 5
+            "max_tokens": 5,
+            "keep_alive": KEEP_ALIVE
         }
-        r = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=payload)
-        r.raise_for_status()
-        ans = r.json()["choices"][0]["message"]["content"].strip().lower()
+        with stage("filter"):
+            ans = get_client(OLLAMA_API_URLS).chat_content(payload, PRIORITY_FILTER).strip().lower()
+        verdicts.append({"id": ctx["id"], "file_name": ctx["file_name"], "verdict": ans})
         if ans.startswith("evet"):
             filtered.append(ctx)
+    return filtered, verdicts, unchecked
+
+
+def chat_with_semantic(query, index, docs, fnames, all_kws, on_token=None, trace=None, session=None, deadline=None,
+                       analyzer=None):
+    deadline = deadline or Deadline()
+    enc = tiktoken.get_encoding(ENCODING_NAME)
+    q_emb = embed(query)
+    main_ctx = cut_results(retrieve_semantic(q_emb, index, docs, fnames, MAIN_SEM_K_MAX),
+                           MAIN_SEM_K_MIN, MAIN_SEM_K_MAX, label="query")
+    # a keyword is only worth its contexts if it matches nearly as well as the question itself
+    kw_floor = KW_MIN_SIM_REL * main_ctx[0]["sim"] if main_ctx else 0.0
+    kw_ctx = []
+    for kw in all_kws:
+        if not deadline.allows("keyword_retrieval"):
+            break
+        kw_ctx.extend(cut_results(retrieve_semantic(embed(kw), index, docs, fnames, KW_SEM_K_MAX),
+                                  KW_SEM_K_MIN, KW_SEM_K_MAX, floor=kw_floor, label=kw))
+    contexts = dedup_contexts(main_ctx, kw_ctx)
+    logger.info(f"{len(contexts)} contexts after deduplication")
+    if USE_MMR:
+        with stage("mmr"):
+            contexts = mmr_contexts(q_emb, contexts, index, MMR_TOP_N, MMR_LAMBDA)
+    spec = None
+    if SPECULATIVE_ANSWERS and contexts:
+        # the top hits usually survive the filter, so start answering on them right away
+        spec_ctx = contexts[:SPECULATIVE_TOP_N]
+        spec = SpeculativeAnswer(spec_ctx, lambda tok, cancel: generate_answer(
+            query, spec_ctx, all_kws, enc, deadline, q_emb, session, tok, cancel, analyzer))
+    try:
+        filtered, verdicts, unchecked = filter_contexts(query, contexts, deadline)
+    except BaseException:
+        # a failed filter call must not leave the speculative answer generating
+        if spec is not None:
+            spec.abort()
+        raise
+    if unchecked:
+        # out of time: trust the main-query hits that were not checked yet
+        main_ids = {c["id"] for c in main_ctx}
+        filtered += [c for c in unchecked if c["id"] in main_ids]
+        logger.warning(f"Deadline: {len(unchecked)} contexts not filtered, kept the main-query ones")
     if not filtered:
-        contexts.sort(key=lambda c: c["sim"], reverse=True)
-        filtered = contexts[:5]
-    sections = []
-    for i, ctx in enumerate(filtered, 1):
-        sections.append(f"{'*'*5} start of belge {i} {'*'*5}")
-        sections.append(ctx["text"])
-        sections.append(f"{'*'*5} end of belge {i} {'*'*5}")
-
-    prompt = "\n\n".join(sections) + f"\n\nsoru: \"{query}\"\n" + RESPONSE_INSTRUCTION
-    while len(enc.encode(prompt)) > MAX_CONTEXT_TOKENS and filtered:
-        filtered.pop()
-        sec = []
-        for j, c in enumerate(filtered, 1):
-            sec.append(f"{'*'*5} start of belge {j} {'*'*5}")
-            sec.append(c["text"])
-            sec.append(f"{'*'*5} end of belge {j} {'*'*5}")
-        prompt = "\n\n".join(sec) + f"\n\nsoru: \"{query}\"\n" + RESPONSE_INSTRUCTION
-    final_payload = {
-        "model":      CHAT_MODEL,
-        "messages": [
-            {"role": "system", "content": RESPONSE_INSTRUCTION},
-            {"role": "user",   "content": prompt}
-        ],
-        "temperature": TEMPERATURE,
-        "top_p":       TOP_P,
-        "max_tokens":  MAX_RESPONSE_TOKENS
+        filtered = sorted(contexts, key=lambda c: c["sim"], reverse=True)[:5]
+    result = spec.commit(on_token) if spec is not None and spec.matches(filtered) else None
+    if result is None:
+        if spec is not None:
+            spec.abort()
+        result = generate_answer(query, filtered, all_kws, enc, deadline, q_emb, session, on_token,
+                                 analyzer=analyzer)
+    answer, final_payload, prompt, filtered = result
+    if trace is not None:
+        trace["retrieved"] = [v["id"] for v in verdicts]
+        trace["verdicts"] = verdicts
+        trace["contexts"] = [{"id": c["id"], "file_name": c["file_name"], "sim": float(c["sim"])}
+                             for c in filtered]
+        if spec is not None:
+            trace["speculative"] = spec.outcome
+    if session is not None:
+        session.add(prompt, answer)
+    return answer, final_payload, prompt
+
+
+def load_resources():
+    with profile_section("load_index"):
+        index, docs, fnames = load_index_and_metadata()
+    with profile_section("load_doc2query"):
+        index = attach_question_vectors(index, docs, DOC2QUERY_VECTORS)
+    key = corpus_key(docs)
+    with profile_section("load_vocabulary"):
+        analyzer = Analyzer(load_or_build("semantic_vocab", docs, corpus_vocabulary, INDEX_CACHE_DIR, key))
+    with profile_section("build_typo_index"):
+        tindex = load_or_build("semantic_typo", docs, lambda d: build_typo_index(d, analyzer=analyzer),
+                               INDEX_CACHE_DIR, key)
+    with profile_section("load_expansion_table"):
+        xtable = load_expansion_table(EXPANSION_TABLE_PATH)
+    return {
+        "index":    index,
+        "docs":     docs,
+        "fnames":   fnames,
+        "analyzer": analyzer,
+        "tindex":   tindex,
+        "xtable":   xtable,
+        "doc2query": covers_corpus(docs, index=index),
     }
-    res = requests.post(f"{OLLAMA_API_URL}/v1/chat/completions", json=final_payload)
-    res.raise_for_status()
-    return res.json()["choices"][0]["message"]["content"], final_payload, prompt
+
+
+def answer_query(query, res, on_token=None, trace=None, session=None):
+    deadline = Deadline(QUERY_BUDGET)
+    with query_timer("semantic") as stats:
+        with stage("keywords"):
+            # generated questions already cover the wording, so only the cheap local lists are added
+            all_kws, extras = collect_keywords(query, res["tindex"], res["xtable"], deadline, res["analyzer"],
+                                               local_only=res["doc2query"] and DOC2QUERY_SKIP_KWS)
+        result = chat_with_semantic(
+            query, res["index"], res["docs"], res["fnames"], all_kws, on_token, trace, session, deadline,
+            res["analyzer"]
+        )
+    if trace is not None:
+        trace["keywords"] = all_kws
+        trace["budget_s"] = QUERY_BUDGET
+        trace["skipped"] = deadline.skipped
+        trace.update(stats)
+    return result
+
+
+def save_history(query, prompt, payload, answer, trace=None):
+    record = {"mode": "semantic", "query": query, "model": payload["model"]}
+    record.update(trace or {})
+    record.update(prompt=prompt, answer=answer)
+    get_query_log(HISTORY_DIR).log(record)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Semantic offline RAG REPL")
+    parser.add_argument("--session", action="store_true", help="keep follow-up questions in one conversation")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    apply_profiling_args(args)
     ensure_history_dir()
-    index, docs, fnames = load_index_and_metadata()
+    start_metrics_dump(os.path.join(HISTORY_DIR, "metrics.prom"))
+    res = load_resources()
+
+    session = ChatSession(RESPONSE_INSTRUCTION, encoding=ENCODING_NAME) if args.session else None
 
     print("RAG ready.")
     while True:
         query = input("You: ").strip()
         if query.lower() in ("exit","quit"):
             break
+        if query.lower() == "/yeni" and session is not None:
+            session.reset()
+            print("Yeni sohbet başlatıldı.")
+            continue
         try:
-            main_kws = extract_keywords(query)
-            extras   = extract_additional_lists(query)
-            all_kws  = (
-                main_kws
-                + extras['subject'] + extras['predicate']
-                + extras['names']   + extras['multiword']
-                + extras['typos']   + extras['lemmas']
-            )
-            all_kws = list(dict.fromkeys([w.lower() for w in all_kws]))
-            logger.info(f"All retrieval keywords ({len(all_kws)}): {all_kws}")
-            answer, payload, prompt = chat_with_semantic(
-                query, index, docs, fnames, all_kws
-            )
-            print("gem:", answer)
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            with open(os.path.join(HISTORY_DIR, f"{ts}.txt"), "w", encoding="utf-8") as f:
-                f.write(f"Soru: {query}\n\nPrompt:\n{prompt}\n\nPayload:\n")
-                f.write(json.dumps(payload, ensure_ascii=False, indent=2))
-                f.write("\n\nCevap:\n" + answer)
+            printer = TokenPrinter("gem: ") if STREAM_ANSWERS else None
+            trace = {}
+            with profile_section("query"):
+                answer, payload, prompt = answer_query(query, res, printer, trace, session)
+            if printer is not None:
+                printer.finish()
+            else:
+                print("gem:", answer)
+            save_history(query, prompt, payload, answer, trace)
 
         except Exception:
             logger.exception("Error in main loop")
@@ -0,0 +1,82 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from ht_llm_client import GenerationCancelled
+from ht_metrics import registry
+
+SPECULATIVE_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+
+
+class SpeculativeAnswer:
+    # Generates on a guessed context set while the relevance filter runs. Tokens are held
+    # back until commit(), so a wrong guess never reaches the user.
+    def __init__(self, contexts, run):
+        # run(on_token, cancel) -> the same tuple the normal answer path returns
+        self.ids = [c["id"] for c in contexts]
+        self.cancel = threading.Event()
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.sink = None
+        self.visible = False
+        self.shown = False
+        self.outcome = None
+        # copy the context so stage timings and LLM usage land in the current query's stats
+        ctx = contextvars.copy_context()
+        self.future = _executor.submit(ctx.run, run, self._on_token, self.cancel)
+        logger.info(f"Speculative answer started on {len(self.ids)} contexts")
+
+    def _on_token(self, token):
+        with self.lock:
+            if self.sink is None:
+                self.buffer.append(token)
+                return
+            self.shown = self.shown or self.visible
+        self.sink(token)
+
+    def matches(self, contexts) -> bool:
+        return [c["id"] for c in contexts] == self.ids
+
+    def commit(self, on_token=None):
+        # returns None when the caller may still regenerate; raises if the answer failed
+        # after part of it was shown, since a second answer would follow the broken one
+        with self.lock:
+            self.visible = on_token is not None
+            if self.visible:
+                for token in self.buffer:
+                    on_token(token)
+                self.shown = bool(self.buffer)
+            self.buffer = []
+            self.sink = on_token or (lambda token: None)
+        try:
+            result = self.future.result()
+        except Exception:
+            self.outcome = "error"
+            registry.inc("rag_speculative_total", outcome="error")
+            if self.shown:
+                logger.exception("Speculative answer failed after it was partly streamed")
+                raise
+            logger.exception("Speculative answer failed before any token was shown, regenerating")
+            return None
+        self.outcome = "hit"
+        registry.inc("rag_speculative_total", outcome="hit")
+        logger.info("Filter kept the speculative contexts, using the speculative answer")
+        return result
+
+    def abort(self):
+        self.cancel.set()
+        self.future.add_done_callback(_log_failure)
+        if self.outcome is None:
+            self.outcome = "miss"
+            registry.inc("rag_speculative_total", outcome="miss")
+            logger.info("Filter changed the context set, speculative answer cancelled")
+
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None and not isinstance(exc, GenerationCancelled):
+        logger.warning(f"Cancelled speculative answer failed: {exc}")
@@ -0,0 +1,27 @@
+import logging
+from ht_llm_client import PRIORITY_ANSWER, get_client
+
+logger = logging.getLogger(__name__)
+
+
+def stream_chat_completion(base_url, payload: dict, on_token=None, priority=PRIORITY_ANSWER, cancel=None) -> str:
+    answer = get_client(base_url).stream_chat(payload, on_token, priority, cancel)
+    logger.debug(f"Streamed answer len={len(answer)}")
+    return answer
+
+
+class TokenPrinter:
+    # prints the prefix lazily so log lines emitted before the first token stay above it
+    def __init__(self, prefix="gem: "):
+        self.prefix = prefix
+        self.started = False
+
+    def __call__(self, token):
+        if not self.started:
+            print(self.prefix, end="")
+            self.started = True
+        print(token, end="", flush=True)
+
+    def finish(self):
+        if self.started:
+            print()
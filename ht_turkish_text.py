@@ -0,0 +1,170 @@
+import re
+from functools import lru_cache
+
+MIN_STEM_LEN = 3
+GUESS_STEM_LEN = 4
+MAX_STRIP_ROUNDS = 3
+
+VOWELS = set("aeıioöuü")
+BACK_VOWELS = set("aıou")
+HIGH_VOWELS = set("ıiuü")
+VOICELESS = set("çfhkpsşt")
+
+FOLD_TABLE = str.maketrans({"I": "ı", "İ": "i", "Â": "a", "â": "a", "Î": "i", "î": "i", "Û": "u", "û": "u"})
+
+# inflectional suffixes in all vowel-harmony variants, tried longest first
+SUFFIXES = sorted({
+    "lar", "ler",
+    "ımız", "imiz", "umuz", "ümüz", "ınız", "iniz", "unuz", "ünüz",
+    "ları", "leri", "sı", "si", "su", "sü",
+    "ım", "im", "um", "üm", "ın", "in", "un", "ün",
+    "nın", "nin", "nun", "nün",
+    "dan", "den", "tan", "ten", "ndan", "nden",
+    "da", "de", "ta", "te", "nda", "nde",
+    "daki", "deki", "taki", "teki",
+    "ya", "ye", "na", "ne", "yı", "yi", "yu", "yü",
+    "yla", "yle",
+    "dır", "dir", "dur", "dür", "tır", "tir", "tur", "tür",
+    "lık", "lik", "luk", "lük",
+    "mak", "mek", "ması", "mesi", "ma", "me",
+    "ıyor", "iyor", "uyor", "üyor", "yor",
+    "acak", "ecek", "mış", "miş", "muş", "müş",
+    "dı", "di", "du", "dü", "tı", "ti", "tu", "tü",
+    "ı", "i", "u", "ü", "a", "e",
+}, key=len, reverse=True)
+
+SOFTENED = {"b": "p", "c": "ç", "d": "t", "ğ": "k"}
+
+
+def turkish_lower(text: str) -> str:
+    # str.lower() maps "İ" to "i̇" (i + combining dot) and "I" to "i"
+    return text.translate(FOLD_TABLE).lower().replace("̇", "")
+
+
+def tokenize(text: str) -> list[str]:
+    # suffixes after an apostrophe (Ankara'nın) belong to the preceding proper name
+    return re.findall(r"[a-zçğıöşü]+", re.sub(r"['’][a-zçğıöşü]+", "", turkish_lower(text)))
+
+
+def corpus_vocabulary(docs) -> set[str]:
+    vocab = set()
+    for doc in docs:
+        vocab.update(tokenize(doc))
+    return vocab
+
+
+def _last_vowel(word):
+    for ch in reversed(word):
+        if ch in VOWELS:
+            return ch
+    return None
+
+
+def _first_vowel(word):
+    for ch in word:
+        if ch in VOWELS:
+            return ch
+    return None
+
+
+def _can_strip(base, suf):
+    last = _last_vowel(base)
+    if last is None or len(base) < (2 if suf in ("lar", "ler") else MIN_STEM_LEN):
+        return False
+    # vowel harmony: the suffix vowel agrees in backness with the stem
+    if (last in BACK_VOWELS) != (_first_vowel(suf) in BACK_VOWELS):
+        return False
+    # buffer letters and consonant assimilation have to fit the stem ending
+    end, head = base[-1], suf[0]
+    if head in VOWELS:
+        return end not in VOWELS
+    if head in "ysn" and suf != "yor":
+        return end in VOWELS
+    if head in "tç":
+        return end in VOICELESS
+    if head in "dc":
+        return end not in VOICELESS
+    return True
+
+
+def _harden(base):
+    # kitab -> kitap, çocuğ -> çocuk, reng -> renk
+    if base[-1] in SOFTENED:
+        return base[:-1] + SOFTENED[base[-1]]
+    if base.endswith("ng"):
+        return base[:-1] + "k"
+    return None
+
+
+class Analyzer:
+    # Stemmer bound to one corpus: stems that rest on a guess are only accepted if they occur
+    # among its word forms. Each pipeline keeps its own, so several can share a process.
+    def __init__(self, vocabulary=()):
+        self.vocabulary = frozenset(vocabulary)
+        self.stem = lru_cache(maxsize=200_000)(self._stem)
+
+    def _attested(self, word):
+        return word in self.vocabulary if self.vocabulary else len(word) >= GUESS_STEM_LEN
+
+    def _strip_vowel_suffix(self, base, suf):
+        # a vowel-initial "suffix" may just be the end of the root (araba, masa, kadın), so the
+        # result is a guess; -ı/-i/-u/-ü after a softened consonant also restores the hard one
+        if len(suf) == 1 and suf not in HIGH_VOWELS and not self.vocabulary:
+            return None
+        if suf[0] in HIGH_VOWELS and len(base) >= GUESS_STEM_LEN:
+            hard = _harden(base)
+            if hard and self._attested(hard):
+                return hard
+        return base
+
+    def _stem(self, word: str) -> str:
+        best, guessed = word, False
+        for _ in range(MAX_STRIP_ROUNDS):
+            for suf in SUFFIXES:
+                base = word[:-len(suf)]
+                if not word.endswith(suf) or not _can_strip(base, suf):
+                    continue
+                if suf[0] in VOWELS:
+                    base = self._strip_vowel_suffix(base, suf)
+                    if base is None:
+                        continue
+                    guessed = True
+                word = base
+                break
+            else:
+                break
+            # everything stripped after a guess still rests on it
+            if not guessed or self._attested(word):
+                best = word
+        return best
+
+    def analyze(self, text: str) -> list[str]:
+        return [self.stem(tok) for tok in tokenize(text)]
+
+    def lemmas(self, text: str, stop=()) -> list[str]:
+        return list(dict.fromkeys(self.stem(tok) for tok in tokenize(text) if tok not in stop))
+
+    @classmethod
+    def for_corpus(cls, docs):
+        return cls(corpus_vocabulary(docs))
+
+
+# without a corpus vocabulary: bare -a/-e are kept and guessed stems need GUESS_STEM_LEN letters
+DEFAULT_ANALYZER = Analyzer()
+
+
+def stem(word: str, analyzer=None) -> str:
+    return (analyzer or DEFAULT_ANALYZER).stem(word)
+
+
+def analyze(text: str, analyzer=None) -> list[str]:
+    return (analyzer or DEFAULT_ANALYZER).analyze(text)
+
+
+def lemmas(text: str, stop=(), analyzer=None) -> list[str]:
+    return (analyzer or DEFAULT_ANALYZER).lemmas(text, stop)
+
+
+def word_pairs(text: str, stop=()) -> list[str]:
+    toks = [tok for tok in tokenize(text) if tok not in stop]
+    return [f"{a} {b}" for a, b in zip(toks, toks[1:])]
@@ -0,0 +1,102 @@
+import logging
+from collections import Counter
+from ht_turkish_text import stem, tokenize
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LEN        = 7
+MIN_TERM_LEN      = 4
+MIN_TERM_COUNT    = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _deletes(word, max_edit):
+    out = {word}
+    frontier = {word}
+    for _ in range(max_edit):
+        nxt = set()
+        for w in frontier:
+            if len(w) <= 1:
+                continue
+            for i in range(len(w)):
+                nxt.add(w[:i] + w[i + 1:])
+        out |= nxt
+        frontier = nxt
+    return out
+
+
+def edit_distance(a: str, b: str, max_dist: int) -> int:
+    # optimal string alignment (Damerau-Levenshtein with adjacent transpositions)
+    if abs(len(a) - len(b)) > max_dist:
+        return max_dist + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_dist:
+            return max_dist + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def build_typo_index(docs, max_edit=MAX_EDIT_DISTANCE, analyzer=None):
+    counts = Counter()
+    for doc in docs:
+        counts.update(tokenize(doc))
+    vocab = {t: c for t, c in counts.items() if c >= MIN_TERM_COUNT}
+    deletes = {}
+    for term in vocab:
+        if len(term) < MIN_TERM_LEN:
+            continue
+        for d in _deletes(term[:PREFIX_LEN], max_edit):
+            deletes.setdefault(d, []).append(term)
+    stems = {stem(t, analyzer) for t in vocab}
+    logger.info(f"Built typo index ({len(vocab)} terms, {len(deletes)} delete keys)")
+    return {"vocab": vocab, "stems": stems, "deletes": deletes, "max_edit": max_edit}
+
+
+def correct_term(term: str, tindex) -> str | None:
+    vocab = tindex["vocab"]
+    if term in vocab or len(term) < MIN_TERM_LEN:
+        return term if term in vocab else None
+    max_edit = tindex["max_edit"]
+    best, best_key = None, None
+    seen = set()
+    for d in _deletes(term[:PREFIX_LEN], max_edit):
+        for cand in tindex["deletes"].get(d, ()):
+            if cand in seen:
+                continue
+            seen.add(cand)
+            dist = edit_distance(term, cand, max_edit)
+            if dist > max_edit:
+                continue
+            key = (dist, -vocab[cand])
+            if best_key is None or key < best_key:
+                best, best_key = cand, key
+    return best
+
+
+def correct_query(query: str, tindex, stop=(), analyzer=None) -> list[str]:
+    vocab = tindex["vocab"]
+    tokens = [t for t in tokenize(query) if t not in stop]
+    fixes = []
+    # accidentally split compounds: "hane halkı" -> "hanehalkı"
+    for a, b in zip(tokens, tokens[1:]):
+        joined = a + b
+        if joined in vocab and vocab[joined] >= min(vocab.get(a, 0), vocab.get(b, 0)):
+            fixes.append(joined)
+    for tok in tokens:
+        # inflected forms of known words are not typos
+        if tok in vocab or stem(tok, analyzer) in tindex["stems"]:
+            continue
+        fixed = correct_term(tok, tindex)
+        if fixed and fixed != tok:
+            fixes.append(fixed)
+    fixes = list(dict.fromkeys(fixes))
+    logger.info(f"Typo corrections: {fixes}")
+    return fixes
@@ -0,0 +1,40 @@
+import pytest
+import ht_chat_session as cs
+
+MAX_CONTEXT_TOKENS = 4000
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # one token per word keeps the budgets readable and needs no BPE download
+    monkeypatch.setattr(cs.tiktoken, "get_encoding", lambda name: WordEncoding())
+
+
+def test_follow_up_keeps_previous_turn():
+    session = cs.ChatSession("sistem talimatı")
+    session.add("Ankara nerede? " + "bağlam " * 100, "Ankara İç Anadolu'dadır.")
+    # trim_prompt fills the whole context budget with the new retrieved contexts
+    prompt = "bağlam " * (MAX_CONTEXT_TOKENS - 3) + "Başkent neresi?"
+    msgs = session.messages(prompt)
+    assert [m["role"] for m in msgs] == ["system", "user", "assistant", "user"]
+    assert msgs[2]["content"] == "Ankara İç Anadolu'dadır."
+
+
+def test_history_over_budget_drops_oldest_turn():
+    session = cs.ChatSession("sistem", max_tokens=30)
+    session.add("ilk " * 20, "cevap " * 10)
+    session.add("ikinci " * 5, "cevap " * 5)
+    msgs = session.messages("yeni soru")
+    assert [m["content"] for m in msgs[1:-1]] == ["ikinci " * 5, "cevap " * 5]
+
+
+def test_num_ctx_counts_history_budget():
+    session = cs.ChatSession("sistem")
+    without = cs.context_options(MAX_CONTEXT_TOKENS, 2000)["num_ctx"]
+    with_history = cs.context_options(MAX_CONTEXT_TOKENS, 2000, session.max_tokens)["num_ctx"]
+    assert with_history - without == cs.SESSION_MAX_TOKENS
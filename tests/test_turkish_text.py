@@ -0,0 +1,78 @@
+import pytest
+import ht_turkish_text as tt
+
+CORPUS = [
+    "Araba kadın masa Ankara kitap çocuk renk ev ağaç arap",
+    "Kitabı masada bıraktı, çocuğu arabaya bindirdi.",
+]
+
+
+@pytest.fixture
+def analyzer():
+    return tt.Analyzer(tt.corpus_vocabulary(CORPUS))
+
+
+@pytest.mark.parametrize("word", ["araba", "kadın", "masa", "ankara"])
+def test_root_final_vowel_is_kept(word):
+    assert tt.stem(word) == word
+
+
+@pytest.mark.parametrize("word", ["araba", "kadın", "masa", "ankara"])
+def test_root_final_vowel_is_kept_with_vocabulary(analyzer, word):
+    assert analyzer.stem(word) == word
+
+
+def test_unrelated_words_do_not_merge(analyzer):
+    assert analyzer.stem("araba") != analyzer.stem("arap")
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("kitabı", "kitap"),
+    ("çocuğu", "çocuk"),
+    ("rengi", "renk"),
+    ("ağacı", "ağaç"),
+    ("kitaplar", "kitap"),
+    ("kitaplarını", "kitap"),
+    ("arabalar", "araba"),
+    ("masada", "masa"),
+    ("evlerinde", "ev"),
+])
+def test_inflected_forms(analyzer, word, expected):
+    assert analyzer.stem(word) == expected
+
+
+def test_hardened_stem_must_be_attested(analyzer):
+    # "dolabı" -> "dolap" is plausible, but "dolap" is not in the corpus
+    assert analyzer.stem("dolabı") == "dolabı"
+
+
+def test_analyze_folds_case():
+    assert tt.analyze("ANKARA'nın Kitapları") == ["ankara", "kitap"]
+
+
+def test_pipelines_keep_their_own_vocabulary(tmp_path, monkeypatch):
+    reg = pytest.importorskip("ht_regular_offline_rag")
+    corpora = {
+        "a": {"park.txt": "Çocuk parkta oynuyor. Çocuklar akşam eve döner.",
+              "deniz.txt": "Gemi limandan ayrıldı, deniz sakindi.",
+              "dag.txt": "Dağın zirvesi karla kaplıydı."},
+        "b": {"ankara.txt": "Ankara başkenttir. Kitaplar masada duruyor."},
+    }
+    resources = {}
+    for name, files in corpora.items():
+        data_dir = tmp_path / name
+        data_dir.mkdir()
+        for fname, text in files.items():
+            (data_dir / fname).write_text(text, encoding="utf-8")
+        monkeypatch.setattr(reg, "DATA_DIR", str(data_dir))
+        monkeypatch.setattr(reg, "INDEX_CACHE_DIR", str(tmp_path / f"cache_{name}"))
+        monkeypatch.setattr(reg, "DOC2QUERY_PATH", str(tmp_path / "missing.jsonl"))
+        monkeypatch.setattr(reg, "EXPANSION_TABLE_PATH", str(tmp_path / "missing.json.gz"))
+        resources[name] = reg.load_resources()
+
+    # loading corpus b must not change how pipeline a stems its queries
+    assert resources["a"]["analyzer"].analyze("çocuğu nerede")[0] == "çocuk"
+    assert resources["b"]["analyzer"].analyze("çocuğu nerede")[0] == "çocuğu"
+    res = resources["a"]
+    hits = reg.retrieve_bm25("çocuğu", res["bm25"], res["docs"], res["fnames"], 1, res["analyzer"])
+    assert hits[0]["file_name"] == "park.txt"